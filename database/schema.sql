@@ -1,3 +1,13 @@
+-- Reference copy of the schema at version 5.
+-- The source of truth is points_bot/migrations.py, which both bots apply at
+-- startup; keep this file in sync when adding a migration.
+
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at DOUBLE PRECISION NOT NULL
+);
+
 CREATE TABLE points (
     user_id BIGINT PRIMARY KEY,
     points INTEGER DEFAULT 0
@@ -10,16 +20,45 @@ CREATE TABLE config (
 
 CREATE TABLE salaries (
     user_id BIGINT PRIMARY KEY,
-    last_salary REAL
+    last_salary DOUBLE PRECISION
 );
 
 CREATE TABLE antifarm (
     user_id BIGINT PRIMARY KEY,
+    -- Comma-separated hex simhashes of recent messages, never the text.
     last_msg TEXT,
-    last_time REAL
+    last_time DOUBLE PRECISION
 );
 
 CREATE TABLE cooldowns (
     user_id BIGINT PRIMARY KEY,
-    last_message REAL
+    last_message DOUBLE PRECISION
+);
+
+CREATE TABLE blacklist (
+    user_id BIGINT PRIMARY KEY,
+    reason TEXT,
+    end_date DOUBLE PRECISION
 );
+
+-- Append-only history of point changes; `points` is a snapshot of every
+-- entry up to ledger_watermark.last_id. (SQLite: INTEGER PRIMARY KEY AUTOINCREMENT.)
+CREATE TABLE points_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    delta INTEGER NOT NULL,
+    reason TEXT,
+    source TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE TABLE ledger_watermark (
+    id INTEGER PRIMARY KEY,
+    last_id BIGINT NOT NULL,
+    compacted_at DOUBLE PRECISION
+);
+
+CREATE INDEX idx_points_points ON points (points, user_id);
+CREATE INDEX idx_blacklist_end_date ON blacklist (end_date);
+CREATE INDEX idx_ledger_user_id ON points_ledger (user_id, id);
+CREATE INDEX idx_ledger_user_time ON points_ledger (user_id, created_at);
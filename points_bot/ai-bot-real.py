@@ -9,6 +9,9 @@ import sqlite3
 import psycopg2
 from datetime import datetime
 import logging
+from storage import Database, SQLITE_PATH
+from migrations import migrate, LATEST_VERSION
+from backup import backup_sqlite, BACKUP_DIR, BACKUP_KEEP
 
 logging.basicConfig(level=logging.INFO)
 
@@ -25,7 +28,24 @@ bot = commands.Bot(
 AI_ADMIN_IDS = {739749692308586526, 1020294577153908766}
 
 MAIN_BOT_PATH = os.path.join(os.path.dirname(__file__), "..", "bot.py")
-DB_PATH = os.path.join(os.path.dirname(__file__), "..", "system.db")
+DB_PATH = SQLITE_PATH
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+async def run_migrations():
+    """يحدّث مخطط قاعدة البيانات لآخر نسخة"""
+    db = Database(DATABASE_URL)
+    await db.connect()
+    try:
+        return await migrate(db)
+    finally:
+        await db.close()
+
+@bot.event
+async def setup_hook():
+    try:
+        await run_migrations()
+    except Exception as e:
+        logging.error(f"Schema migration failed: {e}")
 
 @bot.event
 async def on_ready():
@@ -157,38 +177,13 @@ async def fixdb(ctx):
     msg = await ctx.send("🔧 جاري إصلاح قاعدة البيانات...")
     
     try:
-        db = sqlite3.connect(DB_PATH)
-        c = db.cursor()
-        
-        # إنشاء الجداول الأساسية
-        tables_created = []
-        
-        c.execute("""CREATE TABLE IF NOT EXISTS points 
-                    (user_id BIGINT PRIMARY KEY, points INTEGER DEFAULT 0)""")
-        tables_created.append("points")
-        
-        c.execute("""CREATE TABLE IF NOT EXISTS config 
-                    (guild_id BIGINT PRIMARY KEY, points_channel BIGINT)""")
-        tables_created.append("config")
-        
-        c.execute("""CREATE TABLE IF NOT EXISTS salaries 
-                    (user_id BIGINT PRIMARY KEY, last_salary REAL)""")
-        tables_created.append("salaries")
-        
-        c.execute("""CREATE TABLE IF NOT EXISTS antifarm 
-                    (user_id BIGINT PRIMARY KEY, last_msg TEXT, last_time REAL)""")
-        tables_created.append("antifarm")
-        
-        c.execute("""CREATE TABLE IF NOT EXISTS cooldowns 
-                    (user_id BIGINT PRIMARY KEY, last_message REAL)""")
-        tables_created.append("cooldowns")
-        
-        db.commit()
-        db.close()
+        # نفس المخطط الذي يستخدمه البوت الأساسي (migrations.py)
+        applied = await run_migrations()
         
         embed = discord.Embed(title="✅ تم إصلاح قاعدة البيانات", color=0x00FF00)
-        embed.add_field(name="الجداول", value="\n".join(f"✅ {t}" for t in tables_created), inline=False)
-        embed.add_field(name="الموقع", value=f"`{DB_PATH}`", inline=False)
+        embed.add_field(name="نسخة المخطط", value=f"v{LATEST_VERSION}", inline=False)
+        embed.add_field(name="التحديثات المطبقة", value="\n".join(f"✅ v{n} — {d}" for n, d in applied) if applied else "المخطط محدث بالفعل", inline=False)
+        embed.add_field(name="الموقع", value=f"`{DB_PATH}`" if not DATABASE_URL else "PostgreSQL", inline=False)
         
         await msg.edit(content=None, embed=embed)
         
@@ -280,22 +275,20 @@ async def backup(ctx):
     msg = await ctx.send("💾 جاري إنشاء نسخة احتياطية...")
     
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(os.path.dirname(__file__), "..", "backups")
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        files_backed = []
-        
-        # نسخ قاعدة البيانات
-        if os.path.exists(DB_PATH):
-            backup_db = os.path.join(backup_dir, f"system_{timestamp}.db")
-            import shutil
-            shutil.copy2(DB_PATH, backup_db)
-            files_backed.append(f"✅ system.db → {os.path.basename(backup_db)}")
-        
+        if not os.path.exists(DB_PATH):
+            return await msg.edit(content="❌ لا توجد قاعدة بيانات SQLite للنسخ")
+
+        # Online backup API: consistent even while the main bot is writing.
+        result = await backup_sqlite(DB_PATH)
+
         embed = discord.Embed(title="💾 نسخة احتياطية", color=0x00FF00)
-        embed.add_field(name="الملفات", value="\n".join(files_backed) if files_backed else "لا توجد ملفات", inline=False)
-        embed.add_field(name="المجلد", value=f"`{backup_dir}`", inline=False)
+        embed.add_field(name="الملف", value=f"✅ system.db → {os.path.basename(result.path)}", inline=False)
+        embed.add_field(name="⏱️ المدة", value=f"{result.seconds:.2f}s", inline=True)
+        embed.add_field(name="📦 الحجم", value=f"{result.size / 1024:,.1f} KB (من {result.raw_size / 1024:,.1f} KB)", inline=True)
+        embed.add_field(name="🔍 الفحص", value=f"integrity_check: ok · {result.pages} صفحة", inline=True)
+        if result.removed:
+            embed.add_field(name="🗑️ حذف القديم", value="\n".join(result.removed), inline=False)
+        embed.add_field(name="المجلد", value=f"`{BACKUP_DIR}` (آخر {BACKUP_KEEP} نسخ)", inline=False)
         embed.timestamp = datetime.utcnow()
         
         await msg.edit(content="✅ تمت النسخة الاحتياطية", embed=embed)
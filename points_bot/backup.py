@@ -0,0 +1,109 @@
+"""Online, compressed backups of the SQLite database.
+
+Copies go through SQLite's backup API a few hundred pages at a time, so the
+live database is only locked for one step at a time and a concurrent write
+never produces a torn copy. A write from another connection restarts the
+copy; if that keeps happening it is redone in a single step, which under WAL
+only needs a read snapshot. The work runs on a worker thread, leaving the
+bot's event loop free. Each copy is checked with `PRAGMA integrity_check`
+before it is gzipped, and only the newest `BACKUP_KEEP` archives are kept.
+"""
+import asyncio
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from storage import SQLITE_PATH
+
+BACKUP_DIR = os.path.join(os.path.dirname(__file__), '..', 'backups')
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", 256))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))
+# Pause between steps; lets writers in other connections take the lock.
+BACKUP_STEP_SLEEP = 0.005
+# Restarts caused by concurrent writes before falling back to one step.
+BACKUP_MAX_RESTARTS = 3
+
+
+class BackupError(Exception):
+    """The copy failed its integrity check and was discarded."""
+
+
+class _Restarted(Exception):
+    pass
+
+
+class BackupResult:
+    def __init__(self, path, size, raw_size, pages, seconds, removed):
+        self.path = path
+        self.size = size
+        self.raw_size = raw_size
+        self.pages = pages
+        self.seconds = seconds
+        self.removed = removed
+
+
+def _copy(source_path, target_path, pages_per_step):
+    """Blocking part: page-stepped copy plus integrity check. Returns total pages."""
+    progress = {"pages": 0, "remaining": None, "restarts": 0}
+
+    def on_step(status, remaining, total):
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            progress["restarts"] += 1
+            if progress["restarts"] > BACKUP_MAX_RESTARTS:
+                # Raising from the callback aborts the backup.
+                raise _Restarted()
+        progress["pages"], progress["remaining"] = total, remaining
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages_per_step, progress=on_step, sleep=BACKUP_STEP_SLEEP)
+        except _Restarted:
+            source.backup(target, pages=-1)
+            progress["pages"] = target.execute("PRAGMA page_count").fetchone()[0]
+        result = target.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise BackupError(f"integrity_check: {result}")
+    finally:
+        target.close()
+        source.close()
+    return progress["pages"]
+
+
+def _compress(path, archive):
+    with open(path, "rb") as raw, gzip.open(archive, "wb", compresslevel=6) as packed:
+        shutil.copyfileobj(raw, packed, 1024 * 1024)
+
+
+def rotate(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Deletes all but the newest `keep` archives; returns the removed names."""
+    archives = sorted(glob.glob(os.path.join(backup_dir, "system_*.db.gz")))
+    removed = archives[:-keep] if keep > 0 else archives
+    for path in removed:
+        os.remove(path)
+    return [os.path.basename(path) for path in removed]
+
+
+async def backup_sqlite(source_path=SQLITE_PATH, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, pages_per_step=BACKUP_PAGES_PER_STEP):
+    """Writes system_<timestamp>.db.gz to `backup_dir` and applies the retention policy."""
+    started = time.monotonic()
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    partial = os.path.join(backup_dir, f"system_{timestamp}.db.partial")
+    archive = os.path.join(backup_dir, f"system_{timestamp}.db.gz")
+    try:
+        pages = await asyncio.to_thread(_copy, source_path, partial, pages_per_step)
+        raw_size = os.path.getsize(partial)
+        await asyncio.to_thread(_compress, partial, archive + ".partial")
+        os.replace(archive + ".partial", archive)
+    finally:
+        for leftover in (partial, archive + ".partial"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    removed = rotate(backup_dir, keep)
+    return BackupResult(archive, os.path.getsize(archive), raw_size, pages, time.monotonic() - started, removed)
@@ -1,17 +1,36 @@
 import discord
 from discord.ext import commands, tasks
-import sqlite3
 import time
 import os
 import logging
 import json
 import random
 import asyncio
+import gc
+import math
+from collections import deque
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-import psycopg2
-import psycopg2.extras
 from flask import Flask
 from threading import Thread
+from storage import Database
+from points_buffer import PointsBuffer
+import repository
+from migrations import migrate
+from leaderboard import Leaderboard
+from scheduler import Scheduler
+from ttl_store import TTLStore
+from fingerprint import simhash, near_duplicate
+from ingest import ChatEvent, IngestPipeline
+from tiers import TierTable
+from log_dispatcher import LogDispatcher
+from channel_index import ChannelIndex
+from permissions import Permissions
+from member_cache import MemberLRU
+from shards import for_each_shard, shard_latencies
+from cluster_client import ClusterClient
+import payroll
+from live_migration import LiveMigration, finish_migration
 
 app = Flask('')
 
@@ -39,6 +58,60 @@ PREFIX = "-"
 LOG_CHANNEL_NAME = "staff・اللوقات・⦏👮🏻⦐"
 DATABASE_URL = os.getenv("DATABASE_URL")
 DB_TYPE = "postgres" if DATABASE_URL else "sqlite"
+# PostgreSQL connection pool size and per-statement timeout (seconds).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", 5))
+# SQLite pragma set: "safe" (rollback journal), "balanced" (WAL, default) or "fast".
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "balanced")
+# Rows per -top page.
+TOP_PAGE_SIZE = 10
+# Chat points are written behind: flushed every N seconds or once this many users are pending.
+POINTS_FLUSH_INTERVAL = float(os.getenv("POINTS_FLUSH_INTERVAL", 5))
+POINTS_FLUSH_MAX_PENDING = int(os.getenv("POINTS_FLUSH_MAX_PENDING", 500))
+# PostgreSQL database that -migratepg copies the live SQLite database into.
+MIGRATION_TARGET_URL = os.getenv("MIGRATION_TARGET_URL")
+# Seconds between folding the points ledger into the points snapshot.
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", 60))
+# Anti-farm and chat cooldown state lives in memory; set this to snapshot it
+# to the database every N seconds (0 disables persistence).
+CHAT_STATE_SNAPSHOT_INTERVAL = float(os.getenv("CHAT_STATE_SNAPSHOT_INTERVAL", 0))
+# Chat point accounting workers (messages are sharded by user id), queued
+# events per worker before new ones are dropped, and events per batch.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 1000))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 100))
+# Log embeds are queued and sent in batches every N seconds, optionally through
+# a per-channel webhook (needs Manage Webhooks) for a separate rate limit.
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 2))
+LOG_USE_WEBHOOKS = os.getenv("LOG_USE_WEBHOOKS", "").lower() in ("1", "true", "yes")
+# Low-memory mode for large guilds on small hosts: no member cache and no
+# member chunking at startup, a message cache of LOW_MEMORY_MAX_MESSAGES (0 =
+# none), and members looked up on demand through an LRU of MEMBER_LRU_SIZE.
+# Member update events are not delivered without the cache, so new staff are
+# paid at the next payroll run (at most LOW_MEMORY_PAYROLL_INTERVAL away)
+# instead of right away.
+LOW_MEMORY = os.getenv("LOW_MEMORY", "").lower() in ("1", "true", "yes")
+LOW_MEMORY_MAX_MESSAGES = int(os.getenv("LOW_MEMORY_MAX_MESSAGES", 0))
+MEMBER_LRU_SIZE = int(os.getenv("MEMBER_LRU_SIZE", 1000))
+# Minimum seconds between payroll runs in low-memory mode.
+LOW_MEMORY_PAYROLL_INTERVAL = float(os.getenv("LOW_MEMORY_PAYROLL_INTERVAL", 3600))
+# In low-memory mode -top @role downloads the guild's member list: a guild is
+# downloaded at most once per this many seconds and each role's result is
+# reused for as long.
+LOW_MEMORY_ROLE_TOP_TTL = float(os.getenv("LOW_MEMORY_ROLE_TOP_TTL", 300))
+# Gateway sharding: unset keeps a single connection, "auto" runs Discord's
+# recommended number of shards, a number runs that many. Guild-wide jobs
+# work through each shard's guilds concurrently and give up on a shard after
+# SHARD_JOB_TIMEOUT seconds (its guilds are retried on the next run).
+SHARD_COUNT = os.getenv("SHARD_COUNT", "").strip().lower()
+SHARDED = SHARD_COUNT not in ("", "0", "1")
+SHARD_JOB_TIMEOUT = float(os.getenv("SHARD_JOB_TIMEOUT", 120))
+# Set by cluster.py for each worker process: the shards this process runs
+# (out of SHARD_COUNT) and the coordinator it reports to.
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()]
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", 0))
+CLUSTER_COORDINATOR = os.getenv("CLUSTER_COORDINATOR")
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET")
 
 
 # Logging setup
@@ -49,43 +122,86 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(
+class PointsBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    async def setup_hook(self):
+        # Runs once before the gateway connects, unlike on_ready.
+        await cluster.start()
+        await init_db()
+        await load_leaderboard()
+        if CHAT_STATE_SNAPSHOT_INTERVAL > 0 and db.connected:
+            await load_chat_state()
+        points_buffer.start()
+        ingest.start()
+        log_dispatcher.start()
+
+    async def close(self):
+        # Logs need the HTTP session, so producers stop and the queue is sent first.
+        await scheduler.stop()
+        await ingest.stop()
+        await log_dispatcher.stop()
+        await super().close()
+        await points_buffer.stop()
+        if CHAT_STATE_SNAPSHOT_INTERVAL > 0:
+            await save_chat_state()
+        await db.close()
+        await cluster.stop()
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        if not cluster.clustered:
+            return await super().before_identify_hook(shard_id, initial=initial)
+        # Discord allows one IDENTIFY per 5 seconds across every process.
+        token = await cluster.acquire("identify")
+        asyncio.get_running_loop().call_later(5, cluster.release, "identify", token)
+
+cache_options = {}
+if LOW_MEMORY:
+    cache_options = dict(
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False,
+        max_messages=LOW_MEMORY_MAX_MESSAGES or None,
+    )
+
+if SHARDED:
+    cache_options["shard_count"] = None if SHARD_COUNT == "auto" else int(SHARD_COUNT)
+    if SHARD_IDS:
+        cache_options["shard_ids"] = SHARD_IDS
+
+bot = PointsBot(
     command_prefix=PREFIX,
     intents=intents,
-    help_command=None
+    help_command=None,
+    **cache_options
 )
 
 # ============================================================ 
 # DATABASE SETUP
 # ============================================================ 
-db = None
-c = None
-
-def init_db():
+# All queries go through the async storage layer so a slow commit never
+# stalls the gateway heartbeat.
+db = Database(DATABASE_URL, pool_size=DB_POOL_SIZE, statement_timeout=DB_STATEMENT_TIMEOUT, sqlite_profile=SQLITE_PROFILE)
+points_buffer = PointsBuffer(db, POINTS_FLUSH_INTERVAL, POINTS_FLUSH_MAX_PENDING, LEDGER_COMPACT_INTERVAL)
+# Blacklist expiries and salary payouts, each fired at its due time.
+scheduler = Scheduler()
+log_dispatcher = LogDispatcher(LOG_FLUSH_INTERVAL, use_webhooks=LOG_USE_WEBHOOKS)
+
+async def init_db():
     """Initializes the database connection."""
-    global db, c
-    if DB_TYPE == "postgres":
+    await db.connect()
+    if not db.connected:
+        return
+    # Same schema on SQLite and Postgres; see migrations.py.
+    try:
+        await migrate(db)
+    except Exception as e:
+        logging.error(f"Schema migration failed: {e}")
+    if db.dialect == "postgres":
+        # First start after -migratepg: apply SQLite writes made since it verified.
+        # One worker replays them; the others then find nothing left to finish.
         try:
-            db = psycopg2.connect(DATABASE_URL, sslmode='require')
-            c = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            logging.info("Connected to PostgreSQL database.")
-        except (psycopg2.OperationalError, psycopg2.Error) as e:
-            logging.error(f"Could not connect to PostgreSQL database: {e}")
-            db = None
-            c = None
-    elif DB_TYPE == "sqlite":
-        db = sqlite3.connect("database/system.db")
-        db.row_factory = sqlite3.Row
-        c = db.cursor()
-        logging.info("Connected to SQLite database.")
-        # Create tables if they don't exist for SQLite
-        c.execute("CREATE TABLE IF NOT EXISTS points (user_id BIGINT PRIMARY KEY, points INTEGER DEFAULT 0)")
-        c.execute("CREATE TABLE IF NOT EXISTS config (guild_id BIGINT PRIMARY KEY, points_channel BIGINT)")
-        c.execute("CREATE TABLE IF NOT EXISTS salaries (user_id BIGINT PRIMARY KEY, last_salary REAL)")
-        c.execute("CREATE TABLE IF NOT EXISTS antifarm (user_id BIGINT PRIMARY KEY, last_msg TEXT, last_time REAL)")
-        c.execute("CREATE TABLE IF NOT EXISTS cooldowns (user_id BIGINT PRIMARY KEY, last_message REAL)")
-        c.execute("CREATE TABLE IF NOT EXISTS blacklist (user_id BIGINT PRIMARY KEY, reason TEXT, end_date REAL)")
-        db.commit()
+            async with cluster.lock("migration"):
+                await finish_migration(db.sqlite_path, db)
+        except Exception as e:
+            logging.error(f"Finishing the SQLite migration failed: {e}")
 
 # ============================================================ 
 # SETTINGS & IN-MEMORY DATA
@@ -139,15 +255,26 @@ NEWS_CHANNEL_NAME = "الاخبار"
 POINTS_INFO_CHANNEL_NAME = "البوينتات"
 
 
-AUTO_ROLES = {xp: role_id for role_id, xp in XP_FOR_ROLES.items()}
+# Level roles by points threshold; shared by check_auto_roles and -level.
+TIERS = TierTable(XP_FOR_ROLES)
 
 STAFF_SALARIES = {1092398849299058736: 150, 1286654124527456317: 130, 1371504049115107450: 120, 1286656850871451688: 110, 1293197081997086805: 100, 1092398849684938873: 75, 1433749601529233408: 65, 1433749606633832499: 45}
 
 PROTECTED_IDS = {739749692308586526, 1020294577153908766}
 
+# Admin / staff / protected checks with a cached verdict per member.
+# Verdicts are not cached in low-memory mode; nothing would invalidate them.
+permissions = Permissions(ADMIN_ROLES, STAFF_SALARIES, PROTECTED_IDS, cache=not LOW_MEMORY)
+
 
 POINTS_PER_MESSAGE = 1
 CHAT_COOLDOWN = 30  # seconds
+# Anti-farm: a message within SPAM_MAX_DISTANCE bits (of 64) of one of the
+# user's last SPAM_HISTORY message fingerprints earns nothing. A user's
+# history is forgotten after SPAM_WINDOW seconds of silence.
+SPAM_HISTORY = 5
+SPAM_MAX_DISTANCE = 10
+SPAM_WINDOW = 600
 DAILY_MIN = 20
 DAILY_MAX = 200
 DAILY_COOLDOWN = 86400  # 24h
@@ -155,6 +282,36 @@ SALARY_COOLDOWN = 86400 # 24h
 
 # In-memory stores
 daily_claims = {}
+# Text channels by name, per guild; see the channel events below.
+channel_index = ChannelIndex()
+# Latest (member, points) waiting for an auto-role edit, and members with an edit in flight.
+pending_tiers = {}
+tier_edits = set()
+# Ordered copy of the points table; -top and -rank read from here.
+leaderboard = Leaderboard()
+# (recent message fingerprints, last message time) per user for the anti-farm
+# check, and when each user last earned chat points.
+recent_messages = TTLStore(SPAM_WINDOW)
+chat_cooldowns = TTLStore(CHAT_COOLDOWN)
+# Low-memory -top @role: (guild id, role id) -> [(user id, display name)],
+# and guild id -> time of its last member download.
+role_top_members = TTLStore(LOW_MEMORY_ROLE_TOP_TTL)
+member_downloads = TTLStore(LOW_MEMORY_ROLE_TOP_TTL)
+# Members shown by -top and -rank when the member cache is off.
+member_lru = MemberLRU(MEMBER_LRU_SIZE)
+# Coordinator link in cluster mode (locks, broadcasts, health); standalone otherwise.
+cluster = ClusterClient(
+    CLUSTER_COORDINATOR, CLUSTER_ID, CLUSTER_SECRET,
+    health=lambda: worker_health(),
+    on_lost=lambda: asyncio.create_task(bot.close()),
+)
+# Users whose totals another worker changed, waiting to be re-read.
+remote_point_changes = set()
+# Seconds to collect such changes before re-reading them in one query.
+REMOTE_POINTS_DELAY = 1.0
+# Startup timing for the ready log and -status.
+STARTED_AT = time.monotonic()
+ready_after = None
 
 # ============================================================ 
 # HELPER FUNCTIONS
@@ -162,81 +319,234 @@ daily_claims = {}
 
 def is_admin(member: discord.Member) -> bool:
     # Unified admin check
-    return member.guild_permissions.administrator or any(role.id in ADMIN_ROLES for role in member.roles)
+    return permissions.is_admin(member)
+
+async def display_names(guild, user_ids) -> dict:
+    """{user_id: display name} for the ids still in `guild`."""
+    members = await member_lru.resolve(guild, user_ids)
+    return {user_id: member.display_name for user_id, member in members.items()}
+
+async def guild_members(guild) -> list:
+    """Every member of `guild`; fetched without caching them in low-memory mode."""
+    if not LOW_MEMORY:
+        return guild.members
+    return await guild.chunk(cache=False)
+
+async def role_members(guild, role):
+    """[(user_id, display name)] for the members of `role`, or None while the
+    guild's member list was downloaded too recently (low-memory mode only)."""
+    if not LOW_MEMORY:
+        return [(m.id, m.display_name) for m in role.members]
+    members = role_top_members.get((guild.id, role.id))
+    if members is None:
+        if member_downloads.get(guild.id) is not None:
+            return None
+        member_downloads.set(guild.id, time.time())
+        members = [(m.id, m.display_name) for m in await guild_members(guild) if role in m.roles]
+        role_top_members.set((guild.id, role.id), members)
+    return members
+
+def worker_health() -> dict:
+    """This process's health, as reported to the cluster coordinator."""
+    stats = ingest.stats()
+    return {
+        "shards": [shard_id for shard_id, _ in shard_latencies(bot)],
+        "latency_ms": [round(latency * 1000) if math.isfinite(latency) else None for _, latency in shard_latencies(bot)],
+        "guilds": len(bot.guilds),
+        "processed": stats["processed"],
+        "dropped": stats["dropped"],
+        "queued": stats["depth"],
+        "rss": memory_rss(),
+        "database": db.connected,
+        "ready": ready_after is not None,
+    }
+
+def memory_rss() -> int:
+    """Resident set size in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+async def get_points(user_id: int) -> int:
+    if not db.connected: return 0
+    # Includes chat points that are still waiting in the write-behind buffer.
+    return await points_buffer.read_points(user_id)
+
+async def add_points(user_id: int, amount: int, source: str, reason: str = None):
+    """Appends a ledger entry and returns the user's new total (None if skipped)."""
+    if permissions.is_protected(user_id) or not db.connected:
+        return None
+    # Paused so no flush moves this user's pending chat points into the ledger
+    # between reading the stored total and reading the buffer.
+    async with points_buffer.paused():
+        async with db.transaction() as tx:
+            await repository.append_ledger(tx, [(user_id, amount, reason, source, time.time())])
+            stored = await repository.get_points(tx, user_id)
+        total = stored + points_buffer.pending_delta(user_id)
+    leaderboard.set(user_id, total)
+    announce_points([user_id])
+    return total
+
+def announce_points(user_ids):
+    """Tells the other cluster workers to re-read these users' totals."""
+    if cluster.clustered and user_ids:
+        cluster.broadcast("points_changed", {"user_ids": list(user_ids)})
+
+# Chat points become visible to the other workers once they are flushed.
+points_buffer.on_flush = announce_points
+
+@cluster.on("points_changed")
+async def on_cluster_points_changed(data):
+    first = not remote_point_changes
+    remote_point_changes.update(data["user_ids"])
+    if not first:
+        # Already collecting; the pending refresh picks these up.
+        return
+    await asyncio.sleep(REMOTE_POINTS_DELAY)
+    user_ids = [user_id for user_id in remote_point_changes if not permissions.is_protected(user_id)]
+    remote_point_changes.clear()
+    stored, pending = await points_buffer.read_with_pending(lambda: repository.points_for_users(db, user_ids))
+    for user_id in user_ids:
+        leaderboard.set(user_id, stored.get(user_id, 0) + pending.get(user_id, 0))
 
-def get_points(user_id: int) -> int:
-    if not db or not c: return 0
-    
-    query = "SELECT points FROM points WHERE user_id = %s" if DB_TYPE == "postgres" else "SELECT points FROM points WHERE user_id = ?"
-    c.execute(query, (user_id,))
-    row = c.fetchone()
-    return row["points"] if row else 0
-
-def set_points(user_id: int, amount: int):
-    if not db or not c: return
-
-    if DB_TYPE == "postgres":
-        query = "INSERT INTO points (user_id, points) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET points = EXCLUDED.points"
-    else: # sqlite
-        query = "INSERT OR REPLACE INTO points (user_id, points) VALUES (?, ?)" 
-    
-    c.execute(query, (user_id, amount))
-    db.commit()
+async def load_leaderboard():
+    """(Re)seeds the leaderboard from the points table plus unflushed chat points."""
+    if not db.connected: return
 
-def add_points(user_id: int, amount: int):
-    if user_id in PROTECTED_IDS:
-        return
-    set_points(user_id, get_points(user_id) + amount)
+    async def read_totals():
+        return [row async for row in repository.iter_totals(db)]
+
+    leaderboard.begin_resync()
+    try:
+        rows, pending = await points_buffer.read_with_pending(read_totals)
+    except Exception:
+        leaderboard.end_resync()
+        raise
+    totals = dict(rows)
+    for user_id, delta in pending.items():
+        totals[user_id] = totals.get(user_id, 0) + delta
+    for user_id in PROTECTED_IDS:
+        totals.pop(user_id, None)
+    touched = leaderboard.load(totals.items())
+    logging.info(f"Leaderboard loaded with {len(leaderboard)} users")
+
+    if touched:
+        # add_points set these while we were reading; the snapshot may predate their entries.
+        touched = [user_id for user_id in touched if not permissions.is_protected(user_id)]
+        leaderboard.begin_resync()
+        try:
+            stored, pending = await points_buffer.read_with_pending(lambda: repository.points_for_users(db, touched))
+        finally:
+            newer = leaderboard.end_resync()
+        for user_id in touched:
+            if user_id not in newer:
+                leaderboard.set(user_id, stored.get(user_id, 0) + pending.get(user_id, 0))
+        logging.info(f"Leaderboard resync re-read {len(touched)} users updated during the load")
+
+async def load_chat_state():
+    """Restores anti-farm and cooldown entries from the last snapshot."""
+    now = time.time()
+    chat_cooldowns.load((uid, ts, ts) for uid, ts in await repository.live_cooldowns(db, now - chat_cooldowns.ttl))
+    entries = []
+    for uid, fingerprints, ts in await repository.live_antifarm(db, now - recent_messages.ttl):
+        history = deque((int(fp, 16) for fp in (fingerprints or "").split(",") if fp), maxlen=SPAM_HISTORY)
+        entries.append((uid, ts, (history, ts)))
+    recent_messages.load(entries)
+
+async def save_chat_state():
+    """Snapshots the live anti-farm and cooldown entries; expired rows are dropped."""
+    if not db.connected: return
+    async with db.transaction() as tx:
+        await repository.save_chat_state(
+            tx,
+            [(uid, ts) for uid, ts, _ in chat_cooldowns.items()],
+            # Fingerprints only, as comma-separated hex; message text is never stored.
+            [(uid, ",".join(f"{fp:x}" for fp in history), ts) for uid, _, (history, ts) in recent_messages.items()],
+        )
 
 async def send_to_channel_by_name(guild, channel_name, title, description, color=0xFFD700):
     """Sends an embed message to a channel specified by its name."""
     try:
-        channel = discord.utils.get(guild.text_channels, name=channel_name)
+        channel = channel_index.get(guild, channel_name)
         if not channel:
-            logging.warning(f"Channel '{channel_name}' not found in guild {guild.name}")
             return
         embed = discord.Embed(title=title, description=description, color=color, timestamp=discord.utils.utcnow())
         await channel.send(embed=embed)
     except Exception as e:
         logging.error(f"Failed to send message to channel '{channel_name}': {e}")
 
-async def send_log(guild, title, description, color=0xFFD700):
-    """Sends a log message to the predefined log channel."""
-    await send_to_channel_by_name(guild, LOG_CHANNEL_NAME, title, description, color)
+def send_log(guild, title, description, color=0xFFD700, channel_name=LOG_CHANNEL_NAME):
+    """Queues a log embed for the log channel; log_dispatcher sends it in a batch."""
+    channel = channel_index.get(guild, channel_name)
+    if not channel:
+        return
+    embed = discord.Embed(title=title, description=description, color=color, timestamp=discord.utils.utcnow())
+    log_dispatcher.post(channel, embed)
+
+async def check_auto_roles(member, points: int = None, delta: int = None):
+    """Syncs auto roles; pass the total returned by add_points to skip a lookup.
 
-async def check_auto_roles(member):
-    if member.id in PROTECTED_IDS:
+    With `delta` (the change that produced `points`), nothing happens unless
+    the change crossed a tier threshold.
+    """
+    if permissions.is_protected(member.id):
+        return
+    if points is None:
+        points = await get_points(member.id)
+    elif delta is not None and TIERS.same_tier(points - delta, points):
         return
-    points = get_points(member.id)
-    eligible_role_id = None
 
-    for req_points, role_id in sorted(AUTO_ROLES.items(), reverse=True):
-        if points >= req_points:
-            eligible_role_id = role_id
-            break
+    key = (member.guild.id, member.id)
+    pending_tiers[key] = (member, points)
+    if key in tier_edits:
+        # The edit in flight picks up the newest total when it finishes.
+        return
+    tier_edits.add(key)
+    try:
+        while key in pending_tiers:
+            member, points = pending_tiers.pop(key)
+            await apply_auto_role(member, points)
+    finally:
+        tier_edits.discard(key)
 
+async def apply_auto_role(member, points: int):
+    """Moves the member to the tier for `points`, touching only tier roles."""
+    eligible_role_id = TIERS.role_for(points)
     if not eligible_role_id:
         return
 
     role = member.guild.get_role(eligible_role_id)
-    if role and role not in member.roles:
-        try:
-            # Remove other auto roles before adding the new one
-            for rid in AUTO_ROLES.values():
-                if rid != eligible_role_id:
-                    r = member.guild.get_role(rid)
-                    if r and r in member.roles:
-                        await member.remove_roles(r)
-            
-            await member.add_roles(role)
-            await send_log(
+    if not role:
+        return
+    # Per-role add/remove rather than a full roles edit, so roles changed
+    # elsewhere since `member` was cached are left alone.
+    stale = [r for r in member.roles if r.id in TIERS.all_role_ids and r.id != role.id]
+    gained = role not in member.roles
+    if not gained and not stale:
+        return
+    reason = f"Auto role ({points} points)"
+    try:
+        if gained:
+            await member.add_roles(role, reason=reason)
+        if stale:
+            await member.remove_roles(*stale, reason=reason)
+        if gained:
+            send_log(
                 member.guild,
                 "🏅 Auto Role",
                 f"{member.mention} حصل على رتبة **{role.name}** ({points} نقطة)",
                 0x57F287
             )
-        except discord.errors.Forbidden:
-            logging.error(f"Missing 'Manage Roles' permission in guild {member.guild.name} to auto-assign roles.")
+    except discord.errors.Forbidden:
+        logging.error(f"Missing 'Manage Roles' permission in guild {member.guild.name} to auto-assign roles.")
 
 # ============================================================ 
 # EVENTS
@@ -244,16 +554,88 @@ async def check_auto_roles(member):
 
 @bot.event
 async def on_ready():
-    init_db()
+    global ready_after
     logging.info(f'🔥 SYSTEM ONLINE — Logged in as {bot.user}')
     await bot.change_presence(activity=discord.Game(name="إدارة النقاط"))
+    if ready_after is None:
+        ready_after = time.monotonic() - STARTED_AT
+        if LOW_MEMORY:
+            # Startup objects (config, leaderboard, guild state) move out of the
+            # collector's generations, so later collections skip them.
+            gc.collect()
+            gc.freeze()
+        logging.info(f"Ready after {ready_after:.1f}s — RSS {memory_rss() / 2**20:.1f} MiB (low memory: {LOW_MEMORY})")
     
     # Start background tasks
-    if not salary_loop.is_running():
-        salary_loop.start()
-    if not blacklist_check_loop.is_running():
-        blacklist_check_loop.start()
+    if db.connected and not scheduler.running:
+        # Needs the member cache, so it waits for the first on_ready.
+        try:
+            await load_schedule()
+        except Exception as e:
+            logging.error(f"Loading scheduled jobs failed: {e}")
+        scheduler.start()
+    if not leaderboard_sync_loop.is_running():
+        leaderboard_sync_loop.start()
+    if CHAT_STATE_SNAPSHOT_INTERVAL > 0 and not chat_state_snapshot_loop.is_running():
+        chat_state_snapshot_loop.change_interval(seconds=CHAT_STATE_SNAPSHOT_INTERVAL)
+        chat_state_snapshot_loop.start()
+
+
+@bot.event
+async def on_shard_ready(shard_id):
+    logging.info(f"Shard {shard_id} ready ({bot.get_shard(shard_id).latency * 1000:.0f} ms)")
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    logging.warning(f"Shard {shard_id} disconnected")
 
+@bot.event
+async def on_guild_channel_create(channel):
+    channel_index.invalidate(channel.guild)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    channel_index.invalidate(channel.guild)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name or before.position != after.position:
+        channel_index.invalidate(after.guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    channel_index.forget(guild)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.permissions != after.permissions:
+        permissions.invalidate_guild(after.guild)
+
+@bot.event
+async def on_guild_role_delete(role):
+    permissions.invalidate_guild(role.guild)
+
+@bot.event
+async def on_guild_update(before, after):
+    if before.owner_id != after.owner_id:
+        permissions.invalidate_guild(after)
+
+@bot.event
+async def on_member_remove(member):
+    permissions.invalidate_member(member)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles == after.roles:
+        return
+    # The cached verdict still describes `before`; read it before dropping it.
+    salary_roles_before = permissions.salary_role_ids(before)
+    permissions.invalidate_member(after)
+    # A newly hired staff member may be due now; the run only pays whoever is.
+    if not scheduler.running or after.bot or not permissions.is_staff(after):
+        return
+    if permissions.salary_role_ids(after) - salary_roles_before:
+        schedule_payroll(time.time())
 
 @bot.event
 async def on_disconnect():
@@ -273,42 +655,54 @@ async def on_command_error(ctx, error):
 
 @bot.event
 async def on_message(message: discord.Message):
-    if message.author.bot or not db or not c:
+    if message.author.bot or not db.connected:
         return
 
     # First, process commands so they aren't blocked
     await bot.process_commands(message)
 
-    user_id = message.author.id
-    now = time.time()
+    # Chat points are counted by the ingest workers; see process_chat_events.
+    ingest.submit(ChatEvent(message.author, message.content, time.time()))
+
+async def process_chat_events(events):
+    """Anti-farm, cooldown and chat points for a batch of one shard's messages."""
+    # Anti-farm and cooldown checks are served from memory; point deltas
+    # are buffered and committed together by points_buffer.
+    earned = {}
+    for event in events:
+        user_id = event.user_id
+        now = event.created_at
+
+        # ===== Anti-Farm (Spam Protection) =====
+        fingerprint = simhash(event.content)
+        r = recent_messages.get(user_id, now)
+        if r:
+            history, last_time = r
+            # Spam check: too fast, or (nearly) the same as a recent message
+            if (now - last_time) < 2 or near_duplicate(fingerprint, history, SPAM_MAX_DISTANCE):
+                continue # Ignore message for points, but commands still work
+        else:
+            history = deque(maxlen=SPAM_HISTORY)
 
-    # ===== Anti-Farm (Spam Protection) =====
-    query = "SELECT last_msg, last_time FROM antifarm WHERE user_id = %s" if DB_TYPE == "postgres" else "SELECT last_msg, last_time FROM antifarm WHERE user_id = ?"
-    c.execute(query, (user_id,))
-    r = c.fetchone()
-    if r:
-        # Simple spam check: same message or too fast
-        if r["last_msg"] == message.content or (now - r["last_time"]) < 2:
-            return # Ignore message for points, but commands still work
-    
-    if DB_TYPE == "postgres":
-        c.execute("INSERT INTO antifarm (user_id, last_msg, last_time) VALUES (%s,%s,%s) ON CONFLICT (user_id) DO UPDATE SET last_msg = EXCLUDED.last_msg, last_time = EXCLUDED.last_time", (user_id, message.content, now))
-    else: # sqlite
-        c.execute("INSERT OR REPLACE INTO antifarm VALUES (?,?,?)", (user_id, message.content, now))
-    db.commit()
-
-    # ===== Chat Points Cooldown =====
-    query = "SELECT last_message FROM cooldowns WHERE user_id = %s" if DB_TYPE == "postgres" else "SELECT last_message FROM cooldowns WHERE user_id = ?"
-    c.execute(query, (user_id,))
-    r = c.fetchone()
-    if not r or (now - r["last_message"]) >= CHAT_COOLDOWN:
-        add_points(user_id, POINTS_PER_MESSAGE)
-        if DB_TYPE == "postgres":
-            c.execute("INSERT INTO cooldowns (user_id, last_message) VALUES (%s,%s) ON CONFLICT (user_id) DO UPDATE SET last_message = EXCLUDED.last_message", (user_id, now))
-        else: # sqlite
-            c.execute("INSERT OR REPLACE INTO cooldowns VALUES (?,?)", (user_id, now))
-        db.commit()
-        await check_auto_roles(message.author) # Check roles after points change
+        history.append(fingerprint)
+        recent_messages.set(user_id, (history, now), now)
+
+        # ===== Chat Points Cooldown =====
+        last_message = chat_cooldowns.get(user_id, now)
+        if last_message is None or (now - last_message) >= CHAT_COOLDOWN:
+            if not permissions.is_protected(user_id):
+                points_buffer.add_points(user_id, POINTS_PER_MESSAGE)
+                leaderboard.add(user_id, POINTS_PER_MESSAGE)
+                gained = earned[user_id][1] if user_id in earned else 0
+                earned[user_id] = (event.member, gained + POINTS_PER_MESSAGE)
+            chat_cooldowns.set(user_id, now, now)
+
+    # Role API calls come last, once per user, so they never hold up the counting.
+    for user_id, (member, gained) in earned.items():
+        # The leaderboard already includes the new points.
+        await check_auto_roles(member, leaderboard.points(user_id), gained) # Check roles after points change
+
+ingest = IngestPipeline(process_chat_events, INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE)
 
 
 # ============================================================ 
@@ -340,7 +734,8 @@ async def help_command(ctx, category: str = None):
         embed.add_field(name=f"{prefix}points [member]", value="لمعرفة نقاطك أو نقاط عضو آخر.", inline=False)
         embed.add_field(name=f"{prefix}level [member]", value="لعرض مستوى العضو ونقاطه للترقية التالية.", inline=False)
         embed.add_field(name=f"{prefix}daily", value="للحصول على المكافأة اليومية.", inline=False)
-        embed.add_field(name=f"{prefix}top", value="لعرض قائمة أعلى الأعضاء نقاطًا.", inline=False)
+        embed.add_field(name=f"{prefix}top [@role]", value="لعرض قائمة أعلى الأعضاء نقاطًا (أو أعضاء رتبة معينة).", inline=False)
+        embed.add_field(name=f"{prefix}rank [member]", value="لمعرفة ترتيبك ومن حولك في قائمة النقاط.", inline=False)
         embed.add_field(name=f"{prefix}ranks", value="لعرض الرتب والمتطلبات.", inline=False)
         embed.add_field(name=f"{prefix}status", value="للاطلاع على حالة أنظمة البوت.", inline=False)
         
@@ -351,6 +746,8 @@ async def help_command(ctx, category: str = None):
             embed.add_field(name=f"{prefix}blacklist <@user> <days> <reason>", value="إضافة عضو للقائمة السوداء.", inline=False)
             embed.add_field(name=f"{prefix}unblacklist <@user>", value="إزالة عضو من القائمة السوداء.", inline=False)
             embed.add_field(name=f"{prefix}blacklistcheck <@user>", value="التحقق من حالة عضو في القائمة السوداء.", inline=False)
+            embed.add_field(name=f"{prefix}history <@user>", value="عرض آخر عمليات النقاط لعضو.", inline=False)
+            embed.add_field(name=f"{prefix}balanceat <@user> <YYYY-MM-DD>", value="عرض نقاط عضو كما كانت في نهاية يوم معين.", inline=False)
             embed.add_field(name=f"{prefix}announce <#channel> <title> <message>", value="إرسال إعلان عام في قناة معينة.", inline=False)
             embed.add_field(name=f"{prefix}promotion <@user> <@role> <reason>", value=" للإعلان عن ترقية عضو.", inline=False)
             embed.add_field(name=f"{prefix}news <message>", value="لنشر خبر جديد.", inline=False)
@@ -385,27 +782,18 @@ async def help_command(ctx, category: str = None):
 async def points(ctx, member: discord.Member = None):
     """عرض نقاطك أو نقاط عضو آخر"""
     target = member or ctx.author
-    await ctx.send(f"⭐ نقاط {target.display_name}: **{get_points(target.id)}**")
+    await ctx.send(f"⭐ نقاط {target.display_name}: **{await get_points(target.id)}**")
 
 @bot.command(name="level")
 async def level_command(ctx, member: discord.Member = None):
     """يعرض مستوى العضو ونقاطه للترقية التالية"""
     target = member or ctx.author
-    points = get_points(target.id)
+    points = await get_points(target.id)
 
-    sorted_roles = sorted(XP_FOR_ROLES.items(), key=lambda item: item[1])
-    
-    current_role = None
-    next_role = None
-    xp_for_next = 0
-
-    for role_id, xp_req in sorted_roles:
-        if points >= xp_req:
-            current_role = ctx.guild.get_role(role_id)
-        else:
-            next_role = ctx.guild.get_role(role_id)
-            xp_for_next = xp_req
-            break
+    current_role_id = TIERS.role_for(points)
+    current_role = ctx.guild.get_role(current_role_id) if current_role_id else None
+    next_tier = TIERS.next_tier(points)
+    next_role, xp_for_next = (ctx.guild.get_role(next_tier[0]), next_tier[1]) if next_tier else (None, 0)
     
     embed = discord.Embed(title=f"🏆 Level Information for {target.display_name}", color=target.color)
     embed.set_thumbnail(url=target.avatar.url if target.avatar else target.default_avatar.url)
@@ -433,30 +821,30 @@ async def addpoints(ctx, member: discord.Member, amount: int):
     """إضافة نقاط (إداري)"""
     if not is_admin(ctx.author):
         return await ctx.send("❌ ما عندك صلاحية")
-    if member.id in PROTECTED_IDS:
+    if permissions.is_protected(member.id):
         return await ctx.send("❌ لا يمكن تعديل نقاط هذا العضو لأنه محمي.")
     if amount <= 0:
         return await ctx.send("❌ يرجى تحديد رقم موجب.")
 
-    add_points(member.id, amount)
+    total = await add_points(member.id, amount, "addpoints", f"by {ctx.author.id}")
     await ctx.send(f"✅ تم إضافة {amount} نقطة لـ {member.mention}")
-    await send_log(ctx.guild, "➕ Add Points", f"{ctx.author.mention} أضاف {amount} نقطة لـ {member.mention}")
-    await check_auto_roles(member)
+    send_log(ctx.guild, "➕ Add Points", f"{ctx.author.mention} أضاف {amount} نقطة لـ {member.mention}")
+    await check_auto_roles(member, total, amount)
 
 @bot.command()
 async def removepoints(ctx, member: discord.Member, amount: int):
     """خصم نقاط (إداري)"""
     if not is_admin(ctx.author):
         return await ctx.send("❌ ما عندك صلاحية")
-    if member.id in PROTECTED_IDS:
+    if permissions.is_protected(member.id):
         return await ctx.send("❌ لا يمكن تعديل نقاط هذا العضو لأنه محمي.")
     if amount <= 0:
         return await ctx.send("❌ يرجى تحديد رقم موجب.")
 
-    add_points(member.id, -amount)
+    total = await add_points(member.id, -amount, "removepoints", f"by {ctx.author.id}")
     await ctx.send(f"➖ تم خصم {amount} نقطة من {member.mention}")
-    await send_log(ctx.guild, "➖ Remove Points", f"{ctx.author.mention} خصم {amount} نقطة من {member.mention}")
-    await check_auto_roles(member)
+    send_log(ctx.guild, "➖ Remove Points", f"{ctx.author.mention} خصم {amount} نقطة من {member.mention}")
+    await check_auto_roles(member, total, -amount)
     
 @bot.command()
 async def daily(ctx):
@@ -475,28 +863,110 @@ async def daily(ctx):
     elif roll >= 90: reward = random.randint(120, 180)
     else: reward = random.randint(DAILY_MIN, 80)
 
-    add_points(user_id, reward)
+    total = await add_points(user_id, reward, "daily")
     daily_claims[user_id] = now
+    if total is None:
+        total = await get_points(user_id)
     
-    await ctx.send(f"🎁 حصلت على **{reward} نقطة** (ديلي)\n⭐ نقاطك الآن: {get_points(user_id)}")
-    await send_log(ctx.guild, "🎁 Daily Reward", f"{ctx.author.mention} حصل على {reward} نقطة")
-    await check_auto_roles(ctx.author)
+    await ctx.send(f"🎁 حصلت على **{reward} نقطة** (ديلي)\n⭐ نقاطك الآن: {total}")
+    send_log(ctx.guild, "🎁 Daily Reward", f"{ctx.author.mention} حصل على {reward} نقطة")
+    await check_auto_roles(ctx.author, total, reward)
+
+def build_top_embed(rows, names, title="🏆 قائمة أعلى النقاط"):
+    embed = discord.Embed(title=title, color=0x00FFAA)
+    for rank, user_id, pts in rows:
+        name = names.get(user_id) or f"ID: {user_id}"
+        embed.add_field(name=f"#{rank} — {name}", value=f"{pts} نقطة", inline=False)
+    embed.set_footer(text=f"#{rows[0][0]} - #{rows[-1][0]}")
+    return embed
+
+async def top_page_embed(guild, rows):
+    """Rendered page from leaderboard.pages, rebuilt only after a score on it moved."""
+    first_key, last_key = leaderboard.page_bounds(rows, TOP_PAGE_SIZE)
+    embed = leaderboard.pages.get(guild.id, first_key, last_key)
+    if embed is None:
+        embed = build_top_embed(rows, await display_names(guild, [user_id for _, user_id, _ in rows]))
+        leaderboard.pages.put(guild.id, first_key, last_key, embed)
+    return embed
+
+
+class TopView(discord.ui.View):
+    """Next/previous buttons for -top, paging by keyset cursor rather than offset."""
+
+    def __init__(self, author_id, rows):
+        super().__init__(timeout=180)
+        self.author_id = author_id
+        self.rows = rows
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.rows[0][0] == 1
+        self.next_page.disabled = self.rows[-1][0] >= len(leaderboard)
 
-@bot.command()
-async def top(ctx):
-    if not db or not c: return await ctx.send("❌ لا يوجد بيانات")
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ استخدم الأمر بنفسك لتصفح القائمة.", ephemeral=True)
+            return False
+        return True
+
+    async def show(self, interaction, rows):
+        if not rows:
+            return await interaction.response.defer()
+        self.rows = rows
+        self.update_buttons()
+        # A cold member lookup can outlast the 3s interaction deadline.
+        await interaction.response.defer()
+        await interaction.edit_original_response(embed=await top_page_embed(interaction.guild, rows), view=self)
+
+    @discord.ui.button(label="السابق", style=discord.ButtonStyle.secondary, emoji="⬅️")
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        _, user_id, pts = self.rows[0]
+        await self.show(interaction, leaderboard.page_before((pts, user_id), TOP_PAGE_SIZE))
 
-    c.execute("SELECT user_id, points FROM points ORDER BY points DESC LIMIT 10")
-    rows = c.fetchall()
+    @discord.ui.button(label="التالي", style=discord.ButtonStyle.secondary, emoji="➡️")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        _, user_id, pts = self.rows[-1]
+        await self.show(interaction, leaderboard.page_after((pts, user_id), TOP_PAGE_SIZE))
 
+
+@bot.command()
+async def top(ctx, role: discord.Role = None):
+    if not db.connected: return await ctx.send("❌ لا يوجد بيانات")
+
+    if role:
+        members = await role_members(ctx.guild, role)
+        if members is None:
+            wait = LOW_MEMORY_ROLE_TOP_TTL - (time.time() - (member_downloads.get(ctx.guild.id) or 0))
+            return await ctx.send(f"⏳ تم تحميل أعضاء السيرفر مؤخراً، حاول مرة أخرى بعد {max(1, int(wait))} ثانية.")
+        names = dict(members)
+        rows = leaderboard.top_among(list(names), TOP_PAGE_SIZE)
+        if not rows:
+            return await ctx.send("❌ لا يوجد بيانات")
+        return await ctx.send(embed=build_top_embed(rows, names, f"🏆 أعلى النقاط — {role.name}"))
+
+    rows = leaderboard.page_after(None, TOP_PAGE_SIZE)
     if not rows:
         return await ctx.send("❌ لا يوجد بيانات")
+    await ctx.send(embed=await top_page_embed(ctx.guild, rows), view=TopView(ctx.author.id, rows))
 
-    embed = discord.Embed(title="🏆 أعلى 10 نقاط", color=0x00FFAA)
-    for i, row in enumerate(rows, start=1):
-        user = ctx.guild.get_member(row['user_id'])
-        name = user.display_name if user else f"ID: {row['user_id']}"
-        embed.add_field(name=f"#{i} — {name}", value=f"{row['points']} نقطة", inline=False)
+@bot.command()
+async def rank(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    position = leaderboard.rank(member.id)
+    if position is None:
+        return await ctx.send(f"❌ {member.display_name} ليس لديه نقاط بعد.")
+
+    embed = discord.Embed(
+        title=f"📊 ترتيب {member.display_name}",
+        description=f"**#{position}** من أصل {len(leaderboard)} — {leaderboard.points(member.id)} نقطة",
+        color=0x00FFAA
+    )
+    nearby = leaderboard.around(member.id)
+    names = await display_names(ctx.guild, [user_id for _, user_id, _ in nearby])
+    for pos, user_id, pts in nearby:
+        name = names.get(user_id) or f"ID: {user_id}"
+        marker = "➡️ " if user_id == member.id else ""
+        embed.add_field(name=f"{marker}#{pos} — {name}", value=f"{pts} نقطة", inline=False)
     await ctx.send(embed=embed)
 
 @bot.command()
@@ -508,13 +978,50 @@ async def status(ctx):
     embed.add_field(name="🏅 Auto Roles", value="🟢 يعمل", inline=True)
     embed.add_field(name="💰 Staff Salaries", value="🟢 يعمل", inline=True)
     embed.add_field(name="🛠 Control Panel", value="🟢 يعمل", inline=True)
+    embed.add_field(name="🗄️ Database", value=db.describe(), inline=False)
+    stats = ingest.stats()
+    embed.add_field(
+        name="📥 Ingest",
+        value=f"{stats['workers']} workers — queued {stats['depth']} (peak {stats['peak_depth']}) — processed {stats['processed']:,} — dropped {stats['dropped']:,}",
+        inline=False,
+    )
+    memory = f"RSS {memory_rss() / 2**20:.1f} MiB"
+    if ready_after is not None:
+        memory += f" — ready in {ready_after:.1f}s"
+    if LOW_MEMORY:
+        memory += f" — low memory, {len(member_lru)} members cached ({member_lru.hits:,} hits / {member_lru.misses:,} misses)"
+    embed.add_field(name="🧠 Memory", value=memory, inline=False)
+    guild_counts = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+    lines = [
+        f"{'➡️ ' if shard_id == ctx.guild.shard_id else ''}#{shard_id}: {latency * 1000:.0f} ms — {guild_counts.get(shard_id, 0)} guilds"
+        for shard_id, latency in shard_latencies(bot)
+    ]
+    if len(lines) > 20:
+        lines = lines[:20] + [f"… +{len(lines) - 20}"]
+    embed.add_field(name="🛰 Shards", value="\n".join(lines) or "-", inline=False)
+    if cluster.clustered:
+        try:
+            workers = await asyncio.wait_for(cluster.cluster_health(), 5)
+        except Exception as e:
+            workers = {}
+            logging.warning(f"Cluster health unavailable: {e}")
+        lines = []
+        for worker_id, health in workers.items():
+            shard_ids = health.get("shards") or [None]
+            latencies = [ms for ms in health.get("latency_ms", []) if ms is not None]
+            state = "🔴" if health["stale"] or not health["connected"] else "🟢"
+            lines.append(
+                f"{state} #{worker_id} (shards {shard_ids[0]}-{shard_ids[-1]}): {health.get('guilds', 0)} guilds — "
+                f"{max(latencies) if latencies else '?'} ms — {health.get('processed', 0):,} msgs — {health.get('rss', 0) / 2**20:.0f} MiB"
+            )
+        embed.add_field(name="🧩 Cluster", value="\n".join(lines[:20]) or "❌ لا يوجد بيانات", inline=False)
     
-    if db and c:
-        query = "SELECT points_channel FROM config WHERE guild_id = %s" if DB_TYPE == "postgres" else "SELECT points_channel FROM config WHERE guild_id = ?"
-        c.execute(query, (ctx.guild.id,))
-        r = c.fetchone()
-        if r:
-            channel = ctx.guild.get_channel(r["points_channel"])
+    if db.connected:
+        points_channel = await repository.get_points_channel(db, ctx.guild.id)
+        if points_channel:
+            channel = ctx.guild.get_channel(points_channel)
             embed.add_field(name="📌 Points Channel", value=channel.mention if channel else "❌ غير موجود", inline=False)
         else:
             embed.add_field(name="📌 Points Channel", value="❌ لم يتم الإعداد", inline=False)
@@ -603,16 +1110,12 @@ async def blacklist(ctx, member: discord.Member, duration: int, *, reason: str):
     
     end_date = time.time() + (duration * 86400) # days to seconds
     
-    if DB_TYPE == "postgres":
-        query = "INSERT INTO blacklist (user_id, reason, end_date) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO UPDATE SET reason = EXCLUDED.reason, end_date = EXCLUDED.end_date"
-    else: # sqlite
-        query = "INSERT OR REPLACE INTO blacklist (user_id, reason, end_date) VALUES (?, ?, ?)"
-    
-    c.execute(query, (member.id, reason, end_date))
-    db.commit()
+    await repository.add_blacklist(db, member.id, reason, end_date)
+    scheduler.schedule(("blacklist", member.id), end_date, expire_blacklist, member.id)
+    cluster.broadcast("blacklist", {"user_id": member.id, "end_date": end_date})
     
     await ctx.send(f"✅ تم إضافة {member.mention} إلى القائمة السوداء لمدة {duration} يوم.")
-    await send_to_channel_by_name(ctx.guild, DISMISSAL_BLACKLIST_CHANNEL_NAME, "🚫 Blacklisted", f"**User:** {member.mention}\n**By:** {ctx.author.mention}\n**Duration:** {duration} days\n**Reason:** {reason}", 0xFF0000)
+    send_log(ctx.guild, "🚫 Blacklisted", f"**User:** {member.mention}\n**By:** {ctx.author.mention}\n**Duration:** {duration} days\n**Reason:** {reason}", 0xFF0000, DISMISSAL_BLACKLIST_CHANNEL_NAME)
 
 @bot.command()
 @commands.has_permissions(administrator=True)
@@ -621,23 +1124,17 @@ async def unblacklist(ctx, member: discord.Member):
     if not is_admin(ctx.author):
         return await ctx.send("❌ ما عندك صلاحية")
 
-    if DB_TYPE == "postgres":
-        query = "DELETE FROM blacklist WHERE user_id = %s"
-    else: # sqlite
-        query = "DELETE FROM blacklist WHERE user_id = ?"
-    
-    c.execute(query, (member.id,))
-    db.commit()
+    await repository.remove_blacklist(db, member.id)
+    scheduler.cancel(("blacklist", member.id))
+    cluster.broadcast("blacklist", {"user_id": member.id, "end_date": None})
 
     await ctx.send(f"✅ تم إزالة {member.mention} من القائمة السوداء.")
-    await send_to_channel_by_name(ctx.guild, DISMISSAL_BLACKLIST_CHANNEL_NAME, "✅ Unblacklisted", f"**User:** {member.mention}\n**By:** {ctx.author.mention}", 0x00FF00)
+    send_log(ctx.guild, "✅ Unblacklisted", f"**User:** {member.mention}\n**By:** {ctx.author.mention}", 0x00FF00, DISMISSAL_BLACKLIST_CHANNEL_NAME)
 
 @bot.command()
 async def blacklistcheck(ctx, member: discord.Member):
     """التحقق من وجود عضو في القائمة السوداء"""
-    query = "SELECT reason, end_date FROM blacklist WHERE user_id = %s" if DB_TYPE == "postgres" else "SELECT reason, end_date FROM blacklist WHERE user_id = ?"
-    c.execute(query, (member.id,))
-    r = c.fetchone()
+    r = await repository.get_blacklist(db, member.id)
     if r:
         remaining_seconds = r["end_date"] - time.time()
         if remaining_seconds > 0:
@@ -648,6 +1145,55 @@ async def blacklistcheck(ctx, member: discord.Member):
     else:
         await ctx.send(f"🟢 {member.mention} ليس في القائمة السوداء.")
 
+@bot.command()
+async def history(ctx, member: discord.Member):
+    """سجل عمليات النقاط لعضو (إداري)"""
+    if not is_admin(ctx.author):
+        return await ctx.send("❌ ما عندك صلاحية")
+    if not db.connected:
+        return await ctx.send("❌ Database not connected.")
+
+    rows = await repository.ledger_history(db, member.id, 10)
+    if not rows:
+        return await ctx.send(f"❌ لا يوجد سجل نقاط لـ {member.mention}")
+
+    embed = discord.Embed(title=f"📜 سجل نقاط {member.display_name}", color=0x5865F2)
+    for row in rows:
+        sign = "+" if row["delta"] >= 0 else ""
+        details = f" — {row['reason']}" if row["reason"] else ""
+        embed.add_field(name=f"{sign}{row['delta']} · {row['source']}", value=f"<t:{int(row['created_at'])}:f>{details}", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def balanceat(ctx, member: discord.Member, date: str):
+    """نقاط عضو في نهاية يوم معين (إداري)"""
+    if not is_admin(ctx.author):
+        return await ctx.send("❌ ما عندك صلاحية")
+    if not db.connected:
+        return await ctx.send("❌ Database not connected.")
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return await ctx.send("❌ صيغة التاريخ: YYYY-MM-DD")
+
+    total = await repository.balance_at(db, member.id, day.timestamp() + 86400)
+    await ctx.send(f"🕓 نقاط {member.mention} في نهاية {date} (UTC): **{total}**")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def rebuildpoints(ctx):
+    """إعادة بناء جدول النقاط من السجل"""
+    if not is_admin(ctx.author):
+        return await ctx.send("❌ ما عندك صلاحية")
+    if not db.connected:
+        return await ctx.send("❌ Database not connected.")
+
+    async with db.transaction() as tx:
+        await repository.rebuild_points(tx)
+    await load_leaderboard()
+    await ctx.send("✅ تم إعادة بناء النقاط من السجل.")
+    send_log(ctx.guild, "🧮 Rebuild Points", f"{ctx.author.mention} أعاد بناء جدول النقاط من السجل")
+
 
 # ============================================================ 
 # ADMIN COMMANDS & SETUP
@@ -667,7 +1213,7 @@ class ChannelSetupModal(discord.ui.Modal, title="إعداد قناة النقا
         self.add_item(self.channel_id)
     
     async def on_submit(self, interaction: discord.Interaction):
-        if not db or not c:
+        if not db.connected:
             return await interaction.response.send_message("❌ Database not connected.", ephemeral=True)
         
         try:
@@ -677,13 +1223,7 @@ class ChannelSetupModal(discord.ui.Modal, title="إعداد قناة النقا
             if not channel:
                 return await interaction.response.send_message("❌ لم يتم العثور على القناة.", ephemeral=True)
             
-            if DB_TYPE == "postgres":
-                query = "INSERT INTO config (guild_id, points_channel) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET points_channel = EXCLUDED.points_channel"
-            else:
-                query = "INSERT OR REPLACE INTO config (guild_id, points_channel) VALUES (?, ?)"
-            
-            c.execute(query, (interaction.guild.id, channel_id))
-            db.commit()
+            await repository.set_points_channel(db, interaction.guild.id, channel_id)
             
             await interaction.response.send_message(f"✅ تم تحديد {channel.mention} كقناة للنقاط", ephemeral=True)
             
@@ -703,19 +1243,13 @@ class ChannelSelectView(discord.ui.View):
         max_values=1
     )
     async def select_channel(self, interaction: discord.Interaction, select: discord.ui.Select):
-        if not db or not c:
+        if not db.connected:
             return await interaction.response.send_message("❌ Database not connected.", ephemeral=True)
         
         channel_id = int(select.values[0])
         channel = self.guild.get_channel(channel_id)
         
-        if DB_TYPE == "postgres":
-            query = "INSERT INTO config (guild_id, points_channel) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET points_channel = EXCLUDED.points_channel"
-        else:
-            query = "INSERT OR REPLACE INTO config (guild_id, points_channel) VALUES (?, ?)"
-        
-        c.execute(query, (interaction.guild.id, channel_id))
-        db.commit()
+        await repository.set_points_channel(db, interaction.guild.id, channel_id)
         
         self.selected_channel = channel.mention
         await interaction.response.send_message(f"✅ تم تحديد {channel.mention} كقناة للنقاط", ephemeral=True)
@@ -749,19 +1283,13 @@ class ChannelSelectSelect(discord.ui.Select):
         super().__init__(**kwargs)
     
     async def callback(self, interaction: discord.Interaction):
-        if not db or not c:
+        if not db.connected:
             return await interaction.response.send_message("❌ Database not connected.", ephemeral=True)
         
         channel_id = int(self.values[0])
         channel = interaction.guild.get_channel(channel_id)
         
-        if DB_TYPE == "postgres":
-            query = "INSERT INTO config (guild_id, points_channel) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET points_channel = EXCLUDED.points_channel"
-        else:
-            query = "INSERT OR REPLACE INTO config (guild_id, points_channel) VALUES (?, ?)"
-        
-        c.execute(query, (interaction.guild.id, channel_id))
-        db.commit()
+        await repository.set_points_channel(db, interaction.guild.id, channel_id)
         
         await interaction.response.send_message(f"✅ تم تحديد {channel.mention} كقناة للنقاط", ephemeral=True)
 
@@ -770,7 +1298,7 @@ class ChannelSelectSelect(discord.ui.Select):
 @commands.has_permissions(administrator=True)
 async def setup(ctx):
     """إعداد قناة النقاط"""
-    if not db or not c:
+    if not db.connected:
         return await ctx.send("❌ Database not connected.")
     
     # Create a view with channel selection
@@ -783,19 +1311,13 @@ async def setup(ctx):
     ]
     
     async def select_callback(interaction: discord.Interaction):
-        if not db or not c:
+        if not db.connected:
             return await interaction.response.send_message("❌ Database not connected.", ephemeral=True)
         
         channel_id = int(interaction.data["values"][0])
         channel = ctx.guild.get_channel(channel_id)
         
-        if DB_TYPE == "postgres":
-            query = "INSERT INTO config (guild_id, points_channel) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET points_channel = EXCLUDED.points_channel"
-        else:
-            query = "INSERT OR REPLACE INTO config (guild_id, points_channel) VALUES (?, ?)"
-        
-        c.execute(query, (ctx.guild.id, channel_id))
-        db.commit()
+        await repository.set_points_channel(db, ctx.guild.id, channel_id)
         
         await interaction.response.send_message(f"✅ تم تحديد {channel.mention} كقناة للنقاط", ephemeral=True)
     
@@ -831,19 +1353,63 @@ async def setup(ctx):
 @commands.has_permissions(administrator=True)
 async def removesetup(ctx):
     """إزالة إعداد قناة النقاط"""
-    if not db or not c:
+    if not db.connected:
         return await ctx.send("❌ Database not connected.")
     
-    if DB_TYPE == "postgres":
-        query = "DELETE FROM config WHERE guild_id = %s"
-    else:
-        query = "DELETE FROM config WHERE guild_id = ?"
-    
-    c.execute(query, (ctx.guild.id,))
-    db.commit()
+    await repository.remove_config(db, ctx.guild.id)
     
     await ctx.send("✅ تم إزالة إعداد قناة النقاط بنجاح")
-    await send_log(ctx.guild, "⚙️ Remove Setup", f"{ctx.author.mention} قام بإزالة إعداد قناة النقاط", 0xFF9900)
+    send_log(ctx.guild, "⚙️ Remove Setup", f"{ctx.author.mention} قام بإزالة إعداد قناة النقاط", 0xFF9900)
+
+# Set while -migratepg is copying, so it cannot be started twice.
+migration_state = {"running": False}
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def migratepg(ctx):
+    """نقل قاعدة البيانات من SQLite إلى PostgreSQL بدون إيقاف البوت"""
+    if db.dialect != "sqlite":
+        return await ctx.send("❌ البوت يعمل على PostgreSQL بالفعل.")
+    if not MIGRATION_TARGET_URL:
+        return await ctx.send("❌ اضبط MIGRATION_TARGET_URL على رابط قاعدة PostgreSQL أولاً.")
+    if migration_state["running"]:
+        return await ctx.send("⏳ النقل قيد التنفيذ بالفعل.")
+
+    migration_state["running"] = True
+    embed = discord.Embed(title="🚚 نقل قاعدة البيانات", description="جاري النسخ...", color=0xFFD700)
+    message = await ctx.send(embed=embed)
+    lines = []
+
+    async def on_progress(text):
+        lines.append(text)
+        embed.description = "\n".join(lines[-15:])
+        await message.edit(embed=embed)
+
+    target = Database(MIGRATION_TARGET_URL, pool_size=2, statement_timeout=60)
+    try:
+        await target.connect()
+        await points_buffer.flush()
+        ok, report = await LiveMigration(db, target, on_progress=on_progress).run()
+    except Exception as e:
+        logging.error(f"Live migration failed: {e}")
+        embed.color = 0xFF0000
+        embed.add_field(name="❌ فشل النقل", value=str(e)[:1000], inline=False)
+        return await message.edit(embed=embed)
+    finally:
+        await target.close()
+        migration_state["running"] = False
+
+    for table, (source_count, target_count, match) in report.items():
+        state = "✅" if match and source_count == target_count else "❌"
+        embed.add_field(name=f"{state} {table}", value=f"{source_count} → {target_count}", inline=True)
+    if ok:
+        embed.color = 0x00FF00
+        embed.add_field(name="الخطوة التالية", value="ضع `DATABASE_URL` على نفس الرابط وأعد تشغيل البوت. التغييرات الجديدة تُنقل تلقائياً عند التشغيل.", inline=False)
+    else:
+        embed.color = 0xFF0000
+        embed.add_field(name="❌ التحقق فشل", value="لا تنتقل بعد. تأكد أن قاعدة PostgreSQL فارغة ثم أعد المحاولة.", inline=False)
+    await message.edit(embed=embed)
+    send_log(ctx.guild, "🚚 Database Migration", f"{ctx.author.mention} نقل قاعدة البيانات إلى PostgreSQL ({'verified' if ok else 'failed'})")
 
 class ControlPanel(discord.ui.View):
     def __init__(self):
@@ -896,7 +1462,7 @@ class ControlPanel(discord.ui.View):
     async def points_menu(self, interaction: discord.Interaction, button: discord.ui.Button):
         embed = discord.Embed(
             title="⭐ أوامر النقاط",
-            description="**-points [member]** - عرض نقاطك أو نقاط عضو آخر\n\n**-level [member]** - عرض المستوى ونقاط الترقية\n\n**-top** - عرض أعلى النقاط\n\n**-ranks** - عرض الرتب والمتطلبات",
+            description="**-points [member]** - عرض نقاطك أو نقاط عضو آخر\n\n**-level [member]** - عرض المستوى ونقاط الترقية\n\n**-top [@role]** - عرض أعلى النقاط\n\n**-rank [member]** - عرض ترتيبك في القائمة\n\n**-ranks** - عرض الرتب والمتطلبات",
             color=0xFFD700
         )
         await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -959,57 +1525,140 @@ async def panel(ctx):
 # BACKGROUND TASKS
 # ============================================================ 
 
-@tasks.loop(hours=1)
-async def salary_loop():
-    if not db or not c: return
-    
-    now = time.time()
-    for guild in bot.guilds:
-        for member in guild.members:
-            if member.bot: continue
-            for role in member.roles:
-                if role.id in STAFF_SALARIES:
-                    
-                    query = "SELECT last_salary FROM salaries WHERE user_id = %s" if DB_TYPE == "postgres" else "SELECT last_salary FROM salaries WHERE user_id = ?"
-                    c.execute(query, (member.id,))
-                    r = c.fetchone()
-
-                    if not r or (now - r["last_salary"]) >= SALARY_COOLDOWN:
-                        amount = STAFF_SALARIES[role.id]
-                        add_points(member.id, amount)
-
-                        if DB_TYPE == "postgres":
-                            c.execute("INSERT INTO salaries (user_id, last_salary) VALUES (%s,%s) ON CONFLICT (user_id) DO UPDATE SET last_salary = EXCLUDED.last_salary", (member.id, now))
-                        else:
-                            c.execute("INSERT OR REPLACE INTO salaries VALUES (?,?)", (member.id, now))
-                        db.commit()
-                        
-                        await send_log(guild, "💰 Salary", f"{member.mention} استلم راتب {amount} نقطة", 0x00FF00)
-                        await check_auto_roles(member)
-                    break # Process only the highest salary role
-
-@tasks.loop(hours=1)
-async def blacklist_check_loop():
-    if not db or not c: return
-
-    query = "SELECT user_id, reason, end_date FROM blacklist"
-    c.execute(query)
-    rows = c.fetchall()
+def schedule_payroll(when: float):
+    """Runs the payroll at `when`, unless a run is already due sooner."""
+    current = scheduler.due("payroll")
+    if current is None or when < current:
+        scheduler.schedule("payroll", when, run_payroll)
+
+async def run_payroll():
+    try:
+        # One worker at a time in cluster mode; each re-reads paydays under the lock.
+        async with cluster.lock("payroll"):
+            upcoming = await pay_due_salaries()
+    except Exception as e:
+        logging.error(f"Payroll failed, retrying in an hour: {e}")
+        upcoming = time.time() + 3600
+    if LOW_MEMORY:
+        # Each run fetches every member list, so runs are spaced out and hires
+        # (no member updates without the cache) are found by the next one.
+        floor = time.time() + LOW_MEMORY_PAYROLL_INTERVAL
+        upcoming = floor if upcoming is None else max(upcoming, floor)
+    # Without staff nothing is scheduled; a hire triggers a run from on_member_update.
+    if upcoming is not None:
+        schedule_payroll(upcoming)
+
+async def collect_shard_staff(shard_id, guilds):
+    if not LOW_MEMORY:
+        return payroll.collect_staff(guilds, STAFF_SALARIES)
+    staff = {}
+    for guild in guilds:
+        payroll.collect_staff_from_members(await guild_members(guild), STAFF_SALARIES, permissions, staff)
+    return staff
+
+async def pay_due_salaries():
+    """Pays every staff member whose salary is due, in one transaction. Returns the next due time."""
+    staff = {}
+    by_shard, skipped = await for_each_shard(bot, collect_shard_staff, SHARD_JOB_TIMEOUT)
+    for shard_staff in by_shard.values():
+        payroll.merge_staff(staff, shard_staff)
     now = time.time()
+    last_paid = await repository.last_salaries(db, staff)
+    due, upcoming = payroll.split_due(staff, last_paid, now, SALARY_COOLDOWN)
+
+    if due:
+        payouts = []
+        for user_id in due:
+            _, role, amount = staff[user_id]
+            # Protected members keep their payday but get no points, as with add_points.
+            payouts.append((user_id, None if permissions.is_protected(user_id) else amount, role.name))
+        # Stored totals and pending chat points are read at the same moment, as in add_points.
+        async with points_buffer.paused():
+            async with db.transaction() as tx:
+                await repository.pay_salaries(tx, payouts, now)
+                totals = await repository.points_for_users(tx, [uid for uid, amount, _ in payouts if amount])
+            for user_id, amount, _ in payouts:
+                if amount:
+                    totals[user_id] = totals.get(user_id, 0) + points_buffer.pending_delta(user_id)
+
+        announce_points(totals)
+        for user_id, amount, _ in payouts:
+            member, role, _ = staff[user_id]
+            if amount:
+                total = totals[user_id]
+                leaderboard.set(user_id, total)
+                send_log(member.guild, "💰 Salary", f"{member.mention} استلم راتب {amount} نقطة", 0x00FF00)
+                await check_auto_roles(member, total, amount)
+        logging.info(f"Payroll: paid {len(due)} of {len(staff)} staff members.")
+        upcoming = now + SALARY_COOLDOWN if upcoming is None else min(upcoming, now + SALARY_COOLDOWN)
+    if skipped:
+        # Staff on the skipped shards were not looked at; try them again soon.
+        retry = now + 600
+        upcoming = retry if upcoming is None else min(upcoming, retry)
+    return upcoming
+
+async def expire_blacklist(user_id: int):
+    # Every worker schedules every expiry; the first one to get here removes it.
+    async with cluster.lock("blacklist"):
+        row = await repository.get_blacklist(db, user_id)
+        if row is None:
+            return
+        if row["end_date"] > time.time():
+            # Extended since this was scheduled.
+            return scheduler.schedule(("blacklist", user_id), row["end_date"], expire_blacklist, user_id)
+        await repository.remove_blacklist(db, user_id)
+
+    cluster.broadcast("blacklist_expired", {"user_id": user_id})
+    await notify_blacklist_expired(user_id)
+
+async def notify_blacklist_expired(user_id: int):
+    """Posts the expiry notice in this process's guilds the user is in."""
+    async def notify_expired(shard_id, guilds):
+        for guild in guilds:
+            member = (await member_lru.resolve(guild, [user_id])).get(user_id)
+            if member:
+                send_log(guild, "⌛️ Blacklist Expired", f"**User:** {member.mention}'s blacklist has expired.", 0x00FF00, DISMISSAL_BLACKLIST_CHANNEL_NAME)
+
+    await for_each_shard(bot, notify_expired, SHARD_JOB_TIMEOUT)
+
+@cluster.on("blacklist")
+async def on_cluster_blacklist(data):
+    # Set or lifted on another worker.
+    key = ("blacklist", data["user_id"])
+    if data["end_date"] is None:
+        scheduler.cancel(key)
+    else:
+        scheduler.schedule(key, data["end_date"], expire_blacklist, data["user_id"])
 
-    for row in rows:
-        if now > row["end_date"]:
-            if DB_TYPE == "postgres":
-                del_query = "DELETE FROM blacklist WHERE user_id = %s"
-            else:
-                del_query = "DELETE FROM blacklist WHERE user_id = ?"
-            c.execute(del_query, (row["user_id"],))
-            db.commit()
+@cluster.on("blacklist_expired")
+async def on_cluster_blacklist_expired(data):
+    scheduler.cancel(("blacklist", data["user_id"]))
+    await notify_blacklist_expired(data["user_id"])
 
-            for guild in bot.guilds:
-                member = guild.get_member(row["user_id"])
-                if member:
-                    await send_to_channel_by_name(guild, DISMISSAL_BLACKLIST_CHANNEL_NAME, "⌛️ Blacklist Expired", f"**User:** {member.mention}'s blacklist has expired.", 0x00FF00)
+async def load_schedule():
+    """Seeds the scheduler from the database; overdue jobs run as soon as it starts."""
+    for user_id, end_date in await repository.blacklist_expiries(db):
+        scheduler.schedule(("blacklist", user_id), end_date, expire_blacklist, user_id)
+
+    # The first run pays whoever is overdue and schedules the next one.
+    schedule_payroll(time.time())
+    logging.info(f"Scheduled {len(scheduler)} jobs.")
+
+@tasks.loop(minutes=10)
+async def leaderboard_sync_loop():
+    # Picks up writes made outside this process (ai-bot, manual SQL).
+    try:
+        await load_leaderboard()
+    except Exception as e:
+        logging.error(f"Leaderboard sync failed: {e}")
+
+@tasks.loop(seconds=60)
+async def chat_state_snapshot_loop():
+    # Interval is set from CHAT_STATE_SNAPSHOT_INTERVAL before it starts.
+    try:
+        await save_chat_state()
+    except Exception as e:
+        logging.error(f"Chat state snapshot failed: {e}")
 
 
 # ============================================================ 
@@ -1025,11 +1674,9 @@ def run_bot():
         logging.error(f"Bot crashed: {e}. Restarting in 5 seconds...")
         time.sleep(5)
         run_bot() # Recursive call to restart
-    finally:
-        if db:
-            db.close()
-            logging.info("Database connection closed.")
 
 if __name__ == "__main__":
-    keep_alive()
+    # Cluster workers leave the web port to the launcher.
+    if not CLUSTER_COORDINATOR:
+        keep_alive()
     run_bot()
@@ -0,0 +1,54 @@
+"""Per-guild index of text channels by name.
+
+Log, news, alert and blacklist messages address channels by name. The index
+is built from `guild.text_channels` the first time a guild is asked about and
+thrown away on any channel create, update or delete there, so the next lookup
+rebuilds it. Names that do not exist are remembered as misses: the warning is
+logged once, not on every message, and stays quiet across rebuilds until the
+channel shows up.
+"""
+import logging
+
+
+class ChannelIndex:
+    def __init__(self):
+        # guild id -> {name: channel, or None for a known miss}
+        self._guilds = {}
+        # guild id -> names already reported missing
+        self._missing = {}
+
+    def get(self, guild, name: str):
+        """The guild's first text channel called `name`, or None."""
+        index = self._guilds.get(guild.id)
+        if index is None:
+            index = self._build(guild)
+        if name in index:
+            return index[name]
+        index[name] = None
+        reported = self._missing.setdefault(guild.id, set())
+        if name not in reported:
+            reported.add(name)
+            logging.warning(f"Channel '{name}' not found in guild {guild.name}")
+        return None
+
+    def _build(self, guild):
+        index = {}
+        # text_channels is in position order; the first channel with a name wins, as with utils.get.
+        for channel in guild.text_channels:
+            index.setdefault(channel.name, channel)
+        missing = self._missing.get(guild.id)
+        if missing:
+            # Channels created since the miss are reported normally again if removed.
+            missing.difference_update(index)
+            for name in missing:
+                index[name] = None
+        self._guilds[guild.id] = index
+        return index
+
+    def invalidate(self, guild):
+        self._guilds.pop(guild.id, None)
+
+    def forget(self, guild):
+        """Drops everything about a guild the bot has left."""
+        self._guilds.pop(guild.id, None)
+        self._missing.pop(guild.id, None)
@@ -0,0 +1,283 @@
+"""Cluster launcher: runs the bot as several worker processes.
+
+    python points_bot/cluster.py
+
+Starts CLUSTER_PROCESSES workers (default: one per CPU core), each running
+bot.py as an AutoShardedBot over a contiguous range of the SHARD_COUNT
+shards ("auto" asks Discord for its recommended count). A worker owns its
+shards' guilds outright, so chat accounting, roles and logs scale with the
+number of processes; they share only the database, which should be
+PostgreSQL (DATABASE_URL) rather than SQLite when several processes write.
+
+The launcher is also the coordinator. Workers connect to it on localhost
+(CLUSTER_PORT) and use it for:
+
+* named locks, so jobs that touch every user (payroll, blacklist expiry)
+  run on one worker at a time and re-check the database under the lock;
+* broadcasts, e.g. a blacklist set on one worker is scheduled on all;
+* point changes: after each commit (chat flush, add_points, payroll) a
+  worker announces the user ids it changed and the others re-read those
+  totals a second later, so -top and -rank agree across workers to within
+  POINTS_FLUSH_INTERVAL plus a second. The 10-minute leaderboard resync
+  stays as a backstop for changes made outside the bot;
+* health, reported every few seconds, aggregated for -status and served as
+  JSON on http://0.0.0.0:8080/health next to the usual keep-alive page;
+* gateway IDENTIFY, serialized across processes.
+
+A worker that exits is restarted with backoff. SIGINT/SIGTERM stops all of
+them.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+from collections import deque
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+TOKEN = os.getenv("DISCORD_TOKEN")
+CLUSTER_PROCESSES = int(os.getenv("CLUSTER_PROCESSES", 0)) or os.cpu_count() or 1
+SHARD_COUNT = os.getenv("SHARD_COUNT", "auto").strip().lower()
+CLUSTER_PORT = int(os.getenv("CLUSTER_PORT", 8765))
+HTTP_PORT = int(os.getenv("PORT", 8080))
+# A worker's health older than this is reported as stale.
+HEALTH_STALE_AFTER = 60
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [cluster] %(message)s')
+
+
+def shard_ranges(shard_count: int, processes: int) -> list:
+    """Splits shard ids 0..shard_count-1 into `processes` contiguous, near-equal ranges."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+# ============================================================
+# COORDINATOR
+# ============================================================
+
+class Coordinator:
+    def __init__(self, secret: str):
+        self.secret = secret
+        # writer -> worker id, for connections that said hello
+        self.workers = {}
+        # worker id -> (reported_at, health dict)
+        self.health = {}
+        # Locks are held per request, not per connection: several coroutines of
+        # one worker can hold or wait for them independently.
+        # lock name -> (writer, request id) holding it; lock name -> deque of waiting ones
+        self.holders = {}
+        self.waiters = {}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if writer not in self.workers and message.get("op") != "hello":
+                    break
+                self.dispatch(writer, message)
+        except (ConnectionError, ValueError) as e:
+            logging.warning(f"Dropping worker connection: {e}")
+        finally:
+            self.disconnect(writer)
+            writer.close()
+
+    def dispatch(self, writer, message):
+        op = message.get("op")
+        if op == "hello":
+            if message.get("secret") != self.secret:
+                return self.reply(writer, message, error="bad secret")
+            self.workers[writer] = str(message["cluster_id"])
+            logging.info(f"Worker {message['cluster_id']} connected")
+            self.reply(writer, message)
+        elif op == "lock":
+            self.lock(writer, message)
+        elif op == "unlock":
+            self.unlock(writer, message["name"], message["request"])
+        elif op == "broadcast":
+            for other in self.workers:
+                if other is not writer:
+                    self.send(other, {"event": message["event"], "data": message["data"]})
+        elif op == "report":
+            self.health[self.workers[writer]] = (time.time(), message["data"])
+        elif op == "health":
+            self.reply(writer, message, workers=self.snapshot())
+
+    def send(self, writer, message):
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b"\n")
+
+    def reply(self, writer, request, **fields):
+        self.send(writer, {"id": request.get("id"), **fields})
+
+    # ----------------------------------------------------------------- locks
+
+    def lock(self, writer, message):
+        name = message["name"]
+        request = (writer, message["id"])
+        if name not in self.holders:
+            self.holders[name] = request
+            self.reply(writer, message)
+        else:
+            self.waiters.setdefault(name, deque()).append(request)
+
+    def unlock(self, writer, name, request_id):
+        request = (writer, request_id)
+        if self.holders.get(name) == request:
+            self.grant_next(name)
+            return
+        # Still queued: that request gave up waiting. Anything else is a stray unlock.
+        queue = self.waiters.get(name)
+        if queue and request in queue:
+            queue.remove(request)
+
+    def grant_next(self, name):
+        queue = self.waiters.get(name)
+        while queue:
+            writer, request_id = queue.popleft()
+            if not writer.is_closing():
+                self.holders[name] = (writer, request_id)
+                return self.send(writer, {"id": request_id})
+        self.holders.pop(name, None)
+        self.waiters.pop(name, None)
+
+    def disconnect(self, writer):
+        worker_id = self.workers.pop(writer, None)
+        if worker_id is not None:
+            logging.warning(f"Worker {worker_id} disconnected")
+        for name, queue in self.waiters.items():
+            self.waiters[name] = deque(request for request in queue if request[0] is not writer)
+        for name, (holder, _) in list(self.holders.items()):
+            if holder is writer:
+                self.grant_next(name)
+
+    # ---------------------------------------------------------------- health
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        connected = set(self.workers.values())
+        return {
+            worker_id: {**data, "age": round(now - reported_at), "connected": worker_id in connected,
+                        "stale": now - reported_at > HEALTH_STALE_AFTER}
+            for worker_id, (reported_at, data) in sorted(self.health.items())
+        }
+
+    async def serve_http(self):
+        async def home(request):
+            return web.Response(text="Bot is alive")
+
+        async def health(request):
+            workers = self.snapshot()
+            totals = {
+                "workers": len(workers),
+                "connected": sum(1 for w in workers.values() if w["connected"] and not w["stale"]),
+                "guilds": sum(w.get("guilds", 0) for w in workers.values()),
+                "processed": sum(w.get("processed", 0) for w in workers.values()),
+                "rss": sum(w.get("rss", 0) for w in workers.values()),
+            }
+            return web.json_response({"totals": totals, "workers": workers})
+
+        app = web.Application()
+        app.router.add_get("/", home)
+        app.router.add_get("/health", health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", HTTP_PORT).start()
+
+
+# ============================================================
+# WORKERS
+# ============================================================
+
+async def supervise(cluster_id: int, shard_ids: list, env: dict, stopping: asyncio.Event):
+    """Runs one worker process, restarting it with backoff until the cluster stops."""
+    backoff = 5
+    while not stopping.is_set():
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env={
+            **env,
+            "CLUSTER_ID": str(cluster_id),
+            "SHARD_IDS": ",".join(map(str, shard_ids)),
+        })
+        logging.info(f"Worker {cluster_id} started (pid {process.pid}, shards {shard_ids[0]}-{shard_ids[-1]})")
+        waiter = asyncio.create_task(process.wait())
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait({waiter, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(waiter, 30)
+                except asyncio.TimeoutError:
+                    process.kill()
+            return
+        stop.cancel()
+        if time.monotonic() - started > 300:
+            backoff = 5
+        logging.error(f"Worker {cluster_id} exited with {process.returncode}; restarting in {backoff}s")
+        try:
+            await asyncio.wait_for(stopping.wait(), backoff)
+        except asyncio.TimeoutError:
+            pass
+        backoff = min(backoff * 2, 300)
+
+
+async def main():
+    if not TOKEN:
+        sys.exit("DISCORD_TOKEN is not set")
+    shard_count = await recommended_shards(TOKEN) if SHARD_COUNT in ("", "auto") else int(SHARD_COUNT)
+    ranges = shard_ranges(shard_count, CLUSTER_PROCESSES)
+    logging.info(f"{shard_count} shards over {len(ranges)} workers")
+
+    secret = secrets.token_hex(16)
+    coordinator = Coordinator(secret)
+    server = await asyncio.start_server(coordinator.handle, "127.0.0.1", CLUSTER_PORT)
+    await coordinator.serve_http()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    env = {
+        **os.environ,
+        "SHARD_COUNT": str(shard_count),
+        "CLUSTER_COORDINATOR": f"127.0.0.1:{CLUSTER_PORT}",
+        "CLUSTER_SECRET": secret,
+    }
+    await asyncio.gather(*(supervise(i, shard_ids, env, stopping) for i, shard_ids in enumerate(ranges)))
+    server.close()
+    logging.info("Cluster stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+"""A worker's link to the cluster coordinator (see cluster.py).
+
+The coordinator speaks JSON lines over a localhost socket. Through it a
+worker takes named locks (so payroll and blacklist expiry run on one worker
+at a time), broadcasts events to the other workers, and reports its health.
+
+Without a coordinator address the client is standalone: locks are local
+asyncio locks, broadcasts go nowhere and health is only this process, so
+the bot code is the same whether or not it runs in a cluster.
+"""
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+
+HEALTH_INTERVAL = 15
+
+
+class ClusterClient:
+    def __init__(self, address=None, cluster_id=0, secret=None, health=None, on_lost=None):
+        self.address = address
+        self.cluster_id = cluster_id
+        self.secret = secret
+        # Returns this worker's health dict; sent every HEALTH_INTERVAL seconds.
+        self.health = health
+        # Called once if the coordinator goes away; the launcher is gone with it.
+        self.on_lost = on_lost
+        self.handlers = {}
+        self._local_locks = {}
+        self._pending = {}
+        self._next_id = 0
+        self._writer = None
+        self._tasks = []
+
+    @property
+    def clustered(self) -> bool:
+        return self.address is not None
+
+    def on(self, event: str):
+        """Decorator registering an async handler for a broadcast event."""
+        def register(handler):
+            self.handlers[event] = handler
+            return handler
+        return register
+
+    # ------------------------------------------------------------- lifecycle
+
+    async def start(self):
+        if not self.clustered:
+            return
+        host, port = self.address.rsplit(":", 1)
+        reader, self._writer = await asyncio.open_connection(host, int(port))
+        self._tasks = [asyncio.create_task(self._read(reader))]
+        await self._request("hello", cluster_id=self.cluster_id, secret=self.secret)
+        if self.health is not None:
+            self._tasks.append(asyncio.create_task(self._report()))
+        logging.info(f"Joined cluster at {self.address} as worker {self.cluster_id}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending("left the cluster")
+
+    # ----------------------------------------------------------------- locks
+
+    async def acquire(self, name: str):
+        """Waits for the lock; returns the token to pass to `release`."""
+        if not self.clustered:
+            await self._local_locks.setdefault(name, asyncio.Lock()).acquire()
+            return None
+        request_id, granted = self._start_request("lock", name=name)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            # Leave the queue (or give the lock back if it was granted meanwhile).
+            self._pending.pop(request_id, None)
+            self.release(name, request_id)
+            raise
+        return request_id
+
+    def release(self, name: str, token):
+        """Releases the lock taken by the `acquire` call that returned `token`."""
+        if not self.clustered:
+            self._local_locks[name].release()
+            return
+        self._send({"op": "unlock", "name": name, "request": token})
+
+    @asynccontextmanager
+    async def lock(self, name: str):
+        """Held by at most one worker in the cluster at a time."""
+        token = await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+    # ------------------------------------------------------- events / health
+
+    def broadcast(self, event: str, data: dict):
+        """Sends `event` to every other worker; does nothing when standalone."""
+        if self.clustered:
+            self._send({"op": "broadcast", "event": event, "data": data})
+
+    async def cluster_health(self) -> dict:
+        """{worker id: health} for every worker, as last reported to the coordinator."""
+        if not self.clustered:
+            return {str(self.cluster_id): self.health() if self.health else {}}
+        reply = await self._request("health")
+        return reply["workers"]
+
+    # -------------------------------------------------------------- protocol
+
+    def _send(self, message: dict):
+        self._writer.write(json.dumps(message).encode() + b"\n")
+
+    def _start_request(self, op: str, **fields):
+        """Sends a request; returns (request id, future of the reply)."""
+        self._next_id += 1
+        future = self._pending[self._next_id] = asyncio.get_running_loop().create_future()
+        self._send({"op": op, "id": self._next_id, **fields})
+        return self._next_id, future
+
+    async def _request(self, op: str, **fields) -> dict:
+        return await self._start_request(op, **fields)[1]
+
+    def _fail_pending(self, reason: str):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(reason))
+        self._pending.clear()
+
+    async def _read(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                logging.error("Lost the cluster coordinator")
+                self._fail_pending("cluster coordinator is gone")
+                if self.on_lost is not None:
+                    self.on_lost()
+                return
+            message = json.loads(line)
+            if "event" in message:
+                handler = self.handlers.get(message["event"])
+                if handler is not None:
+                    asyncio.create_task(self._handle(handler, message["event"], message["data"]))
+                continue
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message)
+
+    @staticmethod
+    async def _handle(handler, event, data):
+        try:
+            await handler(data)
+        except Exception as e:
+            logging.error(f"Cluster event '{event}' failed: {e}")
+
+    async def _report(self):
+        while True:
+            try:
+                self._send({"op": "report", "data": self.health()})
+            except Exception as e:
+                logging.warning(f"Health report failed: {e}")
+            await asyncio.sleep(HEALTH_INTERVAL)
@@ -0,0 +1,267 @@
+"""Offline bulk import/export for the points database.
+
+    python points_bot/dbtool.py export points points.csv
+    python points_bot/dbtool.py import blacklist blacklist.jsonl --replace
+
+Rows are streamed in both directions, so memory use does not grow with the
+table. On Postgres, CSV goes through COPY and imports always do. On SQLite,
+reads go through a cursor and writes use chunked executemany. Each import
+runs in a single transaction. The file format follows the extension
+(.csv or .jsonl) unless --format is given.
+
+Imports load a temporary staging table first and merge it in with one
+statement per step. Salaries and blacklist rows are upserted; --replace
+clears the table first. Points are exported as current totals. Importing
+points appends ledger entries that move each listed user to the imported
+total and then compacts, so the history stays intact. With --replace,
+users missing from the file are also moved to zero.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import repository
+from migrations import migrate
+from storage import SQLITE_PATH, Database, Statement
+
+# Rows per executemany / fetch round-trip.
+CHUNK_ROWS = 10000
+
+# Column names and converters, in file and table order.
+TABLES = {
+    "points": (("user_id", int), ("points", int)),
+    "salaries": (("user_id", int), ("last_salary", float)),
+    "blacklist": (("user_id", int), ("reason", str), ("end_date", float)),
+}
+
+STAGING = {
+    "points": "user_id BIGINT PRIMARY KEY, points INTEGER NOT NULL",
+    "salaries": "user_id BIGINT PRIMARY KEY, last_salary DOUBLE PRECISION",
+    "blacklist": "user_id BIGINT PRIMARY KEY, reason TEXT, end_date DOUBLE PRECISION",
+}
+
+EXPORT_QUERIES = {
+    # Snapshot plus ledger entries that have not been compacted yet.
+    "points": "SELECT user_id, SUM(points) AS points FROM ("
+              "SELECT user_id, points FROM points UNION ALL "
+              "SELECT user_id, delta FROM points_ledger WHERE id > (SELECT last_id FROM ledger_watermark WHERE id = 1)"
+              ") AS totals GROUP BY user_id ORDER BY user_id",
+    "salaries": "SELECT user_id, last_salary FROM salaries ORDER BY user_id",
+    "blacklist": "SELECT user_id, reason, end_date FROM blacklist ORDER BY user_id",
+}
+
+# WHERE true: SQLite needs it to parse ON CONFLICT after INSERT ... SELECT.
+UPSERTS = {
+    "salaries": "INSERT INTO salaries (user_id, last_salary) SELECT user_id, last_salary FROM import_salaries WHERE true "
+                "ON CONFLICT (user_id) DO UPDATE SET last_salary = excluded.last_salary",
+    "blacklist": "INSERT INTO blacklist (user_id, reason, end_date) SELECT user_id, reason, end_date FROM import_blacklist WHERE true "
+                 "ON CONFLICT (user_id) DO UPDATE SET reason = excluded.reason, end_date = excluded.end_date",
+}
+
+# Both run right after a compaction, when `points` holds every total.
+ZERO_MISSING_POINTS = Statement(
+    "import_zero_missing_points",
+    "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) "
+    "SELECT user_id, -points, ?, 'import', ? FROM points "
+    "WHERE points <> 0 AND NOT EXISTS (SELECT 1 FROM import_points WHERE import_points.user_id = points.user_id)",
+)
+SET_IMPORTED_POINTS = Statement(
+    "import_set_points",
+    "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) "
+    "SELECT i.user_id, i.points - COALESCE(p.points, 0), ?, 'import', ? FROM import_points i "
+    "LEFT JOIN points p ON p.user_id = i.user_id WHERE i.points <> COALESCE(p.points, 0)",
+)
+
+
+class Progress:
+    """Prints rows done and throughput to stderr, at most once a second."""
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def add(self, count):
+        self.rows += count
+        now = time.monotonic()
+        if now - self._reported >= 1:
+            self._reported = now
+            self._print(now)
+
+    def done(self):
+        self._print(time.monotonic(), final=True)
+
+    def _print(self, now, final=False):
+        elapsed = max(now - self.started, 1e-6)
+        suffix = f" in {elapsed:.1f}s" if final else ""
+        print(f"{self.label}: {self.rows:,} rows{suffix} ({self.rows / elapsed:,.0f} rows/s)", file=sys.stderr)
+
+
+class CopyReader:
+    """File-like CSV view of row tuples, read by COPY ... FROM STDIN."""
+
+    def __init__(self, rows, progress):
+        self._rows = iter(rows)
+        self._progress = progress
+        self._pending = ""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 20
+        while len(self._pending) < size:
+            batch = list(itertools.islice(self._rows, 1000))
+            if not batch:
+                break
+            out = io.StringIO()
+            # None is written as an empty unquoted field, which COPY reads as NULL.
+            csv.writer(out).writerows(batch)
+            self._pending += out.getvalue()
+            self._progress.add(len(batch))
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class CopyWriter:
+    """Counts the rows COPY ... TO STDOUT writes through to `file`."""
+
+    def __init__(self, file, progress):
+        self._file = file
+        self._progress = progress
+        self._header = True
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        self._file.write(data)
+        # psycopg2 writes one row per call; the first is the header.
+        if self._header:
+            self._header = False
+        else:
+            self._progress.add(1)
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".csv", ".jsonl"):
+        return extension[1:]
+    raise SystemExit(f"Cannot tell the format of {path}; use --format csv or --format jsonl")
+
+
+def read_rows(file, fmt, columns):
+    """Yields one converted tuple per record; empty values become NULL."""
+    if fmt == "csv":
+        records = csv.DictReader(file)
+    else:
+        records = (json.loads(line) for line in file if line.strip())
+    for record in records:
+        row = []
+        for name, convert in columns:
+            value = record.get(name)
+            row.append(None if value is None or value == "" else convert(value))
+        yield tuple(row)
+
+
+async def export_table(db, table, path, fmt):
+    names = [name for name, _ in TABLES[table]]
+    query = EXPORT_QUERIES[table]
+    progress = Progress(f"export {table}")
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        async with db.transaction() as tx:
+            if db.dialect == "postgres" and fmt == "csv":
+                await tx.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", CopyWriter(file, progress))
+            else:
+                writer = csv.writer(file) if fmt == "csv" else None
+                if writer:
+                    writer.writerow(names)
+                async for rows in tx.iterate(query, CHUNK_ROWS):
+                    if writer:
+                        writer.writerows(tuple(row) for row in rows)
+                    else:
+                        file.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+                    progress.add(len(rows))
+    progress.done()
+
+
+async def import_table(db, table, path, fmt, replace=False):
+    columns = TABLES[table]
+    names = ", ".join(name for name, _ in columns)
+    staging = f"import_{table}"
+    progress = Progress(f"import {table}")
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = read_rows(file, fmt, columns)
+        async with db.transaction() as tx:
+            await tx.execute(f"CREATE TEMP TABLE {staging} ({STAGING[table]})")
+            if db.dialect == "postgres":
+                await tx.copy(f"COPY {staging} ({names}) FROM STDIN WITH (FORMAT csv)", CopyReader(rows, progress))
+            else:
+                insert = f"INSERT INTO {staging} ({names}) VALUES ({', '.join('?' * len(columns))})"
+                while True:
+                    chunk = list(itertools.islice(rows, CHUNK_ROWS))
+                    if not chunk:
+                        break
+                    await tx.executemany(insert, chunk)
+                    progress.add(len(chunk))
+
+            if table == "points":
+                await merge_points(tx, replace, f"import {os.path.basename(path)}")
+            else:
+                if replace:
+                    await tx.execute(f"DELETE FROM {table}")
+                await tx.execute(UPSERTS[table])
+            await tx.execute(f"DROP TABLE {staging}")
+    progress.done()
+
+
+async def merge_points(tx, replace, reason):
+    """Moves every imported user to their imported total through the ledger."""
+    now = time.time()
+    # Folds pending entries first so `points` holds each user's current total.
+    await repository.compact_ledger(tx, now)
+    if replace:
+        await tx.execute(ZERO_MISSING_POINTS, (reason, now))
+    await tx.execute(SET_IMPORTED_POINTS, (reason, now))
+    await repository.compact_ledger(tx, now)
+
+
+async def run(args, fmt):
+    db = Database(args.database_url, sqlite_path=args.sqlite_path, pool_size=1, statement_timeout=0)
+    await db.connect()
+    try:
+        await migrate(db)
+        if args.action == "export":
+            await export_table(db, args.table, args.path, fmt)
+        else:
+            await import_table(db, args.table, args.path, fmt, args.replace)
+    finally:
+        await db.close()
+
+
+def main(argv=None):
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Stream points bot tables to or from CSV/JSONL files.")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("table", choices=tuple(TABLES))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="defaults to the file extension")
+    parser.add_argument("--replace", action="store_true", help="import: drop rows that are not in the file")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="PostgreSQL URL (defaults to $DATABASE_URL)")
+    parser.add_argument("--sqlite-path", default=SQLITE_PATH, help="SQLite file used when no database URL is set")
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args, args.format or detect_format(args.path)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compact fingerprints for near-duplicate message detection.
+
+A message is normalised (case, Arabic diacritics and tatweel, punctuation,
+spacing and repeated letters are dropped) and reduced to a 64-bit simhash
+of its distinct character trigrams, so repeating a phrase does not help.
+Messages that differ by a few characters get fingerprints a few bits apart,
+so spam variations are caught by comparing Hamming distances against a
+user's last few fingerprints. Only the fingerprints are kept, never the text.
+"""
+import hashlib
+import re
+import unicodedata
+
+BITS = 64
+# Longer messages are fingerprinted on their first characters only.
+MAX_CHARS = 1000
+
+# Harakat, Quranic marks, superscript alef and tatweel.
+_ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _ARABIC_MARKS.sub("", text)
+    # Drops punctuation, separators and control characters; keeps letters, digits and emoji.
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZC")
+    return _REPEATS.sub(r"\1", text)[:MAX_CHARS]
+
+
+def _feature_hash(feature: str) -> int:
+    # blake2b rather than hash(): fingerprints must match across restarts.
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str) -> int:
+    """64-bit simhash over the distinct character trigrams of the normalised text."""
+    text = normalize(text)
+    features = {text[i:i + 3] for i in range(len(text) - 2)} or {text}
+    # One bit string per feature; zip walks them column by column in C.
+    columns = zip(*(format(_feature_hash(feature), f"0{BITS}b") for feature in features))
+    half = len(features) / 2
+    fingerprint = 0
+    for column in columns:
+        fingerprint = fingerprint << 1 | (column.count("1") > half)
+    return fingerprint
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def near_duplicate(fingerprint: int, history, max_distance: int) -> bool:
+    """True if `fingerprint` is within `max_distance` bits of any in `history`."""
+    return any(distance(fingerprint, seen) <= max_distance for seen in history)
@@ -0,0 +1,124 @@
+"""Chat message ingestion off the gateway event path.
+
+`on_message` only builds a small event and hands it to `submit`, which never
+waits. Events are sharded by user id over a fixed set of bounded queues, one
+worker coroutine each, so one user's messages are always handled in order
+and by a single worker. A worker takes whatever is queued (up to
+`batch_size`) and passes it to the handler in one call.
+
+When a shard's queue is full the event is dropped and counted rather than
+queued without bound: during a raid ingestion latency stays flat and only
+chat points for the excess messages are lost. Commands never go through
+here.
+"""
+import asyncio
+import logging
+
+
+class ChatEvent:
+    __slots__ = ("member", "content", "created_at")
+
+    def __init__(self, member, content: str, created_at: float):
+        self.member = member
+        self.content = content
+        self.created_at = created_at
+
+    @property
+    def user_id(self) -> int:
+        return self.member.id
+
+
+class IngestPipeline:
+    def __init__(self, handler, workers=4, max_depth=1000, batch_size=100):
+        # handler: async callable taking a list of ChatEvents from one shard.
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.batch_size = batch_size
+        self.submitted = 0
+        self.processed = 0
+        self.batches = 0
+        self.dropped = 0
+        # Times a shard filled up; each episode is logged once.
+        self.overflows = 0
+        self.peak_depth = 0
+        self._full = set()
+        self._queues = []
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def submit(self, event: ChatEvent) -> bool:
+        """Queues `event` on its user's shard; False if it was dropped."""
+        if not self._queues:
+            self.dropped += 1
+            return False
+        shard = event.user_id % self.workers
+        queue = self._queues[shard]
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if shard not in self._full:
+                self._full.add(shard)
+                self.overflows += 1
+                logging.warning(f"Ingest shard {shard} is full ({self.max_depth} events); dropping chat events")
+            return False
+        self.submitted += 1
+        self.peak_depth = max(self.peak_depth, queue.qsize())
+        return True
+
+    def start(self):
+        if self._tasks:
+            return
+        # Queues are created here, inside the running loop.
+        self._queues = [asyncio.Queue(maxsize=self.max_depth) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._work(shard)) for shard in range(self.workers)]
+
+    async def stop(self, timeout=5.0):
+        """Gives the workers `timeout` seconds to drain, then cancels them."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Ingest stopped with {self.depth()} events still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    async def _work(self, shard):
+        queue = self._queues[shard]
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self._full.discard(shard)
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                logging.error(f"Ingest shard {shard} failed on a batch of {len(batch)}: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+            self.processed += len(batch)
+            self.batches += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "depth": self.depth(),
+            "peak_depth": self.peak_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,328 @@
+"""In-memory leaderboard with O(log n) rank queries.
+
+Users are kept ordered by (points desc, user_id desc) in an indexable skip
+list, so top-N, "what rank is X" and "who is around X" never touch the
+database. The bot seeds it from the points table at startup, updates it on
+every point change and re-syncs it periodically to pick up external writes.
+"""
+import heapq
+import math
+import random
+from collections import OrderedDict
+
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class _End:
+    """Sorts after every key; terminates each level of the skip list."""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return isinstance(other, _End)
+
+    def __gt__(self, other):
+        return not isinstance(other, _End)
+
+
+_TAIL = _Node(_End(), 0)
+
+
+class RankedList:
+    """Sorted list of unique keys with indexing by position in O(log n).
+
+    Each link stores how many positions it skips, which lets insert, remove,
+    index-of and item-at all run in expected logarithmic time.
+    """
+
+    def __init__(self, sorted_keys=()):
+        self.size = 0
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [_TAIL] * MAX_LEVELS
+        # Levels above this only link head -> tail; searches start below it.
+        self._height = 1
+        if sorted_keys:
+            self._build(sorted_keys)
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _random_levels():
+        return min(MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+
+    def _build(self, sorted_keys):
+        """Links already-sorted unique keys in one O(n) pass."""
+        last = [self._head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        position = 0
+        for position, key in enumerate(sorted_keys, start=1):
+            node = _Node(key, self._random_levels())
+            self._height = max(self._height, len(node.next))
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(MAX_LEVELS):
+            last[level].next[level] = _TAIL
+            last[level].width[level] = position + 1 - last_position[level]
+        self.size = position
+
+    def insert(self, key):
+        chain = [self._head] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self._height)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        self._height = max(self._height, levels)
+        new = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [self._head] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self._height)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is _TAIL or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key) -> int:
+        """0-based position of `key` (or where it would be inserted)."""
+        node = self._head
+        position = 0
+        for level in reversed(range(self._height)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def index_after(self, key) -> int:
+        """Number of keys <= `key`, i.e. the position just past it."""
+        node = self._head
+        position = 0
+        for level in reversed(range(self._height)):
+            while node.next[level].key <= key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start, stop):
+        """Keys at positions [start, stop)."""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self._height)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class PageCache:
+    """Rendered leaderboard pages, dropped only when a score inside them moves.
+
+    Pages are stored under (scope, first key) together with their last key.
+    A score change from key A to key B shifts every entry between A and B by
+    one rank, so only pages overlapping that range are invalidated.
+    """
+
+    def __init__(self, max_pages=128):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, scope, first_key, last_key):
+        entry = self._pages.get((scope, first_key))
+        if entry is None or entry[0] != last_key:
+            return None
+        self._pages.move_to_end((scope, first_key))
+        return entry[1]
+
+    def put(self, scope, first_key, last_key, value):
+        """`last_key` None marks a page that runs to the end of the board."""
+        self._pages[(scope, first_key)] = (last_key, value)
+        self._pages.move_to_end((scope, first_key))
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, low, high=None):
+        """Drops pages overlapping [low, high]; `high` None means to the end."""
+        stale = [
+            page for page, (last_key, _) in self._pages.items()
+            if (high is None or page[1] <= high) and (last_key is None or low <= last_key)
+        ]
+        for page in stale:
+            del self._pages[page]
+
+    def clear(self):
+        self._pages.clear()
+
+
+class Leaderboard:
+    def __init__(self):
+        self._scores = {}
+        self._order = RankedList()
+        self.pages = PageCache()
+        # Bumped on every change so a re-sync can tell it raced with an update.
+        self.changes = 0
+        # Users given an absolute total with `set` since begin_resync(), or None.
+        self._resync_touched = None
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    @staticmethod
+    def _key(user_id, points):
+        return (-points, -user_id)
+
+    def begin_resync(self):
+        """Starts recording which users `set` touches, until the next load or end_resync."""
+        self._resync_touched = set()
+
+    def end_resync(self) -> set:
+        """Stops recording; returns the users `set` touched meanwhile."""
+        touched, self._resync_touched = self._resync_touched or set(), None
+        return touched
+
+    def load(self, rows) -> set:
+        """Replaces the whole board with (user_id, points) rows.
+
+        Returns the users given a total with `set` since begin_resync(); those
+        totals may be newer than `rows`.
+        """
+        self._scores = dict(rows)
+        self._order = RankedList(sorted(self._key(uid, pts) for uid, pts in self._scores.items()))
+        self.pages.clear()
+        self.changes += 1
+        return self.end_resync()
+
+    def set(self, user_id: int, points: int):
+        if self._resync_touched is not None:
+            self._resync_touched.add(user_id)
+        self._update(user_id, points)
+
+    def _update(self, user_id: int, points: int):
+        old = self._scores.get(user_id)
+        if old == points:
+            return
+        new_key = self._key(user_id, points)
+        if old is not None:
+            old_key = self._key(user_id, old)
+            self._order.remove(old_key)
+            self.pages.invalidate(min(old_key, new_key), max(old_key, new_key))
+        else:
+            # A new entry pushes everyone below it down a rank.
+            self.pages.invalidate(new_key)
+        self._scores[user_id] = points
+        self._order.insert(new_key)
+        self.changes += 1
+
+    def add(self, user_id: int, delta: int):
+        # Deltas are not recorded for a resync: they are still in the points buffer it reads.
+        self._update(user_id, self._scores.get(user_id, 0) + delta)
+
+    def points(self, user_id: int):
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int):
+        """1-based rank, or None for users with no points row."""
+        points = self._scores.get(user_id)
+        if points is None:
+            return None
+        return self._order.index(self._key(user_id, points)) + 1
+
+    def top(self, limit=10, offset=0):
+        """[(rank, user_id, points)] starting at `offset`."""
+        keys = self._order.slice(offset, offset + limit)
+        return [(offset + i + 1, -key[1], -key[0]) for i, key in enumerate(keys)]
+
+    def page_after(self, cursor=None, limit=10):
+        """Keyset page: the `limit` entries ranked below `cursor`.
+
+        `cursor` is the (points, user_id) of the last row already shown, or
+        None for the first page. Unlike an offset, it stays anchored to that
+        row while other scores move.
+        """
+        start = 0 if cursor is None else self._order.index_after(self._key(cursor[1], cursor[0]))
+        return self.top(limit, start)
+
+    def page_before(self, cursor, limit=10):
+        """The `limit` entries ranked above `cursor` (the first row shown)."""
+        end = self._order.index(self._key(cursor[1], cursor[0]))
+        return self.top(limit, max(end - limit, 0))
+
+    def page_bounds(self, rows, limit=10):
+        """(first key, last key) for PageCache; last is None on a short page."""
+        first_key = self._key(rows[0][1], rows[0][2])
+        last_key = self._key(rows[-1][1], rows[-1][2]) if len(rows) >= limit else None
+        return first_key, last_key
+
+    def around(self, user_id: int, radius=2):
+        """The user's entry with up to `radius` neighbours on each side."""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(rank - 1 - radius, 0)
+        return self.top(rank - start + radius, start)
+
+    def top_among(self, user_ids, limit=10):
+        """Top entries restricted to `user_ids` (e.g. a role's members).
+
+        Ranks are positions within the filtered set. O(m log limit) in the
+        number of candidates instead of a walk over the whole board.
+        """
+        scores = self._scores
+        best = heapq.nsmallest(
+            limit,
+            (self._key(uid, scores[uid]) for uid in user_ids if uid in scores),
+        )
+        return [(i + 1, -key[1], -key[0]) for i, key in enumerate(best)]
@@ -0,0 +1,252 @@
+"""Live copy of the SQLite database into PostgreSQL.
+
+While the bot keeps running on SQLite, triggers record the key of every row
+written into `migration_changes`. Each table is then copied in key order,
+one batch at a time, and the change log is replayed: the current source row
+is re-read and upserted, or deleted from the target if it is gone. A final
+replay and a per-table row count and checksum comparison run inside a
+`BEGIN IMMEDIATE` transaction on the source: it holds SQLite's write lock,
+so neither this bot nor the AI bot can write until it ends, and writes only
+pause for that last step. A run that fails or does not verify drops the
+capture triggers again.
+
+Cutover is a restart with DATABASE_URL pointing at the target. Writes made
+between verification and the restart are still captured, and
+`finish_migration` replays them at startup before the bot uses Postgres.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from migrations import migrate
+from storage import Database, Statement
+
+BATCH_SIZE = 1000
+# Live catch-up passes before the rest is replayed under the write lock;
+# a busy bot could otherwise keep the log from ever draining.
+MAX_CATCHUP_ROUNDS = 5
+
+# table: (key column, columns). schema_version is left out; the target
+# runs its own migrations.
+TABLES = {
+    "points": ("user_id", ("user_id", "points")),
+    "config": ("guild_id", ("guild_id", "points_channel")),
+    "salaries": ("user_id", ("user_id", "last_salary")),
+    "antifarm": ("user_id", ("user_id", "last_msg", "last_time")),
+    "cooldowns": ("user_id", ("user_id", "last_message")),
+    "blacklist": ("user_id", ("user_id", "reason", "end_date")),
+    "points_ledger": ("id", ("id", "user_id", "delta", "reason", "source", "created_at")),
+    "ledger_watermark": ("id", ("id", "last_id", "compacted_at")),
+}
+
+CREATE_CHANGES = "CREATE TABLE IF NOT EXISTS migration_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, row_key INTEGER NOT NULL)"
+CREATE_STATE = "CREATE TABLE IF NOT EXISTS migration_state (id INTEGER PRIMARY KEY, replayed_seq INTEGER NOT NULL, verified_at DOUBLE PRECISION)"
+LAST_CHANGE = Statement("migration_last_change", "SELECT COALESCE(MAX(seq), 0) AS seq FROM migration_changes")
+CHANGES_AFTER = Statement("migration_changes_after", "SELECT seq, table_name, row_key FROM migration_changes WHERE seq > ? AND seq <= ? ORDER BY seq LIMIT ?")
+GET_STATE = Statement("migration_state_get", "SELECT replayed_seq, verified_at FROM migration_state WHERE id = 1")
+SAVE_STATE = Statement("migration_state_save", "INSERT INTO migration_state (id, replayed_seq, verified_at) VALUES (1, ?, ?) ON CONFLICT (id) DO UPDATE SET replayed_seq = excluded.replayed_seq, verified_at = excluded.verified_at")
+# Rows copied with explicit ids leave the sequence behind; new appends must start past them.
+SYNC_LEDGER_SEQUENCE = "SELECT setval(pg_get_serial_sequence('points_ledger', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM points_ledger"
+
+
+async def sync_ledger_sequence(target):
+    # SQLite's AUTOINCREMENT already moves past explicit ids.
+    if target.dialect == "postgres":
+        await target.fetchone(SYNC_LEDGER_SEQUENCE)
+
+
+def _statements(table, key, columns):
+    names = ", ".join(columns)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != key)
+    return {
+        "first_page": Statement(f"migration_{table}_first_page", f"SELECT {names} FROM {table} ORDER BY {key} LIMIT ?"),
+        "page": Statement(f"migration_{table}_page", f"SELECT {names} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?"),
+        "upsert": Statement(
+            f"migration_{table}_upsert",
+            f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT ({key}) DO UPDATE SET {updates}",
+        ),
+        "delete": Statement(f"migration_{table}_delete", f"DELETE FROM {table} WHERE {key} = ?"),
+    }
+
+
+STATEMENTS = {table: _statements(table, key, columns) for table, (key, columns) in TABLES.items()}
+
+
+async def pages(db, table, batch_size=BATCH_SIZE):
+    """Yields a table's rows as tuples in key order, one keyset page at a time."""
+    key_index = TABLES[table][1].index(TABLES[table][0])
+    statements = STATEMENTS[table]
+    rows = await db.fetchall(statements["first_page"], (batch_size,))
+    while rows:
+        yield [tuple(row) for row in rows]
+        if len(rows) < batch_size:
+            return
+        rows = await db.fetchall(statements["page"], (rows[-1][key_index], batch_size))
+
+
+async def table_checksum(db, table):
+    """(row count, sha256 of every row in key order); identical on both dialects."""
+    digest = hashlib.sha256()
+    count = 0
+    async for rows in pages(db, table):
+        for row in rows:
+            digest.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            digest.update(b"\n")
+        count += len(rows)
+    return count, digest.hexdigest()
+
+
+class LiveMigration:
+    """Copies `source` (the bot's live SQLite handle) into `target` (Postgres)."""
+
+    def __init__(self, source, target, batch_size=BATCH_SIZE, on_progress=None):
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.replayed_seq = 0
+        self.copied = {}
+
+    async def _progress(self, text):
+        logging.info(f"Live migration: {text}")
+        if self.on_progress:
+            await self.on_progress(text)
+
+    # ---------------------------------------------------------- capture
+
+    async def install_capture(self):
+        async with self.source.transaction() as tx:
+            await tx.execute(CREATE_CHANGES)
+            await tx.execute(CREATE_STATE)
+            for table, (key, _) in TABLES.items():
+                for event, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+                    await tx.execute(
+                        f"CREATE TRIGGER IF NOT EXISTS capture_{table}_{event} AFTER {event.upper()} ON {table} "
+                        f"BEGIN INSERT INTO migration_changes (table_name, row_key) VALUES ('{table}', {row}.{key}); END"
+                    )
+
+    async def remove_capture(self):
+        async with self.source.transaction() as tx:
+            for table in TABLES:
+                for event in ("insert", "update", "delete"):
+                    await tx.execute(f"DROP TRIGGER IF EXISTS capture_{table}_{event}")
+            await tx.execute("DROP TABLE IF EXISTS migration_changes")
+            await tx.execute("DROP TABLE IF EXISTS migration_state")
+
+    # ---------------------------------------------------------- copy & replay
+
+    async def copy_table(self, table):
+        upsert = STATEMENTS[table]["upsert"]
+        copied = 0
+        async for rows in pages(self.source, table, self.batch_size):
+            await self.target.executemany(upsert, rows)
+            copied += len(rows)
+        self.copied[table] = copied
+        return copied
+
+    async def replay(self, source=None):
+        """Applies the changes captured so far after `replayed_seq`; returns how many."""
+        source = source or self.source
+        # Stops at the current end of the log, so one pass always finishes.
+        until = (await source.fetchone(LAST_CHANGE))["seq"]
+        applied = 0
+        while True:
+            changes = await source.fetchall(CHANGES_AFTER, (self.replayed_seq, until, self.batch_size))
+            if not changes:
+                return applied
+            keys = {}
+            for change in changes:
+                keys.setdefault(change["table_name"], set()).add(change["row_key"])
+
+            async with self.target.transaction() as tx:
+                for table, table_keys in keys.items():
+                    key, columns = TABLES[table]
+                    marks = ", ".join("?" * len(table_keys))
+                    # Read after the log entries, so a later write always has a later seq.
+                    rows = await source.fetchall(f"SELECT {', '.join(columns)} FROM {table} WHERE {key} IN ({marks})", list(table_keys))
+                    rows = [tuple(row) for row in rows]
+                    if rows:
+                        await tx.executemany(STATEMENTS[table]["upsert"], rows)
+                    gone = table_keys - {row[columns.index(key)] for row in rows}
+                    if gone:
+                        await tx.executemany(STATEMENTS[table]["delete"], [(k,) for k in gone])
+            self.replayed_seq = changes[-1]["seq"]
+            applied += len(changes)
+
+    async def verify(self, source=None):
+        """{table: (source count, target count, checksums match)}."""
+        source = source or self.source
+        report = {}
+        for table in TABLES:
+            source_count, source_sum = await table_checksum(source, table)
+            target_count, target_sum = await table_checksum(self.target, table)
+            report[table] = (source_count, target_count, source_sum == target_sum)
+        return report
+
+    # ---------------------------------------------------------- full run
+
+    async def run(self):
+        """Copies, drains the change log and verifies. Returns (ok, report).
+
+        Unless it verifies, the capture triggers are removed again on the way out.
+        """
+        started = time.monotonic()
+        await migrate(self.target)
+        await self.install_capture()
+        ok = False
+        try:
+            # Anything logged before the copy starts is read by the copy itself.
+            self.replayed_seq = (await self.source.fetchone(LAST_CHANGE))["seq"]
+
+            for table in TABLES:
+                copied = await self.copy_table(table)
+                await self._progress(f"{table}: {copied:,} rows copied")
+
+            for _ in range(MAX_CATCHUP_ROUNDS):
+                applied = await self.replay()
+                await self._progress(f"replayed {applied:,} changes made during the copy")
+                if applied < self.batch_size:
+                    break
+
+            async with self.source.transaction() as tx:
+                # The bot's own writes wait on the transaction lock; IMMEDIATE takes
+                # SQLite's write lock as well, so other processes wait too.
+                await tx.execute("BEGIN IMMEDIATE")
+                await self.replay(tx)
+                report = await self.verify(tx)
+                ok = all(match and source_count == target_count for source_count, target_count, match in report.values())
+                if ok:
+                    await sync_ledger_sequence(self.target)
+                    await tx.execute(SAVE_STATE, (self.replayed_seq, time.time()))
+        finally:
+            if not ok:
+                await self.remove_capture()
+        await self._progress(f"{'verified' if ok else 'verification failed'} in {time.monotonic() - started:.1f}s")
+        return ok, report
+
+
+async def finish_migration(sqlite_path, target):
+    """Replays writes captured after a verified migration; run at startup on Postgres.
+
+    Returns the number of changes applied, or None when there is nothing to finish.
+    """
+    if not os.path.exists(sqlite_path):
+        return None
+    source = Database(None, sqlite_path=sqlite_path)
+    await source.connect()
+    try:
+        exists = await source.fetchone("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'migration_state'")
+        state = await source.fetchone(GET_STATE) if exists else None
+        if not state or state["verified_at"] is None:
+            return None
+        migration = LiveMigration(source, target)
+        migration.replayed_seq = state["replayed_seq"]
+        applied = await migration.replay()
+        await sync_ledger_sequence(target)
+        await migration.remove_capture()
+        logging.info(f"Finished SQLite -> PostgreSQL migration, replayed {applied} late changes.")
+        return applied
+    finally:
+        await source.close()
@@ -0,0 +1,124 @@
+"""Batched delivery of log embeds.
+
+`post` only queues an embed for its channel and returns. Every
+`flush_interval` seconds each channel's queue is drained in messages of up
+to 10 embeds (and at most 6000 characters, Discord's per-message limits),
+so a payroll run that logs hundreds of events costs a few dozen requests
+instead of one each. Channels are flushed concurrently, and with webhooks
+enabled each channel posts through its own webhook, which has a rate-limit
+bucket separate from the bot's channel sends.
+
+A channel's queue is bounded; past `max_queue` the oldest entries are
+dropped and counted.
+"""
+import asyncio
+import logging
+from collections import deque
+
+import discord
+
+MAX_EMBEDS = 10
+MAX_CHARS = 6000
+WEBHOOK_NAME = "Points Logs"
+
+
+class LogDispatcher:
+    def __init__(self, flush_interval=2.0, max_queue=500, use_webhooks=False):
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.use_webhooks = use_webhooks
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.dropped = 0
+        # channel id -> (channel, deque of embeds)
+        self._queues = {}
+        # channel id -> Webhook, or None once creating one was refused.
+        self._webhooks = {}
+        self._task = None
+
+    def post(self, channel, embed: discord.Embed):
+        """Queues `embed` for `channel`; never waits on Discord."""
+        entry = self._queues.get(channel.id)
+        if entry is None:
+            entry = self._queues[channel.id] = (channel, deque())
+        queue = entry[1]
+        if len(queue) >= self.max_queue:
+            queue.popleft()
+            self.dropped += 1
+        queue.append(embed)
+
+    def pending(self) -> int:
+        return sum(len(queue) for _, queue in self._queues.values())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the flusher and sends whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        queues = [entry for entry in self._queues.values() if entry[1]]
+        if queues:
+            await asyncio.gather(*(self._drain(channel, queue) for channel, queue in queues))
+
+    @staticmethod
+    def _take(queue):
+        """Pops the next message's worth of embeds."""
+        batch = []
+        chars = 0
+        while queue and len(batch) < MAX_EMBEDS:
+            size = len(queue[0])
+            if batch and chars + size > MAX_CHARS:
+                break
+            batch.append(queue.popleft())
+            chars += size
+        return batch
+
+    async def _drain(self, channel, queue):
+        while queue:
+            batch = self._take(queue)
+            try:
+                webhook = await self._webhook(channel) if self.use_webhooks else None
+                if webhook is not None:
+                    await webhook.send(embeds=batch)
+                else:
+                    await channel.send(embeds=batch)
+            except Exception as e:
+                logging.error(f"Failed to send {len(batch)} log embeds to '{channel.name}': {e}")
+                if isinstance(e, discord.NotFound):
+                    # Webhook deleted; look it up again next time.
+                    self._webhooks.pop(channel.id, None)
+                continue
+            self.sent_messages += 1
+            self.sent_embeds += len(batch)
+
+    async def _webhook(self, channel):
+        if channel.id in self._webhooks:
+            return self._webhooks[channel.id]
+        webhook = None
+        try:
+            me = channel.guild.me
+            webhook = next((w for w in await channel.webhooks() if w.name == WEBHOOK_NAME and w.user == me), None)
+            if webhook is None:
+                webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+        except discord.Forbidden:
+            logging.warning(f"Missing 'Manage Webhooks' in '{channel.name}'; logging there through the bot instead.")
+        self._webhooks[channel.id] = webhook
+        return webhook
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Log flush failed: {e}")
@@ -0,0 +1,76 @@
+"""On-demand member lookups for low-memory mode.
+
+With the member cache turned off, `guild.get_member` only knows the bot
+itself, so commands that show other people (-top, -rank) resolve them here
+instead. Hits come from a small LRU; misses are fetched together over the
+gateway (`query_members`, up to 100 ids per request) and kept for `ttl`
+seconds. Users who have left the guild are remembered as misses too, so a
+page of former members is not re-queried on every view.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import discord
+
+QUERY_LIMIT = 100
+
+
+class MemberLRU:
+    def __init__(self, max_size=1000, ttl=600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # (guild id, user id) -> (fetched_at, Member or None)
+        self._members = OrderedDict()
+
+    def __len__(self):
+        return len(self._members)
+
+    def _get(self, key, now):
+        entry = self._members.get(key)
+        if entry is None or now - entry[0] >= self.ttl:
+            return False, None
+        self._members.move_to_end(key)
+        return True, entry[1]
+
+    def _put(self, key, member, now):
+        self._members[key] = (now, member)
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    async def resolve(self, guild, user_ids) -> dict:
+        """{user_id: Member} for the ids that are in `guild`."""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is None:
+                cached, member = self._get((guild.id, user_id), now)
+                if not cached:
+                    missing.append(user_id)
+                    continue
+                self.hits += 1
+            if member is not None:
+                found[user_id] = member
+
+        self.misses += len(missing)
+        for start in range(0, len(missing), QUERY_LIMIT):
+            batch = missing[start:start + QUERY_LIMIT]
+            try:
+                members = await guild.query_members(user_ids=batch, limit=QUERY_LIMIT, cache=False)
+            except (asyncio.TimeoutError, discord.DiscordException) as e:
+                logging.warning(f"Member lookup in {guild.name} failed: {e}")
+                continue
+            fetched = {member.id: member for member in members}
+            for user_id in batch:
+                member = fetched.get(user_id)
+                self._put((guild.id, user_id), member, now)
+                if member is not None:
+                    found[user_id] = member
+        return found
+
@@ -0,0 +1,99 @@
+"""Versioned schema migrations shared by both bots.
+
+`MIGRATIONS` is the single source of truth for the schema. Each entry is
+applied once, in order, and recorded in `schema_version`, so SQLite and
+PostgreSQL end up with the same tables and indexes whichever bot starts
+first. Steps are written to be idempotent, which makes it safe for two
+processes to migrate at the same time and for databases created by the old
+ad hoc `CREATE TABLE IF NOT EXISTS` code to be adopted as-is.
+
+A step is either one SQL string valid on both dialects or a
+{"sqlite": ..., "postgres": ...} dict (None skips that dialect).
+"""
+import logging
+import time
+
+from storage import Statement
+
+MIGRATIONS = [
+    (1, "base tables", [
+        "CREATE TABLE IF NOT EXISTS points (user_id BIGINT PRIMARY KEY, points INTEGER DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS config (guild_id BIGINT PRIMARY KEY, points_channel BIGINT)",
+        "CREATE TABLE IF NOT EXISTS salaries (user_id BIGINT PRIMARY KEY, last_salary DOUBLE PRECISION)",
+        "CREATE TABLE IF NOT EXISTS antifarm (user_id BIGINT PRIMARY KEY, last_msg TEXT, last_time DOUBLE PRECISION)",
+        "CREATE TABLE IF NOT EXISTS cooldowns (user_id BIGINT PRIMARY KEY, last_message DOUBLE PRECISION)",
+        "CREATE TABLE IF NOT EXISTS blacklist (user_id BIGINT PRIMARY KEY, reason TEXT, end_date DOUBLE PRECISION)",
+    ]),
+    (2, "timestamp precision on postgres", [
+        # REAL is 4 bytes on Postgres: unix timestamps lost ~2 minutes of precision.
+        {"sqlite": None, "postgres": "ALTER TABLE salaries ALTER COLUMN last_salary TYPE DOUBLE PRECISION"},
+        {"sqlite": None, "postgres": "ALTER TABLE antifarm ALTER COLUMN last_time TYPE DOUBLE PRECISION"},
+        {"sqlite": None, "postgres": "ALTER TABLE cooldowns ALTER COLUMN last_message TYPE DOUBLE PRECISION"},
+        {"sqlite": None, "postgres": "ALTER TABLE blacklist ALTER COLUMN end_date TYPE DOUBLE PRECISION"},
+    ]),
+    (3, "leaderboard and blacklist expiry indexes", [
+        # -top and rank queries walk this backwards: ORDER BY points DESC, user_id DESC.
+        "CREATE INDEX IF NOT EXISTS idx_points_points ON points (points, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_blacklist_end_date ON blacklist (end_date)",
+    ]),
+    (4, "append-only points ledger", [
+        # AUTOINCREMENT: ids are never reused, so the compaction watermark only moves forward.
+        {"sqlite": "CREATE TABLE IF NOT EXISTS points_ledger (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id BIGINT NOT NULL, delta INTEGER NOT NULL, reason TEXT, source TEXT NOT NULL, created_at DOUBLE PRECISION NOT NULL)",
+         "postgres": "CREATE TABLE IF NOT EXISTS points_ledger (id BIGSERIAL PRIMARY KEY, user_id BIGINT NOT NULL, delta INTEGER NOT NULL, reason TEXT, source TEXT NOT NULL, created_at DOUBLE PRECISION NOT NULL)"},
+        # Unfolded entries of one user (current totals) and one user's history (point-in-time balances).
+        "CREATE INDEX IF NOT EXISTS idx_ledger_user_id ON points_ledger (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ledger_user_time ON points_ledger (user_id, created_at)",
+        "CREATE TABLE IF NOT EXISTS ledger_watermark (id INTEGER PRIMARY KEY, last_id BIGINT NOT NULL, compacted_at DOUBLE PRECISION)",
+        # Existing totals become opening balances that are already folded into points.
+        {"sqlite": "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) SELECT user_id, points, 'opening balance', 'migration', CAST(strftime('%s', 'now') AS REAL) FROM points WHERE points <> 0 AND NOT EXISTS (SELECT 1 FROM ledger_watermark)",
+         "postgres": "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) SELECT user_id, points, 'opening balance', 'migration', EXTRACT(EPOCH FROM now()) FROM points WHERE points <> 0 AND NOT EXISTS (SELECT 1 FROM ledger_watermark)"},
+        # WHERE true: SQLite needs it to parse ON CONFLICT after INSERT ... SELECT.
+        "INSERT INTO ledger_watermark (id, last_id) SELECT 1, COALESCE(MAX(id), 0) FROM points_ledger WHERE true ON CONFLICT (id) DO NOTHING",
+    ]),
+    (5, "drop stored message text", [
+        # antifarm.last_msg now holds message fingerprints; old rows held raw text.
+        "DELETE FROM antifarm",
+    ]),
+]
+
+CREATE_VERSION_TABLE = "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at DOUBLE PRECISION NOT NULL)"
+GET_VERSION = Statement("schema_version_get", "SELECT MAX(version) AS version FROM schema_version")
+# Serialises migrations across processes on Postgres; SQLite's write lock already does.
+MIGRATION_LOCK = "SELECT pg_advisory_xact_lock(7305311)"
+RECORD_VERSION = Statement("schema_version_record", "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?) ON CONFLICT (version) DO NOTHING")
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(db) -> int:
+    await db.execute(CREATE_VERSION_TABLE)
+    row = await db.fetchone(GET_VERSION)
+    return (row["version"] if row else None) or 0
+
+
+async def migrate(db):
+    """Brings the schema up to LATEST_VERSION. Returns [(version, description)] applied."""
+    version = await current_version(db)
+    applied = []
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        async with db.transaction() as tx:
+            if db.dialect == "postgres":
+                await tx.execute(MIGRATION_LOCK)
+                # Another process may have applied it while we waited for the lock.
+                row = await tx.fetchone(GET_VERSION)
+                if row and row["version"] and row["version"] >= number:
+                    continue
+            for step in steps:
+                sql = step.get(db.dialect) if isinstance(step, dict) else step
+                if sql:
+                    await tx.execute(sql)
+            await tx.execute(RECORD_VERSION, (number, description, time.time()))
+        applied.append((number, description))
+        logging.info(f"Applied schema migration {number}: {description}")
+
+    if applied:
+        # Fresh statistics so the planner picks up the new indexes.
+        await db.execute("ANALYZE")
+    return applied
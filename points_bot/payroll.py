@@ -0,0 +1,70 @@
+"""Who is on the payroll and who is due.
+
+A run is one pass over each guild's cached members, checking each member's
+role ids against the salaried set. (`Role.members` scans the whole member
+cache on every call, so walking the salaried roles would cost one full scan
+per role.) Someone holding several salaried roles, in one guild or several,
+is paid once, for the best-paying role.
+
+Without a member cache (low-memory mode) `guild.members` is empty; the bot
+fetches each guild's member list for the run instead and passes it to
+`collect_staff_from_members`.
+"""
+
+
+def _add(staff, member, role, amount):
+    if member.bot:
+        return
+    current = staff.get(member.id)
+    if current is None or amount > current[2]:
+        staff[member.id] = (member, role, amount)
+
+
+def collect_staff(guilds, salaries: dict) -> dict:
+    """{user_id: (member, role, amount)} for every non-bot member of a salaried role."""
+    salaried = frozenset(salaries)
+    staff = {}
+    for guild in guilds:
+        for member in guild.members:
+            # The raw role ids; `member.roles` would build and sort Role objects for everyone.
+            for role_id in salaried.intersection(member._roles):
+                role = guild.get_role(role_id)
+                if role is not None:
+                    _add(staff, member, role, salaries[role_id])
+    return staff
+
+
+def collect_staff_from_members(members, salaries: dict, permissions, staff=None) -> dict:
+    """Same as `collect_staff`, from an uncached member list; merges into `staff` if given.
+
+    Which salaried roles a member holds comes from the `Permissions` service.
+    """
+    staff = {} if staff is None else staff
+    for member in members:
+        if not permissions.is_staff(member):
+            continue
+        for role_id in permissions.salary_role_ids(member):
+            role = member.guild.get_role(role_id)
+            if role is not None:
+                _add(staff, member, role, salaries[role_id])
+    return staff
+
+
+def merge_staff(staff: dict, other: dict) -> dict:
+    """Folds another collection (e.g. another shard's) into `staff`, keeping the best-paying role."""
+    for member, role, amount in other.values():
+        _add(staff, member, role, amount)
+    return staff
+
+
+def split_due(staff, last_paid: dict, now: float, cooldown: float):
+    """([user ids due now], earliest due time among the rest or None)."""
+    due = []
+    upcoming = None
+    for user_id in staff:
+        last = last_paid.get(user_id)
+        if last is None or now - last >= cooldown:
+            due.append(user_id)
+        elif upcoming is None or last + cooldown < upcoming:
+            upcoming = last + cooldown
+    return due, upcoming
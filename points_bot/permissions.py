@@ -0,0 +1,69 @@
+"""Cached permission checks.
+
+Admin, salary and protected lookups are frozenset membership tests, and each
+member's verdict (admin or not, which salary roles they hold) is computed
+once from their roles and reused until a member or role event invalidates
+it. Admin commands, the control panel and the chat, payroll and role
+subsystems all ask this one service.
+
+With `cache=False` (low-memory mode) verdicts are computed on every call:
+without a member cache Discord does not deliver the member updates that
+would invalidate them.
+"""
+
+
+class _Verdict:
+    __slots__ = ("admin", "salary_role_ids")
+
+    def __init__(self, admin: bool, salary_role_ids: frozenset):
+        self.admin = admin
+        self.salary_role_ids = salary_role_ids
+
+
+class Permissions:
+    def __init__(self, admin_roles, salary_roles, protected_ids, cache=True):
+        self.admin_roles = frozenset(admin_roles)
+        self.salary_roles = frozenset(salary_roles)
+        self.protected_ids = frozenset(protected_ids)
+        self.cache = cache
+        # (guild id, member id) -> _Verdict
+        self._verdicts = {}
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def _verdict(self, member) -> _Verdict:
+        key = (member.guild.id, member.id)
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            role_ids = {role.id for role in member.roles}
+            verdict = _Verdict(
+                member.guild_permissions.administrator or not self.admin_roles.isdisjoint(role_ids),
+                self.salary_roles.intersection(role_ids),
+            )
+            if self.cache:
+                self._verdicts[key] = verdict
+        return verdict
+
+    def is_admin(self, member) -> bool:
+        return self._verdict(member).admin
+
+    def is_staff(self, member) -> bool:
+        """Holds at least one salaried role."""
+        return bool(self._verdict(member).salary_role_ids)
+
+    def salary_role_ids(self, member) -> frozenset:
+        return self._verdict(member).salary_role_ids
+
+    def is_protected(self, user_id: int) -> bool:
+        return user_id in self.protected_ids
+
+    # ---------------------------------------------------------- invalidation
+
+    def invalidate_member(self, member):
+        self._verdicts.pop((member.guild.id, member.id), None)
+
+    def invalidate_guild(self, guild):
+        """A role's permissions or the guild's owner changed; every verdict there may be stale."""
+        for key in [key for key in self._verdicts if key[0] == guild.id]:
+            del self._verdicts[key]
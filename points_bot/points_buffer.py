@@ -0,0 +1,171 @@
+"""Write-behind buffer for chat points.
+
+Per-message point deltas are collected in memory and written in a single
+transaction every few seconds or once enough users are pending, so a chat
+burst costs a handful of commits instead of one per message. Reads consult
+the buffer first so totals stay exact while entries are pending.
+
+Point deltas are appended to the ledger; the same background task folds the
+ledger into the `points` snapshot every `compact_interval` seconds.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import repository
+
+
+class PointsBuffer:
+    def __init__(self, db, flush_interval=5.0, max_pending=500, compact_interval=60.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.compact_interval = compact_interval
+        self.commits = 0
+        # Bumped after every successful flush or compaction; readers use it to
+        # detect that stored totals moved while they were waiting on the database.
+        self.generation = 0
+        self._last_compaction = time.monotonic()
+        self._points = {}
+        # Deltas taken by a flush that has not committed yet.
+        self._inflight = {}
+        self._wake = None
+        self._task = None
+        # Held by flush and compaction, and by read_with_pending while it reads.
+        self._lock = None
+        # Called with the user ids of each committed flush (cluster mode announces them).
+        self.on_flush = None
+
+    # ---------------------------------------------------------- writes
+
+    def add_points(self, user_id: int, amount: int):
+        self._points[user_id] = self._points.get(user_id, 0) + amount
+        self._check_size()
+
+    # ---------------------------------------------------------- reads
+
+    def pending_delta(self, user_id: int) -> int:
+        return self._points.get(user_id, 0) + self._inflight.get(user_id, 0)
+
+    def pending_points(self) -> dict:
+        """{user_id: delta} for every user with unflushed points."""
+        pending = dict(self._inflight)
+        for user_id, amount in self._points.items():
+            pending[user_id] = pending.get(user_id, 0) + amount
+        return pending
+
+    @asynccontextmanager
+    async def paused(self):
+        """Holds off flushes and compactions.
+
+        No delta can move from the buffer into the ledger, or from the ledger
+        into the snapshot, inside the block, so a stored total and the pending
+        deltas read there describe the same moment.
+        """
+        if self._lock is None:
+            yield
+            return
+        async with self._lock:
+            yield
+
+    async def read_with_pending(self, read):
+        """(await read(), pending_points()) as of one moment; see paused()."""
+        async with self.paused():
+            return await read(), self.pending_points()
+
+    async def read_points(self, user_id: int) -> int:
+        """Stored total plus everything still waiting to be flushed."""
+        while True:
+            generation = self.generation
+            stored = await repository.get_points(self.db, user_id)
+            if generation == self.generation:
+                return stored + self.pending_delta(user_id)
+
+    # ---------------------------------------------------------- flushing
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the background flusher and writes out whatever is left."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._points or not self.db.connected:
+            return
+        if self._lock is None:
+            return await self._flush()
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._points:
+            return
+        points, self._points = self._points, {}
+        self._inflight = points
+
+        try:
+            async with self.db.transaction() as tx:
+                now = time.time()
+                await repository.append_ledger(tx, [(uid, amount, None, "chat", now) for uid, amount in points.items()])
+        except Exception as e:
+            logging.error(f"Points buffer flush failed, keeping {len(points)} pending users: {e}")
+            self._restore(points)
+            return
+        finally:
+            self._inflight = {}
+
+        self.generation += 1
+        self.commits += 1
+        if self.on_flush is not None:
+            self.on_flush(list(points))
+
+    async def compact(self) -> int:
+        """Folds the ledger into the points snapshot; returns users updated."""
+        self._last_compaction = time.monotonic()
+        if not self.db.connected:
+            return 0
+        if self._lock is None:
+            return await self._compact()
+        async with self._lock:
+            return await self._compact()
+
+    async def _compact(self) -> int:
+        async with self.db.transaction() as tx:
+            folded = await repository.compact_ledger(tx)
+        if folded:
+            self.generation += 1
+        return folded
+
+    def _restore(self, points):
+        for user_id, amount in points.items():
+            self._points[user_id] = self._points.get(user_id, 0) + amount
+
+    def _check_size(self):
+        if self._wake is not None and len(self._points) >= self.max_pending:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            if time.monotonic() - self._last_compaction >= self.compact_interval:
+                try:
+                    await self.compact()
+                except Exception as e:
+                    logging.error(f"Ledger compaction failed: {e}")
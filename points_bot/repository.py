@@ -0,0 +1,267 @@
+"""Typed database operations for the points bot.
+
+Every query the bot runs lives here as a `storage.Statement`, compiled once
+per dialect and prepared once per connection. The SQL itself is written so
+the same text is valid on SQLite (>= 3.24) and PostgreSQL; only the
+placeholders differ, and `Statement` takes care of those.
+
+Functions accept either the `Database` or an open `Transaction`. Reads and
+single writes can go straight to the database; operations that need more
+than one statement (`compact_ledger`) must be given a transaction.
+
+Point changes are appended to `points_ledger` and only later folded into
+the `points` snapshot, so a user's total is their snapshot row plus their
+ledger entries above the compaction watermark.
+"""
+import time
+
+from storage import Statement
+
+# Keeps multi-row statements under SQLite's 999 bound-variable limit.
+BATCH_SIZE = 400
+
+_WATERMARK = "(SELECT last_id FROM ledger_watermark WHERE id = 1)"
+
+GET_POINTS = Statement(
+    "points_get",
+    "SELECT COALESCE((SELECT points FROM points WHERE user_id = ?), 0) "
+    f"+ COALESCE((SELECT SUM(delta) FROM points_ledger WHERE user_id = ? AND id > {_WATERMARK}), 0) AS points",
+)
+# Totals for many users at once; see rows_for_users.
+POINTS_FOR_USERS_SQL = (
+    "SELECT user_id, SUM(points) AS points FROM ("
+    "SELECT user_id, points FROM points WHERE user_id IN ({ids}) UNION ALL "
+    f"SELECT user_id, delta FROM points_ledger WHERE user_id IN ({{ids}}) AND id > {_WATERMARK}"
+    ") AS totals GROUP BY user_id"
+)
+POINTS_FOR_USERS = Statement(
+    "points_for_users", None,
+    "SELECT user_id, SUM(points) AS points FROM ("
+    "SELECT user_id, points FROM points WHERE user_id = ANY(?::bigint[]) UNION ALL "
+    f"SELECT user_id, delta FROM points_ledger WHERE user_id = ANY(?::bigint[]) AND id > {_WATERMARK}"
+    ") AS totals GROUP BY user_id",
+)
+# Every user's total in one statement, so a compaction cannot fold ledger
+# entries into the snapshot between reading the two (see iter_totals).
+ALL_TOTALS_SQL = (
+    "SELECT user_id, SUM(points) AS points FROM ("
+    "SELECT user_id, points FROM points UNION ALL "
+    f"SELECT user_id, delta FROM points_ledger WHERE id > {_WATERMARK}"
+    ") AS totals GROUP BY user_id"
+)
+
+APPEND_LEDGER = Statement("ledger_append", "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) VALUES (?, ?, ?, ?, ?)")
+LEDGER_BOUNDS = Statement("ledger_bounds", f"SELECT {_WATERMARK} AS last_id, (SELECT MAX(id) FROM points_ledger) AS max_id")
+# Set-based so a large batch never round-trips through Python.
+FOLD_LEDGER = Statement(
+    "ledger_fold",
+    "INSERT INTO points (user_id, points) SELECT user_id, SUM(delta) FROM points_ledger WHERE id > ? AND id <= ? GROUP BY user_id "
+    "ON CONFLICT (user_id) DO UPDATE SET points = points.points + excluded.points",
+)
+SET_WATERMARK = Statement("ledger_set_watermark", "UPDATE ledger_watermark SET last_id = ?, compacted_at = ? WHERE id = 1")
+BALANCE_AT = Statement("ledger_balance_at", "SELECT COALESCE(SUM(delta), 0) AS points FROM points_ledger WHERE user_id = ? AND created_at <= ?")
+LEDGER_HISTORY = Statement("ledger_history", "SELECT delta, reason, source, created_at FROM points_ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?")
+CLEAR_POINTS = Statement("points_clear", "DELETE FROM points")
+REBUILD_POINTS = Statement("points_rebuild", f"INSERT INTO points (user_id, points) SELECT user_id, SUM(delta) FROM points_ledger WHERE id <= {_WATERMARK} GROUP BY user_id")
+# Waits for in-flight appends to commit, so no smaller id can appear below the new watermark.
+LOCK_LEDGER = "LOCK TABLE points_ledger IN EXCLUSIVE MODE"
+
+LIVE_COOLDOWNS = Statement("cooldown_live", "SELECT user_id, last_message FROM cooldowns WHERE last_message > ?")
+TOUCH_COOLDOWN = Statement("cooldown_touch", "INSERT INTO cooldowns (user_id, last_message) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET last_message = excluded.last_message")
+
+LIVE_ANTIFARM = Statement("antifarm_live", "SELECT user_id, last_msg, last_time FROM antifarm WHERE last_time > ?")
+RECORD_ANTIFARM = Statement("antifarm_record", "INSERT INTO antifarm (user_id, last_msg, last_time) VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET last_msg = excluded.last_msg, last_time = excluded.last_time")
+
+SET_SALARY = Statement("salary_set", "INSERT INTO salaries (user_id, last_salary) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET last_salary = excluded.last_salary")
+LAST_SALARIES_SQL = "SELECT user_id, last_salary FROM salaries WHERE user_id IN ({ids})"
+LAST_SALARIES = Statement("salary_last_many", None, "SELECT user_id, last_salary FROM salaries WHERE user_id = ANY(?::bigint[])")
+
+GET_POINTS_CHANNEL = Statement("config_get_channel", "SELECT points_channel FROM config WHERE guild_id = ?")
+SET_POINTS_CHANNEL = Statement("config_set_channel", "INSERT INTO config (guild_id, points_channel) VALUES (?, ?) ON CONFLICT (guild_id) DO UPDATE SET points_channel = excluded.points_channel")
+DELETE_CONFIG = Statement("config_delete", "DELETE FROM config WHERE guild_id = ?")
+
+GET_BLACKLIST = Statement("blacklist_get", "SELECT reason, end_date FROM blacklist WHERE user_id = ?")
+UPSERT_BLACKLIST = Statement("blacklist_upsert", "INSERT INTO blacklist (user_id, reason, end_date) VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET reason = excluded.reason, end_date = excluded.end_date")
+DELETE_BLACKLIST = Statement("blacklist_delete", "DELETE FROM blacklist WHERE user_id = ?")
+# Scheduler seed, soonest first; walks idx_blacklist_end_date.
+BLACKLIST_EXPIRIES = Statement("blacklist_expiries", "SELECT user_id, end_date FROM blacklist ORDER BY end_date")
+
+
+# ============================================================
+# POINTS
+# ============================================================
+
+async def get_points(db, user_id: int) -> int:
+    row = await db.fetchone(GET_POINTS, (user_id, user_id))
+    return row["points"] if row else 0
+
+
+async def iter_totals(db, size: int = 1000):
+    """Streams (user_id, points) for every user from one consistent read."""
+    async with db.transaction() as tx:
+        async for rows in tx.iterate(ALL_TOTALS_SQL, size):
+            for row in rows:
+                yield row[0], row[1]
+
+
+async def rows_for_users(db, statement, query, user_ids, uses=1):
+    """Runs a lookup over many user ids.
+
+    Postgres gets the ids as one array parameter to `statement`; SQLite runs
+    `query` with its `{ids}` slots (`uses` of them) filled by IN lists of at
+    most BATCH_SIZE ids.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    if db.dialect == "postgres":
+        return await db.fetchall(statement, (user_ids,) * uses)
+    rows = []
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start:start + BATCH_SIZE]
+        marks = ", ".join(["?"] * len(batch))
+        rows.extend(await db.fetchall(query.format(ids=marks), batch * uses))
+    return rows
+
+
+async def points_for_users(db, user_ids) -> dict:
+    """{user_id: total} for the given users; like get_points, in one query per batch."""
+    rows = await rows_for_users(db, POINTS_FOR_USERS, POINTS_FOR_USERS_SQL, user_ids, uses=2)
+    return {row["user_id"]: row["points"] for row in rows}
+
+
+# ============================================================
+# LEDGER
+# ============================================================
+
+async def append_ledger(db, entries):
+    """entries: iterable of (user_id, delta, reason, source, created_at)."""
+    await db.executemany(APPEND_LEDGER, list(entries))
+
+
+async def compact_ledger(tx, now: float = None) -> int:
+    """Folds every committed entry above the watermark into `points`.
+
+    Ledger rows are kept for history; only the watermark moves. Returns the
+    number of users whose snapshot changed.
+    """
+    if tx.dialect == "postgres":
+        await tx.execute(LOCK_LEDGER)
+    bounds = await tx.fetchone(LEDGER_BOUNDS)
+    last_id, max_id = bounds["last_id"], bounds["max_id"]
+    if max_id is None or max_id <= last_id:
+        return 0
+    folded = await tx.execute(FOLD_LEDGER, (last_id, max_id))
+    await tx.execute(SET_WATERMARK, (max_id, now if now is not None else time.time()))
+    return folded
+
+
+async def rebuild_points(tx):
+    """Recomputes the whole snapshot from the ledger, e.g. after a bad manual edit."""
+    if tx.dialect == "postgres":
+        await tx.execute(LOCK_LEDGER)
+    await tx.execute(CLEAR_POINTS)
+    await tx.execute(REBUILD_POINTS)
+
+
+async def balance_at(db, user_id: int, when: float) -> int:
+    """The user's total as of `when` (unix time), replayed from the ledger."""
+    row = await db.fetchone(BALANCE_AT, (user_id, when))
+    return row["points"] if row else 0
+
+
+async def ledger_history(db, user_id: int, limit: int = 10):
+    """Newest first: rows of (delta, reason, source, created_at)."""
+    return await db.fetchall(LEDGER_HISTORY, (user_id, limit))
+
+
+# ============================================================
+# COOLDOWNS & ANTI-FARM
+# ============================================================
+
+async def live_cooldowns(db, since: float):
+    """[(user_id, last_message)] for cooldowns started after `since`."""
+    rows = await db.fetchall(LIVE_COOLDOWNS, (since,))
+    return [(row["user_id"], row["last_message"]) for row in rows]
+
+
+async def touch_cooldowns(db, entries):
+    """entries: iterable of (user_id, last_message)."""
+    await db.executemany(TOUCH_COOLDOWN, list(entries))
+
+
+async def live_antifarm(db, since: float):
+    """[(user_id, last_msg, last_time)] for messages seen after `since`."""
+    rows = await db.fetchall(LIVE_ANTIFARM, (since,))
+    return [(row["user_id"], row["last_msg"], row["last_time"]) for row in rows]
+
+
+async def record_antifarm(db, entries):
+    """entries: iterable of (user_id, last_msg, last_time)."""
+    await db.executemany(RECORD_ANTIFARM, list(entries))
+
+
+async def save_chat_state(tx, cooldowns, antifarm):
+    """Replaces both tables with a snapshot of the in-memory state."""
+    await tx.execute("DELETE FROM cooldowns")
+    await tx.execute("DELETE FROM antifarm")
+    if cooldowns:
+        await touch_cooldowns(tx, cooldowns)
+    if antifarm:
+        await record_antifarm(tx, antifarm)
+
+
+# ============================================================
+# SALARIES
+# ============================================================
+
+async def last_salaries(db, user_ids) -> dict:
+    """{user_id: last_salary} for the given users that were ever paid."""
+    rows = await rows_for_users(db, LAST_SALARIES, LAST_SALARIES_SQL, user_ids)
+    return {row["user_id"]: row["last_salary"] for row in rows}
+
+
+async def pay_salaries(tx, payouts, now: float):
+    """payouts: (user_id, amount, reason) rows; amount None records the payday without points."""
+    await append_ledger(tx, [(uid, amount, reason, "salary", now) for uid, amount, reason in payouts if amount])
+    await tx.executemany(SET_SALARY, [(uid, now) for uid, _, _ in payouts])
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+async def get_points_channel(db, guild_id: int):
+    row = await db.fetchone(GET_POINTS_CHANNEL, (guild_id,))
+    return row["points_channel"] if row else None
+
+
+async def set_points_channel(db, guild_id: int, channel_id: int):
+    await db.execute(SET_POINTS_CHANNEL, (guild_id, channel_id))
+
+
+async def remove_config(db, guild_id: int):
+    await db.execute(DELETE_CONFIG, (guild_id,))
+
+
+# ============================================================
+# BLACKLIST
+# ============================================================
+
+async def get_blacklist(db, user_id: int):
+    """Returns the row (reason, end_date) or None."""
+    return await db.fetchone(GET_BLACKLIST, (user_id,))
+
+
+async def add_blacklist(db, user_id: int, reason: str, end_date: float):
+    await db.execute(UPSERT_BLACKLIST, (user_id, reason, end_date))
+
+
+async def remove_blacklist(db, user_id: int):
+    await db.execute(DELETE_BLACKLIST, (user_id,))
+
+
+async def blacklist_expiries(db):
+    """[(user_id, end_date)], soonest expiry first."""
+    rows = await db.fetchall(BLACKLIST_EXPIRIES)
+    return [(row["user_id"], row["end_date"]) for row in rows]
@@ -0,0 +1,112 @@
+"""One-shot jobs that fire at a wall-clock time.
+
+Jobs sit in a heap ordered by due time and a single task sleeps until the
+earliest one, so an idle bot does no work between jobs and each job fires
+when it is due instead of on the next hourly sweep. Every job has a key;
+scheduling a key again replaces its pending job and cancelling only marks
+the heap entry, which is skipped when it reaches the top.
+
+Each due job runs in its own task, so a long one (a payroll run waits on
+every shard and on role API calls) does not hold back the jobs due after it.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+# Longest single sleep. Due times are wall-clock, so a clock step (NTP, suspend)
+# is noticed within this many seconds.
+MAX_SLEEP = 300
+
+
+class Scheduler:
+    def __init__(self):
+        # Entries are [due, seq, key, callback, args]; callback None marks a cancelled job.
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._wake = None
+        self._task = None
+        # Jobs that have fired and are still running.
+        self._running = set()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def due(self, key):
+        """Due time of the pending job under `key`, or None."""
+        entry = self._jobs.get(key)
+        return entry[0] if entry else None
+
+    def schedule(self, key, due: float, callback, *args):
+        """Runs `await callback(*args)` at unix time `due`, replacing any job under `key`."""
+        self.cancel(key)
+        entry = [due, next(self._seq), key, callback, args]
+        self._jobs[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._wake is not None and self._heap[0] is entry:
+            self._wake.set()
+
+    def cancel(self, key):
+        entry = self._jobs.pop(key, None)
+        if entry is None:
+            return
+        entry[3] = None
+        # Drop dead entries once they outnumber the live ones.
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [e for e in self._heap if e[3] is not None]
+            heapq.heapify(self._heap)
+
+    def start(self):
+        if self.running:
+            return
+        # Created here, inside the running loop.
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops firing jobs and cancels the ones still running."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            now = time.time()
+            while self._heap and (self._heap[0][3] is None or self._heap[0][0] <= now):
+                _, _, key, callback, args = heapq.heappop(self._heap)
+                if callback is None:
+                    continue
+                del self._jobs[key]
+                task = asyncio.create_task(self._fire(key, callback, args))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _fire(key, callback, args):
+        try:
+            await callback(*args)
+        except Exception as e:
+            logging.error(f"Scheduled job {key} failed: {e}")
@@ -0,0 +1,59 @@
+"""Shard-aware helpers for jobs that walk every guild.
+
+Work over `bot.guilds` is grouped by `guild.shard_id` and each shard's guilds
+are handled by their own task, so shards proceed concurrently and one slow
+or disconnected shard is given up on after `timeout` seconds instead of
+holding up the rest. A plain `commands.Bot` is one shard, id 0 (or its
+`shard_id`), so the same code runs with and without AutoShardedBot.
+"""
+import asyncio
+import logging
+
+
+def guilds_by_shard(bot) -> dict:
+    """{shard_id: [guilds]} for every available guild."""
+    shards = {}
+    for guild in bot.guilds:
+        if not guild.unavailable:
+            shards.setdefault(guild.shard_id, []).append(guild)
+    return shards
+
+
+def shard_latencies(bot) -> list:
+    """[(shard_id, latency in seconds)] for every shard this process runs."""
+    latencies = getattr(bot, "latencies", None)
+    if latencies is not None:
+        return sorted(latencies)
+    return [(bot.shard_id or 0, bot.latency)]
+
+
+def shard_is_closed(bot, shard_id) -> bool:
+    get_shard = getattr(bot, "get_shard", None)
+    if get_shard is None:
+        return bot.is_closed()
+    shard = get_shard(shard_id)
+    return shard is None or shard.is_closed()
+
+
+async def for_each_shard(bot, job, timeout: float):
+    """Runs `job(shard_id, guilds)` for all shards at once.
+
+    Returns ({shard_id: result}, [shard ids that were closed, failed or timed out]).
+    """
+    shards = guilds_by_shard(bot)
+    failed = [shard_id for shard_id in shards if shard_is_closed(bot, shard_id)]
+    running = [shard_id for shard_id in shards if shard_id not in failed]
+
+    async def run(shard_id):
+        return await asyncio.wait_for(job(shard_id, shards[shard_id]), timeout)
+
+    results = {}
+    outcomes = await asyncio.gather(*(run(shard_id) for shard_id in running), return_exceptions=True)
+    for shard_id, outcome in zip(running, outcomes):
+        if isinstance(outcome, BaseException):
+            reason = "timed out" if isinstance(outcome, asyncio.TimeoutError) else outcome
+            logging.warning(f"Shard {shard_id}: {job.__name__} skipped ({reason})")
+            failed.append(shard_id)
+        else:
+            results[shard_id] = outcome
+    return results, failed
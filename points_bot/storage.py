@@ -0,0 +1,460 @@
+"""Async database access for the points bot.
+
+SQLite goes through aiosqlite; PostgreSQL goes through a psycopg2 connection
+pool whose calls run on worker threads, so no query ever runs on the
+discord.py event loop. Every call opens its own cursor, and a transaction
+keeps one connection to itself until it commits.
+
+Pooled Postgres connections are health-checked on checkout and replaced when
+they break. If the server is unreachable, new connection attempts back off
+exponentially instead of failing on every message, so a managed-database
+failover costs a few seconds of errors rather than a dead points system.
+
+SQLite connections get one of the `SQLITE_PROFILES` pragma sets at connect.
+The WAL profiles run a background checkpoint so the -wal file stays bounded
+while other processes (the AI bot) keep reading.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiosqlite
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+SQLITE_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'system.db')
+
+# Connections idle for longer than this are pinged before being handed out.
+HEALTH_CHECK_IDLE = 30
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# Pragmas applied to every SQLite connection, picked with SQLITE_PROFILE.
+SQLITE_PROFILES = {
+    # SQLite's own defaults: rollback journal, fsync on every commit.
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    # WAL with fsync only at checkpoints; a power cut can lose the last
+    # commits but never corrupts the file.
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,  # KiB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "journal_size_limit": 64 * 1024 * 1024,
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+        "journal_size_limit": 128 * 1024 * 1024,
+    },
+}
+CHECKPOINT_INTERVAL = 60
+# Above this the checkpoint also truncates the -wal file back to zero.
+WAL_TRUNCATE_BYTES = 32 * 1024 * 1024
+
+# Errors raised when a new connection cannot be opened.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class DatabaseUnavailable(psycopg2.OperationalError):
+    """Raised while reconnect attempts are backing off."""
+
+
+class Statement:
+    """A query compiled once per dialect and reused on every call.
+
+    Written with `?` placeholders. On Postgres it is sent once per connection
+    as a named server-side PREPARE and then run with EXECUTE; on SQLite the
+    fixed text is served from the connection's statement cache.
+    """
+    _names = set()
+
+    def __init__(self, name, sql, postgres_sql=None):
+        if name in Statement._names:
+            raise ValueError(f"Duplicate statement name: {name}")
+        Statement._names.add(name)
+        self.name = name
+        self.sqlite = sql
+        pg = postgres_sql or sql
+        parts = pg.split("?")
+        self.param_count = len(parts) - 1
+        self.postgres = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+        args = ", ".join(["%s"] * self.param_count)
+        self.execute_sql = f"EXECUTE {name} ({args})" if args else f"EXECUTE {name}"
+
+    def __repr__(self):
+        return f"<Statement {self.name}>"
+
+
+class Transaction:
+    """Statements issued inside `Database.transaction()`; committed together on exit."""
+
+    def __init__(self, database, conn=None):
+        self._db = database
+        self._conn = conn
+
+    @property
+    def dialect(self):
+        return self._db.dialect
+
+    async def execute(self, query, params=()):
+        return await self._db._run(self._conn, query, params)
+
+    async def executemany(self, query, seq_of_params):
+        return await self._db._run(self._conn, query, seq_of_params, many=True)
+
+    async def fetchone(self, query, params=()):
+        return await self._db._run(self._conn, query, params, fetch="one")
+
+    async def fetchall(self, query, params=()):
+        return await self._db._run(self._conn, query, params, fetch="all")
+
+    async def iterate(self, query, size=1000):
+        """Yields the rows of `query` in lists of up to `size` without loading them all."""
+        async for rows in self._db._iterate(self._conn, query, size):
+            yield rows
+
+    async def copy(self, sql, stream):
+        """Runs COPY ... FROM STDIN or TO STDOUT against a file-like `stream` (Postgres only)."""
+        return await self._db._in_thread(self._db._copy_postgres, self._conn, sql, stream)
+
+
+class Database:
+    """Single async handle shared by every command, event and background loop."""
+
+    _cursor_ids = itertools.count()
+
+    def __init__(self, database_url=None, sqlite_path=SQLITE_PATH, pool_size=5, statement_timeout=5.0, sqlite_profile="balanced"):
+        if sqlite_profile not in SQLITE_PROFILES:
+            raise ValueError(f"Unknown SQLite profile '{sqlite_profile}', expected one of {', '.join(SQLITE_PROFILES)}")
+        self.database_url = database_url
+        self.sqlite_path = sqlite_path
+        self.dialect = "postgres" if database_url else "sqlite"
+        self.pool_size = pool_size
+        self.statement_timeout = statement_timeout
+        self._conn = None
+        self._lock = None
+        # SQLite only
+        self.sqlite_profile = sqlite_profile
+        self.pragmas = {}
+        self.last_checkpoint = None
+        self._checkpoint_task = None
+        # Postgres only
+        self._pool = None
+        self._slots = None
+        self._executor = None
+        self._last_used = {}
+        self._prepared = {}
+        self._retry_at = 0.0
+        self._retry_delay = RECONNECT_MIN_DELAY
+        self._reconnect_lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        if self.dialect == "postgres":
+            return self._pool is not None
+        return self._conn is not None
+
+    async def connect(self):
+        """Opens the connection (or pool). Safe to call again after a reconnect."""
+        if self.connected:
+            return
+        # Created here rather than in __init__ so they bind to the running loop.
+        self._lock = asyncio.Lock()
+
+        if self.dialect == "postgres":
+            self._slots = asyncio.Semaphore(self.pool_size)
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="postgres")
+            # minconn=0: the pool itself never fails to open, connections are
+            # made (and retried with backoff) on first checkout.
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                0, self.pool_size, self.database_url,
+                sslmode='require',
+                connect_timeout=10,
+                keepalives=1,
+                keepalives_idle=30,
+                keepalives_interval=10,
+                keepalives_count=3,
+                options=f"-c statement_timeout={int(self.statement_timeout * 1000)}",
+            )
+            # Raised after construction so returned connections stay pooled
+            # (psycopg2 closes anything returned beyond minconn).
+            self._pool.minconn = self.pool_size
+            try:
+                await self.fetchone("SELECT 1")
+                logging.info(f"Connected to PostgreSQL database (pool of {self.pool_size}).")
+            except psycopg2.Error as e:
+                logging.error(f"Could not connect to PostgreSQL database, will keep retrying: {e}")
+        else:
+            self._conn = await aiosqlite.connect(self.sqlite_path, cached_statements=256)
+            self._conn.row_factory = sqlite3.Row
+            await self._apply_profile()
+            logging.info(f"Connected to SQLite database ({self.sqlite_profile} profile, journal_mode={self.pragmas.get('journal_mode')}).")
+            if self.pragmas.get("journal_mode") == "wal":
+                self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def close(self):
+        if not self.connected:
+            return
+        if self.dialect == "postgres":
+            pool, self._pool = self._pool, None
+            await self._in_thread(pool.closeall)
+            self._executor.shutdown(wait=False)
+            self._last_used.clear()
+            self._prepared.clear()
+        else:
+            if self._checkpoint_task is not None:
+                self._checkpoint_task.cancel()
+                self._checkpoint_task = None
+            async with self._lock:
+                conn, self._conn = self._conn, None
+                await conn.close()
+        logging.info("Database connection closed.")
+
+    # ---------------------------------------------------------- public API
+
+    async def execute(self, query, params=()):
+        """Runs a single write statement and commits it. Returns the row count."""
+        if self.dialect == "postgres":
+            # One statement is atomic on its own; skip the BEGIN/COMMIT round-trips.
+            async with self._slots:
+                return await self._in_thread(self._pooled, query, params, None)
+        async with self.transaction() as tx:
+            return await tx.execute(query, params)
+
+    async def executemany(self, query, seq_of_params):
+        async with self.transaction() as tx:
+            return await tx.executemany(query, seq_of_params)
+
+    async def fetchone(self, query, params=()):
+        return await self._read(query, params, "one")
+
+    async def fetchall(self, query, params=()):
+        return await self._read(query, params, "all")
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Groups several statements into one commit; rolls back on error."""
+        if self.dialect == "postgres":
+            async with self._slots:
+                conn = await self._in_thread(self._checkout)
+                broken = False
+                try:
+                    await self._in_thread(setattr, conn, "autocommit", False)
+                    yield Transaction(self, conn)
+                    await self._in_thread(conn.commit)
+                except BaseException:
+                    # A lost connection is flagged by psycopg2 (conn.closed) and
+                    # dropped on checkin; anything else just rolls back.
+                    try:
+                        await self._in_thread(conn.rollback)
+                    except psycopg2.Error:
+                        broken = True
+                    raise
+                finally:
+                    await self._in_thread(self._checkin, conn, broken)
+            return
+
+        async with self._lock:
+            try:
+                yield Transaction(self)
+            except BaseException:
+                await self._conn.rollback()
+                raise
+            await self._conn.commit()
+
+    def describe(self) -> str:
+        """One-line summary of the storage setup, shown in -status."""
+        if self.dialect == "postgres":
+            state = "🟢" if self.connected and time.monotonic() >= self._retry_at else "🔴"
+            return f"{state} PostgreSQL · pool {self.pool_size} · timeout {self.statement_timeout:g}s"
+        if not self.connected:
+            return "🔴 SQLite"
+        text = f"🟢 SQLite · {self.sqlite_profile} · {self.pragmas.get('journal_mode', '?').upper()} · synchronous={self.pragmas.get('synchronous', '?')}"
+        if self.last_checkpoint:
+            busy, wal_pages, moved = self.last_checkpoint
+            text += f" · WAL {moved}/{wal_pages} pages checkpointed"
+        return text
+
+    # ---------------------------------------------------------- sqlite profile
+
+    async def _apply_profile(self):
+        synchronous_names = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+        for pragma, value in SQLITE_PROFILES[self.sqlite_profile].items():
+            await self._conn.execute(f"PRAGMA {pragma} = {value}")
+        self.pragmas = {}
+        for pragma in SQLITE_PROFILES[self.sqlite_profile]:
+            async with self._conn.execute(f"PRAGMA {pragma}") as cursor:
+                row = await cursor.fetchone()
+            self.pragmas[pragma] = row[0] if row else None
+        self.pragmas["synchronous"] = synchronous_names.get(self.pragmas.get("synchronous"), self.pragmas.get("synchronous"))
+
+    async def checkpoint(self):
+        """Copies WAL pages back into the database without blocking readers."""
+        try:
+            wal_size = os.path.getsize(self.sqlite_path + "-wal")
+        except OSError:
+            wal_size = 0
+        mode = "TRUNCATE" if wal_size > WAL_TRUNCATE_BYTES else "PASSIVE"
+        row = await self.fetchone(f"PRAGMA wal_checkpoint({mode})")
+        self.last_checkpoint = tuple(row) if row else None
+        return self.last_checkpoint
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logging.error(f"WAL checkpoint failed: {e}")
+
+    # ---------------------------------------------------------- internals
+
+    async def _in_thread(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    async def _read(self, query, params, fetch):
+        if self.dialect == "postgres":
+            async with self._slots:
+                return await self._in_thread(self._pooled, query, params, fetch)
+        async with self._lock:
+            return await self._run(None, query, params, fetch=fetch)
+
+    async def _run(self, conn, query, params, fetch=None, many=False):
+        if self.dialect == "postgres":
+            return await self._in_thread(self._run_postgres, conn, query, params, fetch, many)
+
+        if isinstance(query, Statement):
+            query = query.sqlite
+        if many:
+            cursor = await self._conn.executemany(query, params)
+        else:
+            cursor = await self._conn.execute(query, params)
+        try:
+            if fetch == "one":
+                return await cursor.fetchone()
+            if fetch == "all":
+                return await cursor.fetchall()
+            return cursor.rowcount
+        finally:
+            await cursor.close()
+
+    async def _iterate(self, conn, query, size):
+        if self.dialect == "postgres":
+            # A named cursor keeps the result set on the server between fetches.
+            cur = conn.cursor(f"stream_{next(self._cursor_ids)}")
+            try:
+                await self._in_thread(cur.execute, query)
+                while True:
+                    rows = await self._in_thread(cur.fetchmany, size)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                await self._in_thread(cur.close)
+        else:
+            cursor = await self._conn.execute(query)
+            try:
+                while True:
+                    rows = await cursor.fetchmany(size)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                await cursor.close()
+
+    # ---------------------------------------------------------- postgres pool (worker threads)
+
+    def _run_postgres(self, conn, query, params, fetch, many):
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            if isinstance(query, Statement):
+                prepared = self._prepared.setdefault(id(conn), set())
+                if query.name not in prepared:
+                    cur.execute(f"PREPARE {query.name} AS {query.postgres}")
+                    prepared.add(query.name)
+                query = query.execute_sql
+            if many:
+                # Sends the statements in pages instead of one round-trip each.
+                psycopg2.extras.execute_batch(cur, query, params, page_size=100)
+            else:
+                cur.execute(query, params)
+            if fetch == "one":
+                return cur.fetchone()
+            if fetch == "all":
+                return cur.fetchall()
+            return cur.rowcount
+
+    def _copy_postgres(self, conn, sql, stream):
+        with conn.cursor() as cur:
+            cur.copy_expert(sql, stream, size=65536)
+            return cur.rowcount
+
+    def _pooled(self, query, params, fetch):
+        conn = self._checkout()
+        try:
+            return self._run_postgres(conn, query, params, fetch, False)
+        finally:
+            self._checkin(conn)
+
+    def _checkout(self):
+        """Hands out a live autocommit connection, replacing dead ones."""
+        for _ in range(self.pool_size + 1):
+            if time.monotonic() < self._retry_at:
+                raise DatabaseUnavailable(f"PostgreSQL unreachable, retrying in {self._retry_at - time.monotonic():.0f}s")
+            try:
+                conn = self._pool.getconn()
+            except CONNECTION_ERRORS as e:
+                self._back_off(e)
+                raise
+
+            if not conn.closed:
+                conn.autocommit = True
+                if time.monotonic() - self._last_used.get(id(conn), 0) > HEALTH_CHECK_IDLE:
+                    try:
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+                    except psycopg2.Error:
+                        conn.close()
+            if conn.closed:
+                self._checkin(conn, broken=True)
+                continue
+
+            if self._retry_delay != RECONNECT_MIN_DELAY:
+                logging.info("PostgreSQL connection restored.")
+                self._retry_delay = RECONNECT_MIN_DELAY
+            return conn
+        raise DatabaseUnavailable("No healthy PostgreSQL connection available")
+
+    def _checkin(self, conn, broken=False):
+        if conn.closed or broken:
+            self._last_used.pop(id(conn), None)
+            self._prepared.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+            return
+        conn.autocommit = True
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    def _back_off(self, error):
+        with self._reconnect_lock:
+            logging.error(f"PostgreSQL connection failed, next attempt in {self._retry_delay}s: {error}")
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, RECONNECT_MAX_DELAY)
@@ -0,0 +1,140 @@
+import asyncio
+
+from cluster import Coordinator
+from cluster_client import ClusterClient
+
+SECRET = "s3cret"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def start_cluster(workers):
+    coordinator = Coordinator(SECRET)
+    server = await asyncio.start_server(coordinator.handle, "127.0.0.1", 0)
+    address = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    clients = [ClusterClient(address, cluster_id=i, secret=SECRET) for i in range(workers)]
+    for client in clients:
+        await client.start()
+    return coordinator, server, clients
+
+
+async def stop_cluster(server, clients):
+    for client in clients:
+        await client.stop()
+    server.close()
+    await server.wait_closed()
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def test_contention_across_workers():
+    async def scenario():
+        coordinator, server, (a, b) = await start_cluster(2)
+        try:
+            token = await a.acquire("payroll")
+            waiting = asyncio.create_task(b.acquire("payroll"))
+            await settle()
+            assert not waiting.done()
+            a.release("payroll", token)
+            await asyncio.wait_for(waiting, 1)
+            assert coordinator.holders["payroll"][1] == waiting.result()
+        finally:
+            await stop_cluster(server, (a, b))
+
+    run(scenario())
+
+
+def test_contention_within_one_worker():
+    async def scenario():
+        coordinator, server, (a,) = await start_cluster(1)
+        order = []
+
+        async def job(name):
+            async with a.lock("payroll"):
+                order.append(f"{name} in")
+                await asyncio.sleep(0.05)
+                order.append(f"{name} out")
+
+        try:
+            await asyncio.wait_for(asyncio.gather(job("first"), job("second")), 2)
+            assert order == ["first in", "first out", "second in", "second out"]
+            await settle()
+            assert "payroll" not in coordinator.holders
+        finally:
+            await stop_cluster(server, (a,))
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_holder_and_other_waiters_alone():
+    async def scenario():
+        coordinator, server, (a, b) = await start_cluster(2)
+        try:
+            token = await a.acquire("blacklist")
+            cancelled = asyncio.create_task(a.acquire("blacklist"))
+            other = asyncio.create_task(a.acquire("blacklist"))
+            remote = asyncio.create_task(b.acquire("blacklist"))
+            await settle()
+            cancelled.cancel()
+            await settle()
+            # The first coroutine still holds it; nobody else got in.
+            assert coordinator.holders["blacklist"][1] == token
+            assert not other.done() and not remote.done()
+
+            a.release("blacklist", token)
+            second = await asyncio.wait_for(other, 1)
+            await settle()
+            assert not remote.done()
+            a.release("blacklist", second)
+            b.release("blacklist", await asyncio.wait_for(remote, 1))
+            await settle()
+            assert "blacklist" not in coordinator.holders
+        finally:
+            await stop_cluster(server, (a, b))
+
+    run(scenario())
+
+
+def test_stray_release_does_not_free_the_lock():
+    async def scenario():
+        coordinator, server, (a, b) = await start_cluster(2)
+        try:
+            token = await a.acquire("payroll")
+            waiting = asyncio.create_task(b.acquire("payroll"))
+            await settle()
+            a.release("payroll", token + 100)
+            b.release("payroll", token + 200)
+            await settle()
+            assert coordinator.holders["payroll"][1] == token
+            assert not waiting.done()
+            a.release("payroll", token)
+            await asyncio.wait_for(waiting, 1)
+        finally:
+            await stop_cluster(server, (a, b))
+
+    run(scenario())
+
+
+def test_disconnect_hands_the_lock_on():
+    async def scenario():
+        coordinator, server, (a, b, c) = await start_cluster(3)
+        try:
+            await a.acquire("payroll")
+            queued = asyncio.create_task(a.acquire("payroll"))
+            waiting = asyncio.create_task(b.acquire("payroll"))
+            await settle()
+            await a.stop()
+            await asyncio.wait_for(waiting, 1)
+            assert isinstance(queued.exception(), ConnectionError)
+            # a's queued request went with its connection.
+            assert list(coordinator.waiters.get("payroll", ())) == []
+            b.release("payroll", waiting.result())
+            await asyncio.wait_for(c.acquire("payroll"), 1)
+        finally:
+            await stop_cluster(server, (b, c))
+
+    run(scenario())
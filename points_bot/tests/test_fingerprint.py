@@ -0,0 +1,53 @@
+from fingerprint import BITS, distance, near_duplicate, normalize, simhash
+
+# The anti-farm threshold bot.py uses (SPAM_MAX_DISTANCE).
+MAX_DISTANCE = 10
+
+MESSAGE = "anyone want to team up for the tournament this weekend, we need two more players for the squad"
+
+
+def test_normalize_drops_case_punctuation_spacing_and_repeats():
+    assert normalize("HeLLooo,  World!!") == "heloworld"
+    # Harakat and tatweel.
+    assert normalize("مَرْحَبـــا") == "مرحبا"
+    assert len(normalize("abc" * 1000)) == 1000
+
+
+def test_fingerprint_is_stable_and_64_bit():
+    assert simhash(MESSAGE) == simhash(MESSAGE)
+    assert 0 <= simhash(MESSAGE) < 2 ** BITS
+    assert simhash("") == simhash("!!!")
+
+
+def test_cosmetic_variants_are_identical():
+    shouted = "ANYONE want to team up for the tournament this weekend!!! we need two more players for the squad"
+    stretched = MESSAGE.replace("anyone", "anyoneeee")
+    assert distance(simhash(MESSAGE), simhash(shouted)) == 0
+    assert distance(simhash(MESSAGE), simhash(stretched)) == 0
+    arabic = "السلام عليكم ورحمة الله وبركاته يا شباب"
+    assert distance(simhash(arabic), simhash(arabic + "!!")) == 0
+
+
+def test_small_additions_stay_within_the_threshold():
+    assert distance(simhash(MESSAGE), simhash(MESSAGE + " please")) <= MAX_DISTANCE
+
+
+def test_unrelated_messages_are_far_apart():
+    others = [
+        "meeting moved to thursday afternoon at five",
+        "كيف حالكم اليوم يا جماعة الخير",
+        "what time does the event start tonight",
+    ]
+    for other in others:
+        assert distance(simhash(MESSAGE), simhash(other)) > 2 * MAX_DISTANCE
+
+
+def test_near_duplicate_threshold_is_inclusive():
+    fingerprint = 0
+    at_limit = (1 << MAX_DISTANCE) - 1  # MAX_DISTANCE bits set
+    past_limit = (1 << (MAX_DISTANCE + 1)) - 1
+    assert distance(fingerprint, at_limit) == MAX_DISTANCE
+    assert near_duplicate(fingerprint, [at_limit], MAX_DISTANCE)
+    assert not near_duplicate(fingerprint, [past_limit], MAX_DISTANCE)
+    assert near_duplicate(fingerprint, [past_limit, at_limit], MAX_DISTANCE)
+    assert not near_duplicate(fingerprint, [], MAX_DISTANCE)
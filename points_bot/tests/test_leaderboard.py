@@ -0,0 +1,135 @@
+import random
+
+import pytest
+
+from leaderboard import Leaderboard, RankedList
+
+
+def expected_order(scores):
+    """(rank, user_id, points) rows in leaderboard order, computed naively."""
+    ordered = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+    return [(rank, user_id, points) for rank, (user_id, points) in enumerate(ordered, start=1)]
+
+
+def test_ranked_list_index_and_slice_match_a_sorted_list():
+    rng = random.Random(1)
+    ranked = RankedList()
+    keys = []
+    for _ in range(500):
+        key = rng.randrange(10_000)
+        if key in keys:
+            continue
+        ranked.insert(key)
+        keys.append(key)
+    keys.sort()
+    assert len(ranked) == len(keys)
+    assert ranked.slice(0, len(keys)) == keys
+    for position, key in enumerate(keys):
+        assert ranked.index(key) == position
+        assert ranked.index_after(key) == position + 1
+    assert ranked.slice(100, 110) == keys[100:110]
+    assert ranked.slice(len(keys) - 3, len(keys) + 5) == keys[-3:]
+    assert ranked.slice(50, 50) == []
+
+
+def test_ranked_list_remove():
+    ranked = RankedList(range(100))
+    for key in range(0, 100, 3):
+        ranked.remove(key)
+    remaining = [key for key in range(100) if key % 3]
+    assert len(ranked) == len(remaining)
+    assert ranked.slice(0, 100) == remaining
+    assert ranked.index(50) == remaining.index(50)
+    with pytest.raises(KeyError):
+        ranked.remove(3)
+
+
+def test_rank_and_pages_follow_inserts_and_updates():
+    rng = random.Random(7)
+    board = Leaderboard()
+    scores = {}
+    board.load([])
+    for _ in range(2000):
+        user_id = rng.randrange(300)
+        if rng.random() < 0.5:
+            points = rng.randrange(1000)
+            board.set(user_id, points)
+            scores[user_id] = points
+        else:
+            delta = rng.randrange(-50, 50)
+            board.add(user_id, delta)
+            scores[user_id] = scores.get(user_id, 0) + delta
+
+    rows = expected_order(scores)
+    assert len(board) == len(scores)
+    assert board.top(len(rows)) == rows
+    for rank, user_id, points in rows:
+        assert board.rank(user_id) == rank
+        assert board.points(user_id) == points
+    assert board.top(10, offset=25) == rows[25:35]
+
+
+def test_load_replaces_the_board():
+    board = Leaderboard()
+    board.set(1, 10)
+    board.load([(2, 5), (3, 7)])
+    assert 1 not in board
+    assert board.top() == [(1, 3, 7), (2, 2, 5)]
+
+
+def test_ties_are_broken_by_higher_user_id_first():
+    board = Leaderboard()
+    board.load([(1, 50), (2, 50), (3, 60)])
+    assert [user_id for _, user_id, _ in board.top()] == [3, 2, 1]
+
+
+def test_keyset_pages_walk_the_whole_board():
+    board = Leaderboard()
+    scores = {user_id: (user_id * 37) % 101 for user_id in range(1, 58)}
+    board.load(scores.items())
+    rows = expected_order(scores)
+
+    pages = []
+    page = board.page_after(None, 10)
+    while page:
+        pages.append(page)
+        _, user_id, points = page[-1]
+        page = board.page_after((points, user_id), 10)
+    assert [row for page in pages for row in page] == rows
+
+    _, user_id, points = pages[2][0]
+    assert board.page_before((points, user_id), 10) == pages[1]
+
+
+def test_around_and_top_among():
+    board = Leaderboard()
+    board.load((user_id, user_id * 10) for user_id in range(1, 21))
+    # User 15 is ranked 6th (20..16 are above).
+    assert board.around(15, radius=2) == [(4, 17, 170), (5, 16, 160), (6, 15, 150), (7, 14, 140), (8, 13, 130)]
+    assert board.around(20, radius=1) == [(1, 20, 200), (2, 19, 190)]
+    assert board.around(99) == []
+    assert board.top_among([3, 7, 12, 99], limit=2) == [(1, 12, 120), (2, 7, 70)]
+
+
+def test_page_cache_is_invalidated_by_score_moves_in_range():
+    board = Leaderboard()
+    board.load((user_id, user_id) for user_id in range(1, 31))
+    first = board.page_after(None, 10)
+    second = board.page_after((first[-1][2], first[-1][1]), 10)
+    for rows in (first, second):
+        board.pages.put("g", *board.page_bounds(rows, 10), rows)
+
+    # 25 -> 26 points stays inside the first page.
+    board.set(25, 26)
+    assert board.pages.get("g", *board.page_bounds(first, 10)) is None
+    assert board.pages.get("g", *board.page_bounds(second, 10)) == second
+
+
+def test_resync_reports_users_set_during_the_read():
+    board = Leaderboard()
+    board.load([(1, 10), (2, 20)])
+    board.begin_resync()
+    board.set(1, 15)
+    board.add(2, 1)  # Buffered deltas are read by the resync itself.
+    assert board.load([(1, 10), (2, 21)]) == {1}
+    assert board.end_resync() == set()
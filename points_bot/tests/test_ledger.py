@@ -0,0 +1,141 @@
+import asyncio
+
+import repository
+from migrations import migrate
+from points_buffer import PointsBuffer
+from storage import Database
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_db(path):
+    db = Database(None, sqlite_path=str(path))
+    await db.connect()
+    return db
+
+
+async def ledger_sums(db):
+    rows = await db.fetchall("SELECT user_id, SUM(delta) AS points FROM points_ledger GROUP BY user_id")
+    return {row["user_id"]: row["points"] for row in rows}
+
+
+async def snapshot(db):
+    return {row["user_id"]: row["points"] for row in await db.fetchall("SELECT user_id, points FROM points")}
+
+
+async def watermark(db):
+    return (await db.fetchone("SELECT last_id FROM ledger_watermark WHERE id = 1"))["last_id"]
+
+
+def test_migration_seeds_opening_balances_once(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path / "points.db")
+        try:
+            # A database from before the ledger: totals only.
+            await db.execute("CREATE TABLE points (user_id BIGINT PRIMARY KEY, points INTEGER DEFAULT 0)")
+            await db.executemany("INSERT INTO points (user_id, points) VALUES (?, ?)", [(1, 50), (2, 0), (3, -5)])
+            await migrate(db)
+
+            entries = await db.fetchall("SELECT user_id, delta, source FROM points_ledger ORDER BY user_id")
+            assert [tuple(row) for row in entries] == [(1, 50, "migration"), (3, -5, "migration")]
+            # Already folded: the opening balances sit below the watermark.
+            assert await watermark(db) == (await db.fetchone("SELECT MAX(id) AS id FROM points_ledger"))["id"]
+            assert [await repository.get_points(db, user_id) for user_id in (1, 2, 3)] == [50, 0, -5]
+
+            # Running the step again (two bots migrating at once) seeds nothing new.
+            await db.execute("DELETE FROM schema_version WHERE version >= 4")
+            await migrate(db)
+            assert (await db.fetchone("SELECT COUNT(*) AS n FROM points_ledger"))["n"] == 2
+            assert await repository.get_points(db, 1) == 50
+        finally:
+            await db.close()
+
+    run(scenario())
+
+
+def test_flush_and_compaction_keep_totals_exact(tmp_path, monkeypatch):
+    async def scenario():
+        db = await open_db(tmp_path / "points.db")
+        await migrate(db)
+        buffer = PointsBuffer(db)
+        flushed = []
+        buffer.on_flush = flushed.append
+        try:
+            buffer.add_points(1, 5)
+            buffer.add_points(1, 3)
+            buffer.add_points(2, -2)
+            assert await buffer.read_points(1) == 8
+            assert await repository.get_points(db, 1) == 0
+
+            await buffer.flush()
+            assert buffer.pending_points() == {}
+            assert sorted(flushed[0]) == [1, 2]
+            assert await repository.get_points(db, 1) == 8
+            assert await snapshot(db) == {}
+
+            assert await buffer.compact() == 2
+            assert await snapshot(db) == {1: 8, 2: -2}
+            assert await buffer.compact() == 0
+
+            # Above the watermark again: snapshot plus the unfolded entries.
+            buffer.add_points(1, 10)
+            await buffer.flush()
+            assert await repository.get_points(db, 1) == 18
+            assert await repository.points_for_users(db, [1, 2, 3]) == {1: 18, 2: -2}
+            totals = [total async for total in repository.iter_totals(db)]
+            assert sorted(totals) == [(1, 18), (2, -2)]
+
+            # A failed flush keeps the deltas pending instead of losing them.
+            async def broken(tx, entries):
+                raise RuntimeError("disk full")
+
+            monkeypatch.setattr(repository, "append_ledger", broken)
+            buffer.add_points(2, 4)
+            await buffer.flush()
+            assert buffer.pending_points() == {2: 4}
+            assert await buffer.read_points(2) == 2
+            monkeypatch.undo()
+            await buffer.flush()
+            await buffer.compact()
+            assert await snapshot(db) == await ledger_sums(db) == {1: 18, 2: 2}
+        finally:
+            await db.close()
+
+    run(scenario())
+
+
+def test_rebuild_points_and_balance_at_replay_the_ledger(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path / "points.db")
+        await migrate(db)
+        try:
+            await repository.append_ledger(db, [
+                (1, 10, None, "chat", 100.0),
+                (2, 7, "bonus", "admin", 150.0),
+                (1, -4, "penalty", "admin", 200.0),
+            ])
+            async with db.transaction() as tx:
+                await repository.compact_ledger(tx, now=250.0)
+            await repository.append_ledger(db, [(1, 6, None, "chat", 300.0)])
+
+            # A bad manual edit of the snapshot.
+            await db.execute("UPDATE points SET points = 999 WHERE user_id = 1")
+            await db.execute("INSERT INTO points (user_id, points) VALUES (3, 5)")
+            async with db.transaction() as tx:
+                await repository.rebuild_points(tx)
+            # Only entries up to the watermark are folded; the last one stays above it.
+            assert await snapshot(db) == {1: 6, 2: 7}
+            assert await repository.get_points(db, 1) == 12
+            assert await repository.get_points(db, 3) == 0
+            assert (await ledger_sums(db))[1] == 12
+
+            assert [await repository.balance_at(db, 1, when) for when in (50, 100, 199, 200, 300)] == [0, 10, 10, 6, 12]
+            assert await repository.balance_at(db, 2, 149.9) == 0
+            history = await repository.ledger_history(db, 1, limit=2)
+            assert [row["delta"] for row in history] == [6, -4]
+        finally:
+            await db.close()
+
+    run(scenario())
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from live_migration import LiveMigration, finish_migration
+from migrations import migrate
+from storage import Database
+
+TRIGGERS = "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'capture_%'"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_db(path):
+    db = Database(None, sqlite_path=str(path))
+    await db.connect()
+    await migrate(db)
+    return db
+
+
+async def seed(db, users):
+    await db.executemany("INSERT INTO points (user_id, points) VALUES (?, ?)", [(i, i * 10) for i in range(1, users + 1)])
+    await db.executemany(
+        "INSERT INTO points_ledger (user_id, delta, reason, source, created_at) VALUES (?, ?, 'chat', 'chat', 0)",
+        [(i, 1) for i in range(1, users + 1)],
+    )
+    await db.execute("INSERT INTO blacklist (user_id, reason, end_date) VALUES (7, 'spam', 100.5)")
+
+
+async def rows(db, sql):
+    return [tuple(row) for row in await db.fetchall(sql)]
+
+
+def test_copy_replay_and_verify(tmp_path):
+    async def scenario():
+        source = await open_db(tmp_path / "source.db")
+        target = await open_db(tmp_path / "target.db")
+        await seed(source, 2500)
+
+        async def on_progress(text):
+            # Writes landing while later tables are still being copied.
+            if text.startswith("points:"):
+                await source.execute("UPDATE points SET points = points + 5 WHERE user_id = 3")
+                await source.execute("DELETE FROM points WHERE user_id = 4")
+                await source.execute("INSERT INTO points (user_id, points) VALUES (9999, 1)")
+                await source.execute("DELETE FROM blacklist WHERE user_id = 7")
+
+        ok, report = await LiveMigration(source, target, batch_size=400, on_progress=on_progress).run()
+        assert ok
+        assert all(match and a == b for a, b, match in report.values())
+        assert await rows(target, "SELECT user_id, points FROM points ORDER BY user_id") == \
+            await rows(source, "SELECT user_id, points FROM points ORDER BY user_id")
+        assert await rows(target, "SELECT * FROM blacklist") == []
+        # Verified: capture stays on until the Postgres side finishes at startup.
+        assert len(await rows(source, TRIGGERS)) == 24
+
+        await source.execute("UPDATE points SET points = 0 WHERE user_id = 1")
+        await source.close()
+        applied = await finish_migration(str(tmp_path / "source.db"), target)
+        assert applied == 1
+        assert await rows(target, "SELECT points FROM points WHERE user_id = 1") == [(0,)]
+        assert await finish_migration(str(tmp_path / "source.db"), target) is None
+
+        source = await open_db(tmp_path / "source.db")
+        try:
+            assert await rows(source, TRIGGERS) == []
+        finally:
+            await source.close()
+            await target.close()
+
+    run(scenario())
+
+
+def test_failed_verification_removes_capture(tmp_path):
+    async def scenario():
+        source = await open_db(tmp_path / "source.db")
+        target = await open_db(tmp_path / "target.db")
+        await seed(source, 10)
+        # A row only the target has: copying never deletes it.
+        await target.execute("INSERT INTO config (guild_id, points_channel) VALUES (1, 2)")
+        try:
+            ok, report = await LiveMigration(source, target).run()
+            assert not ok
+            assert report["config"][:2] == (0, 1)
+            assert await rows(source, TRIGGERS) == []
+            assert await rows(source, "SELECT name FROM sqlite_master WHERE name = 'migration_changes'") == []
+        finally:
+            await source.close()
+            await target.close()
+
+    run(scenario())
+
+
+def test_failed_copy_removes_capture(tmp_path):
+    async def scenario():
+        source = await open_db(tmp_path / "source.db")
+        target = await open_db(tmp_path / "target.db")
+        await seed(source, 10)
+
+        async def broken(query, seq_of_params):
+            raise ConnectionError("target went away")
+
+        target.executemany = broken
+        try:
+            with pytest.raises(ConnectionError):
+                await LiveMigration(source, target).run()
+            assert await rows(source, TRIGGERS) == []
+        finally:
+            await source.close()
+            await target.close()
+
+    run(scenario())
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+import payroll
+
+SALARIES = {10: 150, 20: 100, 30: 45}
+
+
+def guild(role_ids, members):
+    roles = {role_id: SimpleNamespace(id=role_id) for role_id in role_ids}
+    return SimpleNamespace(members=members, get_role=roles.get)
+
+
+def member(user_id, role_ids, bot=False):
+    return SimpleNamespace(id=user_id, bot=bot, _roles=list(role_ids))
+
+
+def test_collect_staff_pays_the_best_role_once():
+    first = guild([10, 20, 30], [member(1, [30, 99]), member(2, [20, 10]), member(3, [99]), member(4, [10], bot=True)])
+    # User 1 again in another guild, with a better role; role 20 is missing there.
+    second = guild([10, 30], [member(1, [10]), member(5, [20])])
+    staff = payroll.collect_staff([first, second], SALARIES)
+    assert {user_id: (role.id, amount) for user_id, (_, role, amount) in staff.items()} == {1: (10, 150), 2: (10, 150)}
+
+
+def test_split_due():
+    staff = {1: None, 2: None, 3: None}
+    due, upcoming = payroll.split_due(staff, {2: 950, 3: 500}, now=1000, cooldown=100)
+    assert sorted(due) == [1, 3]
+    assert upcoming == 1050
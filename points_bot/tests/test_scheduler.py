@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+from scheduler import Scheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_jobs_fire_in_due_order():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def job(name):
+            fired.append(name)
+
+        now = time.time()
+        scheduler.schedule("b", now + 0.10, job, "b")
+        scheduler.schedule("a", now + 0.05, job, "a")
+        scheduler.schedule("overdue", now - 10, job, "overdue")
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+        return fired, len(scheduler)
+
+    assert run(scenario()) == (["overdue", "a", "b"], 0)
+
+
+def test_reschedule_replaces_the_pending_job():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def job(value):
+            fired.append((value, time.time()))
+
+        start = time.time()
+        scheduler.schedule("k", start + 0.05, job, "first")
+        scheduler.schedule("k", start + 0.15, job, "second")
+        assert len(scheduler) == 1
+        assert scheduler.due("k") == start + 0.15
+        scheduler.start()
+        await asyncio.sleep(0.25)
+        await scheduler.stop()
+        return start, fired
+
+    start, fired = run(scenario())
+    assert [value for value, _ in fired] == ["second"]
+    assert fired[0][1] - start >= 0.15
+
+
+def test_cancel_skips_the_job():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def job(value):
+            fired.append(value)
+
+        now = time.time()
+        scheduler.schedule("keep", now + 0.05, job, "keep")
+        scheduler.schedule("drop", now + 0.05, job, "drop")
+        scheduler.cancel("drop")
+        scheduler.cancel("unknown")
+        assert "drop" not in scheduler and scheduler.due("drop") is None
+        scheduler.start()
+        await asyncio.sleep(0.15)
+        await scheduler.stop()
+        return fired
+
+    assert run(scenario()) == ["keep"]
+
+
+def test_an_earlier_job_wakes_a_sleeping_scheduler():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def job(value):
+            fired.append(value)
+
+        scheduler.schedule("late", time.time() + 60, job, "late")
+        scheduler.start()
+        await asyncio.sleep(0.02)
+        scheduler.schedule("soon", time.time() + 0.02, job, "soon")
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return fired, scheduler.due("late") is not None
+
+    assert run(scenario()) == (["soon"], True)
+
+
+def test_a_failing_job_does_not_stop_the_scheduler():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def boom():
+            raise RuntimeError("boom")
+
+        async def job():
+            fired.append("ok")
+
+        now = time.time()
+        scheduler.schedule("boom", now, boom)
+        scheduler.schedule("ok", now + 0.02, job)
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return fired
+
+    assert run(scenario()) == ["ok"]
+
+
+def test_cancelled_entries_are_compacted():
+    async def noop():
+        pass
+
+    scheduler = Scheduler()
+    due = time.time() + 3600
+    for i in range(500):
+        scheduler.schedule(i, due, noop)
+        scheduler.cancel(i)
+    scheduler.schedule("live", due, noop)
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 65
+
+
+def test_a_slow_job_does_not_delay_the_next_one():
+    async def scenario():
+        scheduler = Scheduler()
+        fired = []
+
+        async def slow():
+            await asyncio.sleep(0.5)
+            fired.append("slow")
+
+        async def job():
+            fired.append("fast")
+
+        now = time.time()
+        scheduler.schedule("slow", now, slow)
+        scheduler.schedule("fast", now + 0.02, job)
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return fired
+
+    # The slow job is still running at stop(), which cancels it.
+    assert run(scenario()) == ["fast"]
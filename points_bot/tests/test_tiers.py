@@ -0,0 +1,48 @@
+import pytest
+
+from tiers import TierTable
+
+TABLE = TierTable({"bronze": 100, "silver": 500, "gold": 2000, "starter": 1})
+
+
+@pytest.mark.parametrize("points, role", [
+    (-5, None),
+    (0, None),
+    (1, "starter"),
+    (99, "starter"),
+    (100, "bronze"),
+    (499, "bronze"),
+    (500, "silver"),
+    (1999, "silver"),
+    (2000, "gold"),
+    (10 ** 9, "gold"),
+])
+def test_role_for_uses_inclusive_thresholds(points, role):
+    assert TABLE.role_for(points) == role
+
+
+def test_table_is_sorted_regardless_of_input_order():
+    assert TABLE.thresholds == [1, 100, 500, 2000]
+    assert TABLE.role_ids == ["starter", "bronze", "silver", "gold"]
+    assert TABLE.all_role_ids == {"starter", "bronze", "silver", "gold"}
+
+
+def test_next_tier():
+    assert TABLE.next_tier(0) == ("starter", 1)
+    assert TABLE.next_tier(99) == ("bronze", 100)
+    assert TABLE.next_tier(100) == ("silver", 500)
+    assert TABLE.next_tier(2000) is None
+
+
+def test_same_tier_only_changes_at_a_threshold():
+    assert TABLE.same_tier(100, 499)
+    assert not TABLE.same_tier(499, 500)
+    assert not TABLE.same_tier(500, 499)
+    assert TABLE.same_tier(-10, 0)
+    assert not TABLE.same_tier(0, 1)
+
+
+def test_empty_table():
+    empty = TierTable({})
+    assert empty.role_for(100) is None
+    assert empty.next_tier(0) is None
@@ -0,0 +1,55 @@
+from ttl_store import TTLStore
+
+
+def test_entries_expire_after_ttl():
+    store = TTLStore(ttl=30)
+    store.set("a", 1, now=100)
+    assert store.get("a", now=100) == 1
+    assert store.get("a", now=129.9) == 1
+    assert store.get("a", now=130) is None
+    assert store.get("missing", now=100) is None
+
+
+def test_setting_again_restarts_the_ttl():
+    store = TTLStore(ttl=30)
+    store.set("a", 1, now=100)
+    store.set("a", 2, now=120)
+    assert store.get("a", now=140) == 2
+    assert store.get("a", now=150) is None
+
+
+def test_writes_evict_expired_entries():
+    store = TTLStore(ttl=10)
+    for i in range(5):
+        store.set(i, i, now=100 + i)
+    store.set("late", 0, now=112)
+    # Entries set at 100, 101 and 102 are older than 10s at 112.
+    assert len(store) == 3
+    assert [key for key, _, _ in store.items(now=112)] == [3, 4, "late"]
+
+
+def test_size_cap_drops_the_oldest():
+    store = TTLStore(ttl=100, max_entries=3)
+    for i in range(5):
+        store.set(i, i, now=i)
+    assert len(store) == 3
+    assert store.get(0, now=5) is None
+    assert store.get(4, now=5) == 4
+
+
+def test_items_skips_stale_entries():
+    store = TTLStore(ttl=10)
+    store.set("old", 1, now=100)
+    store.set("new", 2, now=105)
+    assert store.items(now=112) == [("new", 105, 2)]
+
+
+def test_load_keeps_live_entries_in_expiry_order():
+    store = TTLStore(ttl=10)
+    store.set("live", 0, now=108)
+    store.load([("b", 104, "b"), ("stale", 90, "x"), ("a", 102, "a"), ("live", 101, "old")], now=109)
+    assert store.get("stale", now=109) is None
+    # A key already set since startup wins over its snapshot.
+    assert store.get("live", now=109) == 0
+    assert [key for key, _, _ in store.items(now=109)] == ["a", "b", "live"]
+    assert [key for key, _, _ in store.items(now=113)] == ["b", "live"]
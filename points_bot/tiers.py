@@ -0,0 +1,34 @@
+"""Point thresholds for the auto-assigned level roles.
+
+The thresholds are sorted once, so finding a member's tier is a single
+bisect instead of a sort per call. `check_auto_roles` and `-level` share one
+table, and comparing tier indexes tells whether a point change crossed a
+threshold at all.
+"""
+from bisect import bisect_right
+
+
+class TierTable:
+    def __init__(self, xp_for_roles: dict):
+        """`xp_for_roles` maps role id -> points required."""
+        pairs = sorted((xp, role_id) for role_id, xp in xp_for_roles.items())
+        self.thresholds = [xp for xp, _ in pairs]
+        self.role_ids = [role_id for _, role_id in pairs]
+        self.all_role_ids = frozenset(self.role_ids)
+
+    def index(self, points: int) -> int:
+        """Position of the highest tier reached, or -1 below the first threshold."""
+        return bisect_right(self.thresholds, points) - 1
+
+    def role_for(self, points: int):
+        """Role id of the tier for `points`, or None."""
+        i = self.index(points)
+        return self.role_ids[i] if i >= 0 else None
+
+    def next_tier(self, points: int):
+        """(role id, points required) of the next tier up, or None at the top."""
+        i = self.index(points) + 1
+        return (self.role_ids[i], self.thresholds[i]) if i < len(self.thresholds) else None
+
+    def same_tier(self, before: int, after: int) -> bool:
+        return self.index(before) == self.index(after)
@@ -0,0 +1,62 @@
+"""Bounded in-memory map whose entries expire a fixed time after being set.
+
+Backs the per-message anti-farm and chat-cooldown checks, whose state is only
+meaningful for a few seconds. Entries are kept in the order they were last
+set, which with a single TTL is also expiry order, so every write evicts
+expired entries from the front in amortised O(1) and lookups are a dict hit.
+The size cap drops the oldest entries first.
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLStore:
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (set_at, value), oldest first.
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """The value set for `key` within the last `ttl` seconds, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if now - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key, value, now=None):
+        now = time.time() if now is None else now
+        self._entries.pop(key, None)
+        self._entries[key] = (now, value)
+        self._evict(now)
+
+    def items(self, now=None):
+        """[(key, set_at, value)] for live entries, oldest first."""
+        now = time.time() if now is None else now
+        self._evict(now)
+        return [(key, set_at, value) for key, (set_at, value) in self._entries.items() if now - set_at < self.ttl]
+
+    def load(self, entries, now=None):
+        """Adds (key, set_at, value) entries, e.g. from a snapshot; stale ones are skipped."""
+        now = time.time() if now is None else now
+        for key, set_at, value in sorted(entries, key=lambda entry: entry[1]):
+            if now - set_at < self.ttl and key not in self._entries:
+                self._entries[key] = (set_at, value)
+        # Loaded entries are older than anything set since startup.
+        for key in sorted(self._entries, key=lambda k: self._entries[k][0]):
+            self._entries.move_to_end(key)
+        self._evict(now)
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            key, (set_at, _) = next(iter(entries.items()))
+            if now - set_at < self.ttl and len(entries) <= self.max_entries:
+                return
+            del entries[key]